@@ -0,0 +1,146 @@
+#jfr
+#admission control for generation requests, per API key and model.
+#every room without a custom key shares the server key, so the requests/minute and tokens/minute quota of that key
+#is shared too. Requests are only sent while the key has room left in its sliding one minute window,
+#everything else waits in line (fairly across rooms) instead of hitting the API and failing with 429/503.
+#NOTE: the window lives in this process, with several server workers each one should be given its share of the limits.
+import hashlib, threading, time
+from collections import deque
+
+WINDOW = 60                     #seconds the request and token limits are measured over
+POLL_INTERVAL = 0.25            #seconds between checks while a request waits in line
+EXPECTED_OUTPUT_TOKENS = 1500   #output tokens reserved per generation until the real usage is known
+#requests and tokens per minute for each model (Gemini paid tier 1), see GAOL_RPM_LIMIT and GAOL_TPM_LIMIT
+MODEL_LIMITS = {
+    'gemini-2.5-flash-lite': (4000, 4000000),
+    'gemini-2.5-flash': (1000, 1000000),
+    'gemini-2.5-pro': (150, 2000000)
+}
+DEFAULT_LIMITS = (1000, 1000000)
+
+def key_id(api_key):
+    return hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:16]
+
+# Ticket class
+# One request's place in line, and once admitted its entry in the key's window
+class Ticket:
+    def __init__(self, room_id, tokens):
+        self.room_id = room_id
+        self.tokens = tokens        #tokens reserved in the window, replaced by the real count in settle()
+        self.arrived = time.time()
+        self.waited = 0.0           #seconds spent in line before being admitted
+        self.entry = None           #[timestamp, tokens, room id] in the window log once admitted
+        self.window = None
+
+# KeyWindow class
+# The sliding window of one (API key, model): every admitted request in the last WINDOW seconds and the line waiting for it.
+class KeyWindow:
+    def __init__(self, label, rpm, tpm):
+        self.label = label          #last characters of the key and the model, for the logs
+        self.rpm = rpm
+        self.tpm = tpm
+        self.log = deque()          #[timestamp, tokens, room id] of every admitted request, oldest first
+        self.tokens = 0             #sum of the tokens in the log
+        self.waiting = []           #tickets in line, in arrival order
+        self.blocked_until = 0.0    #set when the API reports overload, nothing is admitted before this time
+
+    def expire(self, now):
+        while self.log and now - self.log[0][0] >= WINDOW:
+            self.tokens -= self.log.popleft()[1]
+
+    def fits(self, now, tokens):
+        if now < self.blocked_until:
+            return False
+        if len(self.log) >= self.rpm:
+            return False
+        #a request bigger than the whole limit only has to wait for an empty window
+        return self.tokens + tokens <= self.tpm or not self.log
+
+    #the line in serving order: rooms that were served least in this window go first, then first come first served.
+    #a room sending many requests can't push the other rooms back, it only moves itself back.
+    def queue_order(self):
+        served = {}
+        for _, _, room_id in self.log:
+            served[room_id] = served.get(room_id, 0) + 1
+        return sorted(self.waiting, key=lambda t: (served.get(t.room_id, 0), t.arrived))
+
+# AdmissionController class
+# Hands out tickets per (API key, model). acquire() blocks (with the given sleep, socketio.sleep in the server)
+# until the request may be sent, settle() corrects the reservation once usage_metadata arrives.
+class AdmissionController:
+    def __init__(self, limits=None, default_limits=DEFAULT_LIMITS, sleep=time.sleep):
+        self.limits = dict(MODEL_LIMITS if limits is None else limits)
+        self.default_limits = default_limits
+        self.sleep = sleep
+        self.windows = {}           #(key id, model) -> KeyWindow
+        self.lock = threading.Lock()
+
+    def _window(self, api_key, model):
+        k = (key_id(api_key), model)
+        window = self.windows.get(k)
+        if window is None:
+            rpm, tpm = self.limits.get(model, self.default_limits)
+            window = KeyWindow(f"...{(api_key or '')[-4:]} {model}", rpm, tpm)
+            self.windows[k] = window
+        return window
+
+    #waits until the key has room for the request, on_wait(position) is called whenever its place in line changes
+    def acquire(self, api_key, model, room_id, tokens, on_wait=None):
+        ticket = Ticket(room_id, tokens)
+        with self.lock:
+            window = self._window(api_key, model)
+            window.waiting.append(ticket)
+        last_position = None
+        try:
+            while True:
+                with self.lock:
+                    now = time.time()
+                    window.expire(now)
+                    order = window.queue_order()
+                    if order[0] is ticket and window.fits(now, tokens):
+                        window.waiting.remove(ticket)
+                        ticket.entry = [now, tokens, room_id]
+                        ticket.window = window
+                        ticket.waited = now - ticket.arrived
+                        window.log.append(ticket.entry)
+                        window.tokens += tokens
+                        if ticket.waited > 1:
+                            print(f"[ADMISSION] {room_id} admitted on {window.label} after {ticket.waited:.1f}s in line.")
+                        return ticket
+                    position = order.index(ticket) + 1
+                if position != last_position:
+                    last_position = position
+                    print(f"[ADMISSION] {room_id} is #{position} in line for {window.label}.")
+                    if on_wait:
+                        on_wait(position)
+                self.sleep(POLL_INTERVAL)
+        finally:
+            if ticket.entry is None: #gave up (the task was killed), don't hold the line
+                with self.lock:
+                    if ticket in window.waiting:
+                        window.waiting.remove(ticket)
+
+    #replaces the reserved tokens with what the request actually used
+    def settle(self, ticket, tokens):
+        if ticket.entry is None or tokens is None:
+            return
+        with self.lock:
+            #the entry may already have left the window, then there is nothing left to correct
+            if ticket.window.log and ticket.entry[0] >= ticket.window.log[0][0]:
+                ticket.window.tokens += tokens - ticket.entry[1]
+            ticket.entry[1] = tokens
+            ticket.tokens = tokens
+
+    #the API said the key or model is overloaded, hold the whole line for a while instead of retrying blindly
+    def throttle(self, api_key, model, seconds):
+        with self.lock:
+            window = self._window(api_key, model)
+            window.blocked_until = max(window.blocked_until, time.time() + seconds)
+        print(f"[ADMISSION] Holding requests on {window.label} for {seconds}s.")
+
+    #current load of a key, for the logs
+    def describe(self, api_key, model):
+        with self.lock:
+            window = self._window(api_key, model)
+            window.expire(time.time())
+            return f"{window.label}: {len(window.log)}/{window.rpm} RPM | {window.tokens}/{window.tpm} TPM | {len(window.waiting)} waiting"
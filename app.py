@@ -11,12 +11,26 @@
 #5. Personal Worlds
 
 print("------------------------------ GAOL v1.7 ------------------------------")
-import                     os, json, time, re, traceback
-from google         import genai
+import                     os, json, time, re, traceback, atexit, functools, platform, uuid, threading
+from contextlib     import contextmanager, nullcontext
 from flask_cors     import CORS
 from dotenv         import load_dotenv
 from google.genai   import types, errors
 from classes        import World, Player, GameRoom
+from storage        import WorldStore, WorldRegistry, WriteBehindScheduler, write_json_atomic
+from audit          import AuditLog
+from relevance      import RelevanceEngine
+from prompting      import PromptPacker, input_budget_for, estimate_tokens, CHARS_PER_TOKEN
+from highlight      import highlight_story
+from context_cache  import ContextCache, BACKENDS as CACHE_BACKENDS
+from state_backend  import open_state_backend
+from concurrency    import RoomRegistry
+from timers         import ExpiryHeap
+from lobby          import LobbyIndex, ROOM_CAPACITY, parse_filters
+from client_pool    import ClientPool
+from retry          import RetryPolicy, ModelChain, RETRYABLE_CODES
+from admission      import AdmissionController, MODEL_LIMITS, DEFAULT_LIMITS, EXPECTED_OUTPUT_TOKENS
+from history        import TranscriptArchive, HISTORY_WINDOW, PROMPT_HISTORY, PAGE_SIZE, SUMMARY_PROMPT, SUMMARY_MODEL, SUMMARY_MAX_CHARS, message_line, trim_summary, fallback_summary
 from flask          import Flask, render_template, request
 from flask_socketio import SocketIO, emit, join_room, leave_room as socket_leave_room
 
@@ -32,13 +46,42 @@ app = Flask(__name__,
             static_url_path='/assets')
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+#with several server workers, emits go through a shared message queue (e.g. redis://localhost:6379/0) so every client gets them
+MESSAGE_QUEUE = os.getenv("GAOL_MESSAGE_QUEUE") or None
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=MESSAGE_QUEUE)
 
 #Gemini API
 #key loading from .env
 raw_key = os.getenv("GEMINI_API_KEY")
 #if the .env field is empty or just whitespace, treat it as none
 DEFAULT_API_KEY = raw_key.strip() if raw_key and raw_key.strip() else None
+#lore scoring engine used by the RelevanceEngine ('bm25', 'tfidf', or the original 'overlap')
+LORE_SCORING = os.getenv("GAOL_LORE_SCORING", "bm25").strip().lower()
+if LORE_SCORING not in RelevanceEngine.SCORING_MODES:
+    print(f"[SYSTEM] Unknown GAOL_LORE_SCORING '{LORE_SCORING}', using bm25.")
+    LORE_SCORING = "bm25"
+#prompt packing limits, the token budget decides how much of these actually gets sent
+MAX_HISTORY_MESSAGES = PROMPT_HISTORY   #newest story messages considered for the prompt, older ones live in the summary
+MAX_LORE_ITEMS = 8          #most lore lines that can be sent
+LORE_CANDIDATES = 24        #scored lore lines handed to the packer
+#stream story text to the room while it generates (set GAOL_STREAM=false to wait for the full response)
+STREAM_STORY_TEXT = os.getenv("GAOL_STREAM", "true").strip().lower() != "false"
+#where the static prompt prefix is cached ('gemini', 'local' for the offline stand-in, or 'off')
+CONTEXT_CACHE_MODE = os.getenv("GAOL_CONTEXT_CACHE", "gemini").strip().lower()
+if CONTEXT_CACHE_MODE not in CACHE_BACKENDS and CONTEXT_CACHE_MODE != "off":
+    print(f"[SYSTEM] Unknown GAOL_CONTEXT_CACHE '{CONTEXT_CACHE_MODE}', using gemini.")
+    CONTEXT_CACHE_MODE = "gemini"
+#tokens of standing world lore (factions, places) sent in the cached prefix, 0 leaves it to the per turn lore
+SETTLED_LORE_TOKENS = max(0, int(os.getenv("GAOL_SETTLED_LORE_TOKENS", "1500")))
+#world changes before the settled lore is rebuilt, in between the prefix (and with it the cache) stays the same
+SETTLED_LORE_REFRESH = 25
+#requests/minute and tokens/minute allowed per API key, overrides the per model defaults in admission.py (set these for free tier keys)
+RPM_LIMIT = int(os.getenv("GAOL_RPM_LIMIT", "0")) or None
+TPM_LIMIT = int(os.getenv("GAOL_TPM_LIMIT", "0")) or None
+#models tried when the room's model keeps failing, in order, and the total attempts per generation
+#left empty a room falls back to the models cheaper than its own (see retry.py)
+FALLBACK_MODELS = [m.strip() for m in os.getenv("GAOL_FALLBACK_MODELS", "").split(',') if m.strip()]
+RETRY_ATTEMPTS = max(1, int(os.getenv("GAOL_RETRY_ATTEMPTS", "4")))
 
 #server prints to see if API key is found in the environment
 if DEFAULT_API_KEY:
@@ -52,17 +95,38 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 
 
-WORLDS_FILE = os.path.join(DATA_DIR, 'worlds.json')
+WORLDS_FILE = os.path.join(DATA_DIR, 'worlds.json') #legacy world storage, only read to migrate into WORLDS_DB
+WORLDS_DB = os.path.join(DATA_DIR, 'worlds.db')
 ROOMS_FILE = os.path.join(DATA_DIR, 'rooms.json')
 PLAYERS_FILE = os.path.join(DATA_DIR, 'players.json')
 CHARACTERS_FILE = os.path.join(DATA_DIR, 'characters.json')
-
+TOKEN_AUDIT_FILE = os.path.join(DATA_DIR, 'token_audit.jsonl')
+TRANSCRIPT_DIR = os.path.join(DATA_DIR, 'transcripts') #full room transcripts, one file per room
+#max seconds between a change and it being written to disk
+SAVE_INTERVAL = float(os.getenv("GAOL_SAVE_INTERVAL", "2"))
+
+#sqlite backed storage engine for the worlds
+os.makedirs(DATA_DIR, exist_ok=True)
+world_store = WorldStore(WORLDS_DB)
 #new global world storage
-# {'world_id': World Object}
-worlds = {} 
+# {'world_id': World Object}, only the headers are read on startup and a world's lore is loaded the first time it's used
+worlds = WorldRegistry(world_store)
+#append-only token usage log, one JSON line per generation
+token_audit = AuditLog(TOKEN_AUDIT_FILE)
+#full transcript of every room, the rooms themselves only keep a bounded window in memory
+transcripts = TranscriptArchive(TRANSCRIPT_DIR)
+#shared room state for running several server workers, 'local' keeps everything in this process (see state_backend.py)
+state_backend = open_state_backend(os.getenv("GAOL_STATE_BACKEND", "local"))
+WORKER_ID = f"{platform.node()}:{os.getpid()}" #names this process on the room leases
+LEASE_TTL = 120     #seconds a worker may hold a room without renewing, long enough for a generation with retries
+LEASE_WAIT = 15     #seconds a handler waits for another worker to finish with a room before giving up
 #temp game storage
-# {'room_id': GameRoom Object}
-games = {}
+# {'room_id': GameRoom Object}, copy-on-write so the room list and background sweeps can iterate it without locking
+games = RoomRegistry()
+DISCONNECT_GRACE = 300  #seconds (5 minutes) a disconnected player keeps their seat before being removed
+DISCONNECT_SYNC_INTERVAL = 30   #seconds between looks at the shared backend for disconnects recorded by other workers
+#when each disconnected player's grace period runs out, keyed by (room id, username) since the sid changes on rejoin
+disconnect_timers = ExpiryHeap()
 
 #gemini configurations
 generation_config = types.GenerateContentConfig(
@@ -129,6 +193,22 @@ generation_config = types.GenerateContentConfig(
     9. A players character may become significant either due to their backstory or their actions, if so, create a new figure based on their character.
     """
 )
+#caches the system instruction, world header and settled lore so each turn only sends what changed
+context_cache = ContextCache(CACHE_BACKENDS[CONTEXT_CACHE_MODE]() if CONTEXT_CACHE_MODE in CACHE_BACKENDS else None, generation_config)
+#queues generations per API key so the shared server key stays inside its per minute limits
+admission = AdmissionController(
+    {model: (RPM_LIMIT or rpm, TPM_LIMIT or tpm) for model, (rpm, tpm) in MODEL_LIMITS.items()},
+    (RPM_LIMIT or DEFAULT_LIMITS[0], TPM_LIMIT or DEFAULT_LIMITS[1]),
+    sleep=socketio.sleep
+)
+#one Gemini client per API key, created on a key's first generation and shared by every room using it
+client_pool = ClientPool()
+atexit.register(client_pool.close_all)
+#how failed generations are retried, and the models tried (in order) after the room's own model stops answering
+retry_policy = RetryPolicy(attempts=RETRY_ATTEMPTS)
+model_chain = ModelChain(FALLBACK_MODELS)
+OVERLOAD_BACKOFF = {503: 5, 429: 20} #seconds a key's line is held after the API reports overload (503) or quota exhaustion (429)
+
 # The JSON schema follows these basic rules:
 # 1. Immutable updates (like game history) is added as a list (e.g. world updates is a chronological history)
 # 2. Updates to entities like locations or characters is provided in a dictionary, so that specific values may be modified.
@@ -137,250 +217,308 @@ generation_config = types.GenerateContentConfig(
 #                          Helper Functions                            #
 ########################################################################
 
-# RelevanceEngine class
-# The purpose of this class is to allow for better scoping of context so that only relevant information is sent into the prompt
-# and to reduce unnecessary information from taking up token count in our prompting.
-class RelevanceEngine:
-    #stop words are common word that aren't relevant to our prompting, and removing them helps minimize prompt bloat and improve both efficiency and information relevancy.
-    STOP_WORDS = {
-        'the', 'is', 'at', 'which', 'on', 'a', 'an', 'and', 'or', 'but', 
-        'if', 'of', 'to', 'in', 'for', 'with', 'by', 'from', 'up', 'about', 
-        'into', 'over', 'after', 'i', 'you', 'he', 'she', 'it', 'we', 'they',
-        'me', 'him', 'her', 'us', 'them', 'my', 'your', 'his', 'its', 'our', 'their'
-    }
-
-    #takes all the tokens submitted, cleans them, and removes stop words.
-    @staticmethod
-    def extract_keywords(text):
-        if not text: return set()
-        #clean and split text into tokens
-        tokens = re.findall(r'\b\w+\b', text.lower())                         #extracts just the words, letters, and characters (removing punctuation)
-        return {t for t in tokens if t not in RelevanceEngine.STOP_WORDS}     #removes all the stop words from the list of words
-
-    #grab relevent lore bits from the world file
-    @staticmethod
-    def get_relevant_lore(world, history_buffer, current_actions, limit=5):
-        #creates search context out of recent history and the actions being taken
-        search_context = history_buffer + " " + current_actions
-        #distills that search context into relevant keywords for better searching
-        context_keywords = RelevanceEngine.extract_keywords(search_context)
-        
-        #scoring out items
-        #scores against major events and worldentites
-        scored_items = []
-        
-        #process groups/factions
-        for group in world.groups:
-            score = 0
-            #check keywords in name
-            group_words = RelevanceEngine.extract_keywords(group.name)
-            score += len(group_words.intersection(context_keywords)) * 2            #2x weight value (explicit names are high value)
-            
-            #check manual keywords
-            if group.keywords:
-                kw_set = {k.lower() for k in group.keywords}
-                score += len(kw_set.intersection(context_keywords))                  #1x weight value
-            
-            #check description (lower weight)
-            desc_words = RelevanceEngine.extract_keywords(group.description)
-            score += len(desc_words.intersection(context_keywords)) * 0.5            #1/2 weight value
-
-            if score > 0:
-                scored_items.append({
-                    'text': f"[{group.type_tag}] {group.name}: {group.description}",
-                    'score': score
-                })
-        
-        #process Locations
-        for loc in world.locations:
-            score = 0
-            loc_words = RelevanceEngine.extract_keywords(loc.name)
-            score += len(loc_words.intersection(context_keywords)) * 2
-            
-            #check manual keywords
-            if loc.keywords:
-                kw_set = {k.lower() for k in loc.keywords}
-                score += len(kw_set.intersection(context_keywords))
-
-            if score > 0:
-                 scored_items.append({
-                    'text': f"[{loc.type_tag}] {loc.name} (at {loc.x},{loc.y}): {loc.description} [Controlled by: {loc.affiliation}]",
-                    'score': score
-                 })
-
-        #process major world events (factoring in a recency bias with keyword matching)
-        #since events are added sequentially, the further they are in the list the more recent they happened.
-        total_events = len(world.major_events)
-        for i, event in enumerate(world.major_events):
-            score = 0
-            
-            #check if event is a dict (new format) or string (old format)
-            if isinstance(event, dict):
-                text_content = f"{event.get('title', '')} {event.get('description', '')}"
-                display_text = f"[History] {event.get('title', 'Event')}: {event.get('description', '')}"
-            else:
-                text_content = event
-                display_text = f"[History] {event}"
-
-            event_words = RelevanceEngine.extract_keywords(text_content)
-            score += len(event_words.intersection(context_keywords))
-            
-            #recency bias (events at end of list get higher base score)
-            recency_score = (i / total_events) * 2 if total_events > 0 else 0
-            
-            final_score = score + recency_score
-            
-            #keep the most recent event in mind, even if it's not super relevant.
-            if i == total_events - 1:
-                final_score += 10 
-
-            scored_items.append({
-                'text': display_text,
-                'score': final_score
-            })
-            
-        #sort the items by their score, and slice the most relevant scorings.
-        scored_items.sort(key=lambda x: x['score'], reverse=True)
-        top_items = scored_items[:limit]
-        
-        return "\n".join([item['text'] for item in top_items])
-    
-#runs every 10 seconds, checks for any players who have been disconnected for 300 seconds (5 minutes), and removes them
+# StoryTextStreamer class
+# The AI responds with a JSON object, which can't be parsed until the whole thing has arrived.
+# This pulls the "story_text" string out of the partial JSON as it streams in, so players can start reading right away.
+class StoryTextStreamer:
+    KEY_PATTERN = re.compile(r'"story_text"\s*:\s*"')
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self):
+        self.buffer = ""     #everything received so far
+        self.pos = None      #index in the buffer of the next undecoded story_text character
+        self.done = False    #true once the closing quote of story_text has been seen
+
+    #adds a piece of the stream, returns any newly decoded story text (may be empty)
+    def feed(self, piece):
+        self.buffer += piece
+        if self.done:
+            return ""
+        if self.pos is None:
+            match = self.KEY_PATTERN.search(self.buffer)
+            if not match:
+                return ""
+            self.pos = match.end()
+
+        out = []
+        buf = self.buffer
+        i = self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch != '\\':
+                out.append(ch)
+                i += 1
+                continue
+            #escape sequences may be split across chunks, so wait for the rest of them
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc != 'u':
+                out.append(self.ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            code = int(buf[i + 2:i + 6], 16)
+            #surrogate pairs (emoji etc.) come in as two \u escapes
+            if 0xD800 <= code <= 0xDBFF:
+                if i + 12 > len(buf):
+                    break
+                if buf[i + 6:i + 8] == '\\u':
+                    low = int(buf[i + 8:i + 12], 16)
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i += 12
+                    continue
+            out.append(chr(code))
+            i += 6
+        self.pos = i
+        return "".join(out)
+
+#sleeps until the next disconnected player's grace period runs out and removes the players whose time is up.
+#only rooms with an expiring player are touched, idle rooms cost nothing. Wakes at least every 10 seconds to look for new entries.
+#with a shared backend the disconnect time is part of the room state, so every worker schedules it once it syncs the room
+#(see sync_room). Rooms changed elsewhere are picked up here too, a disconnect still expires if the worker that saw it is gone.
 def check_disconnect_timers():
+    last_sync = 0
     while True:
-        socketio.sleep(10) #run check every 10 seconds
+        next_deadline = disconnect_timers.next_deadline()
+        wait = 10 if next_deadline is None else min(10, next_deadline - time.time())
+        socketio.sleep(max(0.5, wait))
+
+        if state_backend.shared and time.time() - last_sync >= DISCONNECT_SYNC_INTERVAL:
+            last_sync = time.time()
+            try:
+                sync_rooms()
+            except Exception as e:
+                print(f"[TIMEOUT] Could not sync rooms from the state backend: {e}")
+
+        expired = {} #room id -> usernames whose grace period ran out
+        for room_id, username in disconnect_timers.pop_due(time.time()):
+            expired.setdefault(room_id, []).append(username)
+        for room_id, usernames in expired.items():
+            expire_disconnected(room_id, usernames)
+
+#starts the grace period of every disconnected player in a room, for rooms loaded from disk or from another worker
+def schedule_disconnects(game):
+    for p in game.players.values():
+        if not p.connect and p.dc_timer:
+            disconnect_timers.schedule((game.room_id, p.username), p.dc_timer + DISCONNECT_GRACE)
+
+#removes the given players from a room if they are still disconnected and their grace period is over
+def expire_disconnected(room_id, usernames):
+    with room_lease(room_id, wait=1) as lease:
+        game = games.get(room_id)
+        if game is None:
+            return #closed in the meantime
+        if lease is None:
+            #busy on another worker, try again shortly
+            for username in usernames:
+                disconnect_timers.schedule((room_id, username), time.time() + 10)
+            return
         current_time = time.time()
-        timeout_limit = 300 #5 minutes in seconds
+        #find players to kick, anyone who reconnected and dropped again since gets the rest of their new grace period
+        to_kick = []
+        for sid, p in game.players.items():
+            if p.username not in usernames or p.connect or not p.dc_timer:
+                continue
+            if current_time - p.dc_timer >= DISCONNECT_GRACE:
+                to_kick.append(sid)
+            else:
+                disconnect_timers.schedule((room_id, p.username), p.dc_timer + DISCONNECT_GRACE)
+        if not to_kick:
+            return
 
-        #create list of rooms to modify to avoid iteration errors
-        for room_id, game in list(games.items()):
-            
-            #find players to kick
-            to_kick = []
-            for sid, p in game.players.items():
-                if not p.connect and p.dc_timer:
-                    if (current_time - p.dc_timer) > timeout_limit:
-                        to_kick.append(sid)
-            
-            #kick them
-            if to_kick:
-                for sid in to_kick:
-                    p_name = game.players[sid].username
-                    print(f"[TIMEOUT] Removing {p_name} from Room {room_id} (inactive > 5m)")
-                    game.remove_player(sid)
-                    
-                    #notify room of the final removal
-                    emit('status', {'msg': f'{p_name} was removed due to inactivity.'}, room=room_id)
-                
-                save_players()
-
-            #if room is now empty (everyone timed out), delete the room
-            if len(game.players) == 0:
-                print(f"[CLEANUP] Deleting empty Room {room_id}")
-                del games[room_id]
-                save_rooms()
-                continue # Move to next room
-            
-            #if players remain, send update to remove the ghost card
-            if to_kick:
-                game_state_export = [
-                    {
-                        'name': p.username, 'hp': p.hp, 'status': p.status, 
-                        'has_acted': p.has_acted, 'is_ready': p.is_ready, 
-                        'tags': p.tags, 'ambition': p.ambition, 'secret': p.secret, 'description': p.description
-                    } 
-                    for p in game.players.values()
-                ]
-                emit('game_state_update', game_state_export, room=room_id)
+        #kick them
+        for sid in to_kick:
+            p_name = game.players[sid].username
+            print(f"[TIMEOUT] Removing {p_name} from Room {room_id} (inactive > 5m)")
+            game.remove_player(sid)
+            #notify room of the final removal (this runs as a background task, there is no request to emit to)
+            socketio.emit('status', {'msg': f'{p_name} was removed due to inactivity.'}, room=room_id)
+        save_players(room_id)
+
+        #if room is now empty (everyone timed out), delete the room
+        if len(game.players) == 0:
+            print(f"[CLEANUP] Deleting empty Room {room_id}")
+            close_room(room_id)
+            return
+
+        #if players remain, send update to remove the ghost card
+        publish_party_state(game)
+
+##############################
+#        Shared State        #
+##############################
+#every change to a room happens while holding it with room_lease. Inside one process that is the room's own lock,
+#so rooms never wait on each other (worlds have their own locks, always taken after the room's).
+#NOTE: with GAOL_STATE_BACKEND left as 'local' that lock is all there is, games and worlds are the only copy.
+#with a shared backend every worker keeps its own copy of the rooms it has touched. A worker has to hold a room's
+#lease to change it: the room is refreshed from the backend when the lease is taken and written back when it's released.
+
+synced_versions = {} #room id -> backend version our copy of the room matches
+synced_blobs = {}    #room id -> the state last read or written, commits are skipped when nothing changed
+world_revisions = {} #world id -> backend revision our copy of the world matches
+held_leases = threading.local() #rooms whose lease the current task holds, so nested handlers (create_room -> on_join) reuse it
+
+#holds a room for the body of the with block, yields the lease owner (or None if the room stayed busy)
+#in this process that means the room's lock, with a shared backend the room's lease on top of it
+@contextmanager
+def room_lease(room_id, wait=LEASE_WAIT):
+    held = held_leases.__dict__.setdefault('rooms', {})
+    if room_id in held:
+        yield held[room_id] #the outer holder syncs and commits
+        return
+    with games.lock(room_id, timeout=wait) as acquired:
+        if not acquired:
+            print(f"[STATE] Room {room_id} is still busy, giving up.")
+            yield None
+            return
+        owner = WORKER_ID
+        if state_backend.shared:
+            owner = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+            deadline = time.time() + wait
+            while not state_backend.acquire_lease(room_id, owner, LEASE_TTL):
+                if time.time() >= deadline:
+                    print(f"[STATE] Room {room_id} is still busy on another worker, giving up.")
+                    yield None
+                    return
+                socketio.sleep(0.05)
+        held[room_id] = owner
+        try:
+            sync_room(room_id)
+            yield owner
+            commit_room(room_id)
+            lobby.touch(room_id) #the lobby loop checks if its row changed
+        except Exception:
+            synced_versions.pop(room_id, None) #our copy may be half changed, reload it next time
+            raise
+        finally:
+            held.pop(room_id, None)
+            if state_backend.shared:
+                state_backend.release_lease(room_id, owner)
+
+#brings our copy of a room up to date with the backend
+def sync_room(room_id):
+    if not state_backend.shared:
+        return
+    version, state = state_backend.load_room(room_id)
+    if version is None:
+        if room_id in synced_versions: #closed by another worker
+            games.pop(room_id, None)
+            synced_versions.pop(room_id, None)
+            synced_blobs.pop(room_id, None)
+            lobby.touch(room_id)
+        return
+    if synced_versions.get(room_id) == version and room_id in games:
+        return
+    games[room_id] = GameRoom.from_state(state)
+    schedule_disconnects(games[room_id])
+    lobby.touch(room_id)
+    synced_versions[room_id] = version
+    synced_blobs[room_id] = json.dumps(state)
+    transcripts.forget(room_id) #another worker may have appended to the transcript
+    sync_world(state['world_id'])
+
+#reloads a world from the world database if another worker has changed its lore
+def sync_world(world_id):
+    if not state_backend.shared or not world_id:
+        return
+    revision = state_backend.world_revision(world_id)
+    if world_id in worlds and world_revisions.get(world_id) == revision:
+        return
+    world = worlds.peek(world_id)
+    if world is None and world_id in worlds:
+        world_revisions[world_id] = revision #not loaded here yet, it's read fresh from the database when first used
+        return
+    #held across the save and the swap, so a room changing this world can't slip lore in between and lose it
+    with worlds.lock(world_id):
+        if world and world.has_changes():
+            world_store.save_world(world) #never throw away lore we haven't written yet
+        fresh = world_store.load_world(world_id)
+        if fresh:
+            worlds[world_id] = fresh
+            world_revisions[world_id] = revision
+
+#writes our copy of a room (and its world's lore, if it changed) back to the backend
+def commit_room(room_id):
+    game = games.get(room_id)
+    if not state_backend.shared or game is None:
+        return
+    world = worlds.get(game.world_id)
+    if world and world.has_changes():
+        #other workers reload the world from the database, so the lore has to be there before the revision moves
+        with worlds.lock(world.id):
+            world_store.save_world(world)
+        world_revisions[world.id] = state_backend.bump_world(world.id)
+    state = game.to_state()
+    blob = json.dumps(state)
+    if blob == synced_blobs.get(room_id):
+        return
+    transcripts.flush() #other workers read the transcript from disk once they see the new version
+    synced_versions[room_id] = state_backend.save_room(room_id, state)
+    synced_blobs[room_id] = blob
+
+#refreshes the list of rooms from the backend, rooms created or closed by other workers included
+def sync_rooms():
+    if not state_backend.shared:
+        return
+    versions = state_backend.room_versions()
+    for room_id in list(games):
+        if room_id not in versions and room_id in synced_versions:
+            games.pop(room_id, None)
+            synced_versions.pop(room_id, None)
+            synced_blobs.pop(room_id, None)
+            lobby.touch(room_id)
+    for room_id, version in versions.items():
+        if synced_versions.get(room_id) != version:
+            sync_room(room_id)
+
+#wraps a socket handler whose data names a room, so it runs holding that room (rooms never wait on each other)
+def room_event(handler):
+    @functools.wraps(handler)
+    def wrapper(data, *args):
+        room_id = data.get('room') if isinstance(data, dict) else None
+        if not room_id:
+            return handler(data, *args)
+        with room_lease(room_id) as lease:
+            if lease is None:
+                emit('status', {'msg': 'The room is busy, try again in a moment.'})
+                return
+            return handler(data, *args)
+    return wrapper
 
 ##############################
 #      Loader Functions      #
 ##############################
 
-#load worlds from json file on startup
+#load the world headers from the world database on startup, the lore itself is loaded when a room uses the world
 def load_worlds():
-    global worlds
-    if not os.path.exists(WORLDS_FILE):
-        print("[SYSTEM] No worlds file found.")
-        return
     try:
-        with open(WORLDS_FILE, 'r') as f:
-            data = json.load(f)
-            for w_id, w_data in data.items():
-                print(f"[DEBUG] Attempting to load world: {w_id}") #debug stuff
-                #defaults added for backward compatibility
-                #added width/height defaults
-                w = World(
-                    w_data['name'], 
-                    w_data.get('setting', 'Medieval Fantasy'), 
-                    w_data.get('realism', 'High'), 
-                    w_data['description'],
-                    w_data.get('width', 1024),
-                    w_data.get('height', 512)
-                )
-                w.id = w_data['id'] #overwrite random id
-                
-                #handle major_events. If they are strings, convert to dicts.
-                w.major_events = []
-                if 'major_events' in w_data:
-                    for evt in w_data['major_events']:
-                        if isinstance(evt, str):
-                             w.add_event({"title": "Historical Event", "description": evt})
-                        else:
-                             w.add_event(evt)
-                
-                #load entities if they exist
-                if 'groups' in w_data:
-                    for e_data in w_data['groups']:
-                        w.add_group(
-                            e_data['name'], 
-                            e_data['type'], 
-                            e_data['description'], 
-                            e_data.get('keywords', [])
-                        )
-
-                #load locations
-                if 'locations' in w_data:
-                    for l_data in w_data['locations']:
-                        w.add_location(
-                            l_data['name'],
-                            l_data['type'],
-                            l_data['description'],
-                            l_data.get('x', 0),
-                            l_data.get('y', 0),
-                            l_data.get('radius', 1),
-                            l_data.get('affiliation', 'Independent'), #default to independent
-                            l_data.get('keywords', [])
-                        )
-
-                #load characters
-                if 'characters' in w_data:
-                    for c_data in w_data['characters']:
-                        c_role = c_data.get('role', 'NPC')
-                        c_aff  = c_data.get('affiliation', 'None')
-                        c_stat = c_data.get('status', 'Alive') 
-
-                        #this line was crashing before because World.add_character didn't accept status
-                        w.add_character(c_data['name'], c_data['description'], c_role, c_aff, c_stat)
-
-                #load world biology
-                if 'biology' in w_data:
-                    for b_data in w_data['biology']:
-                        w.add_biology(
-                            b_data['name'],
-                            b_data['description'],
-                            b_data['habitat'],
-                            b_data['disposition']
-                        )
-                worlds[w_id] = w
-        print(f"[SYSTEM] Loaded {len(worlds)} worlds from storage.")
+        #first run after upgrading, pull the old worlds.json into the database (retried every boot until it succeeds)
+        if os.path.exists(WORLDS_FILE) and not world_store.json_migrated():
+            print(f"[SYSTEM] Migrating {WORLDS_FILE} into the world database...")
+            try:
+                world_store.migrate_from_json(WORLDS_FILE)
+            except Exception as e:
+                print(f"[CRITICAL ERROR] Could not migrate {WORLDS_FILE}, nothing was imported and it will be retried on the next start: {e}")
+                traceback.print_exc()
+        worlds.load_headers()
+        print(f"[SYSTEM] Found {len(worlds)} worlds in storage.")
     except Exception as e:
         print(f"[CRITICAL ERROR] Error loading worlds: {e}") #debug stuff
         traceback.print_exc() #debug stuff
 
 # Load Room and Player Data on Startup
 def load_game_state():
-    global games
+    #with a shared backend the rooms live there, rooms.json is only read to seed an empty backend
+    if state_backend.shared and state_backend.room_versions():
+        sync_rooms()
+        print(f"[SYSTEM] Loaded {len(games)} active rooms from the shared state backend.")
+        return
     #load rooms
     if os.path.exists(ROOMS_FILE):
         try:
@@ -396,7 +534,18 @@ def load_game_state():
                         password=None # We don't save passwords in plain text ideally, but logic dictates recreation
                     )
                     gr.is_started = r_data.get('is_started', False)
-                    gr.history = r_data.get('history', [])
+                    gr.input_token_budget = r_data.get('input_token_budget')
+                    gr.summary = r_data.get('summary', "")
+                    gr.pending_summary = r_data.get('pending_summary', [])
+                    #rooms saved before the transcript archive kept their whole history in rooms.json, archive it once
+                    saved_history = r_data.get('history', [])
+                    if saved_history and not transcripts.exists(r_id):
+                        transcripts.append(r_id, saved_history)
+                        for msg in saved_history:
+                            gr.add_message(msg)
+                    else:
+                        #the history window is refilled from the end of the transcript
+                        gr.history = transcripts.tail(r_id, HISTORY_WINDOW)
                     # we flag it as private if json says so, but we might lose the password on restart if not saved.
                     # for now, we assume public re-entry or data loss of password unless we saved it. 
                     # implementation of full persistence would require saving passwords.
@@ -433,46 +582,113 @@ def load_game_state():
         except Exception as e:
             print(f"[ERROR] Failed to load players: {e}")
 
+    if state_backend.shared:
+        for r_id in list(games):
+            commit_room(r_id)
+        print(f"[SYSTEM] Moved {len(games)} rooms into the shared state backend.")
+
 
 ##############################
 #       Saver Functions      #
 ##############################
 
-#save worlds to json file
-def save_worlds():
-    try:
-        data = {w_id: w.to_dict() for w_id, w in worlds.items()}
-        with open(WORLDS_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-        print("[DEBUG] Worlds saved successfully.")
-    except Exception as e:
-        print(f"Error saving worlds: {e}")
+#NOTE: the save_* functions below don't touch the disk, they only mark data as dirty.
+#the write-behind scheduler writes everything marked in one batch every SAVE_INTERVAL seconds (and on shutdown),
+#so handlers never block on disk I/O no matter how many times they save.
 
-def save_rooms():
-    try:
-        data = {r_id: r.to_dict() for r_id, r in games.items()}
-        with open(ROOMS_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        print(f"Error saving rooms: {e}")
+#last serialized state of each room/player, so a flush only re-serializes the rooms that changed
+#these start as None, which makes the first flush rebuild them from every room
+room_cache = None   #{'room_id': room dict}
+player_cache = None #{'room_id': {'RoomID_Username': player dict}}
+
+#save worlds to the world database, only lore that changed since the last save is written
+def save_worlds(world_id=None):
+    persistence.mark_dirty('worlds', world_id)
+
+#save a room (or all rooms if no id is given) to the local rooms file
+#with a shared state backend the backend is the room storage, see commit_room
+def save_rooms(room_id=None):
+    if state_backend.shared: return
+    persistence.mark_dirty('rooms', room_id)
 
 #save players to the local players file
 #NOTE: Is this actually useful or necessary?
-def save_players():
-    #flattens all players from all games into one dictionary keyed by "RoomID_Username"
-    try:
-        all_players = {}
-        for r_id, game in games.items():
-            for p in game.players.values():
-                unique_key = f"{r_id}_{p.username}"
-                player_data = p.to_dict()
-                player_data['room_ref'] = r_id # add reference to room
-                all_players[unique_key] = player_data
-        
-        with open(PLAYERS_FILE, 'w') as f:
-            json.dump(all_players, f, indent=2)
-    except Exception as e:
-        print(f"Error saving players: {e}")
+def save_players(room_id=None):
+    if state_backend.shared: return
+    persistence.mark_dirty('players', room_id)
+
+#removes a room for good, its transcript goes with it
+def close_room(room_id):
+    games.pop(room_id, None)
+    lobby.touch(room_id)
+    transcripts.delete(room_id)
+    if state_backend.shared:
+        state_backend.delete_room(room_id)
+        synced_versions.pop(room_id, None)
+        synced_blobs.pop(room_id, None)
+    save_rooms(room_id)
+    save_players(room_id)
+
+#writer used by the scheduler, pushes the changed worlds into the world database
+def write_worlds(world_ids):
+    #worlds that were never loaded can't have changed
+    targets = worlds.hydrated() if world_ids is None else [worlds.peek(w_id) for w_id in world_ids]
+    saved = 0
+    for w in targets:
+        if w is None:
+            continue
+        with worlds.lock(w.id): #a turn may be adding lore to this world right now
+            if world_store.save_world(w):
+                saved += 1
+    if saved:
+        print(f"[DEBUG] Worlds saved successfully. ({saved} changed)")
+
+#writer used by the scheduler, refreshes the changed rooms and rewrites rooms.json atomically
+def write_rooms(room_ids):
+    global room_cache
+    if room_ids is None or room_cache is None:
+        room_cache = {r_id: serialize_room(r_id, r) for r_id, r in games.items()}
+    else:
+        for r_id in room_ids:
+            if r_id in games:
+                room_cache[r_id] = serialize_room(r_id, games[r_id])
+            else:
+                room_cache.pop(r_id, None) #room was deleted
+    write_json_atomic(ROOMS_FILE, room_cache)
+
+#a room as saved in rooms.json, taken under the room's lock so a handler can't change it halfway through
+def serialize_room(r_id, game):
+    with games.lock(r_id):
+        return game.to_dict()
+
+#players of a single room, keyed by "RoomID_Username"
+def serialize_room_players(r_id, game):
+    with games.lock(r_id):
+        return {f"{r_id}_{p.username}": dict(p.to_dict(), room_ref=r_id) for p in game.players.values()}
+
+#writer used by the scheduler, flattens all players from all games into one dictionary keyed by "RoomID_Username"
+def write_players(room_ids):
+    global player_cache
+    if room_ids is None or player_cache is None:
+        player_cache = {r_id: serialize_room_players(r_id, g) for r_id, g in list(games.items())}
+    else:
+        for r_id in room_ids:
+            if r_id in games:
+                player_cache[r_id] = serialize_room_players(r_id, games[r_id])
+            else:
+                player_cache.pop(r_id, None)
+    all_players = {}
+    for room_players in player_cache.values():
+        all_players.update(room_players)
+    write_json_atomic(PLAYERS_FILE, all_players)
+
+persistence = WriteBehindScheduler({
+    'worlds': write_worlds,
+    'rooms': write_rooms,
+    'players': write_players
+}, interval=SAVE_INTERVAL)
+#make sure nothing marked dirty is lost when the server shuts down
+atexit.register(persistence.flush)
 
 #save important characters to the local characters file
 #NOTE: This isn't used.
@@ -492,12 +708,12 @@ def save_all_data():
     save_rooms()
     save_players()
     save_characters()
+    persistence.flush()
 
 #clean markdown formatting from JSON responses (in case the AI uses it or it bleeds in)
 #you may have seen this happen if you try to get an AI model to format some markdown files.
 def process_response(text, game_room):
-    players = game_room.players.values() #players in the room
-    entities = worlds[game_room.world_id].get_entity_list()
+    world = worlds.get(game_room.world_id)
     #remove markdown from JSON response
     if "```json" in text:
         text = text.replace("```json", "").replace("```", "")
@@ -520,142 +736,251 @@ def process_response(text, game_room):
                 "updates": {}, 
                 "world_updates": []
             }
-    if players:
-        player_names = [re.escape(p.username) for p in players] #grab all palyer names
-        replace_reg = r"\b(" + "|".join(f"{player_names}") + r")\b"
-        if "story_text" in data:
-            data["story_text"] = re.sub(' ', '||', data["story_text"])
-            data["story_text"] = re.sub(replace_reg, r'<span class="highlighted-name">\1</span>', data["story_text"], flags=re.IGNORECASE)
-    if entities:
-        entity_names = [re.escape(e) for e in entities]
-        print(f"[DEBUG] Entity Names: {entity_names}")
-        replace_reg = r"\b(" + "|".join(entity_names) + r")\b"
-        if "story_text" in data:
-            data["story_text"] = re.sub(replace_reg, r'<span class="highlighted-entity">\1</span>', data["story_text"], flags=re.IGNORECASE)
+    #one pass over the story text, player names take priority over lore names
+    if "story_text" in data:
+        with games.lock(game_room.room_id), (worlds.lock(world.id) if world else nullcontext()):
+            data["story_text"] = highlight_story(data["story_text"], [
+                (game_room.get_player_matcher(), 'highlighted-name'),
+                (world.name_matcher if world else None, 'highlighted-entity')
+            ])
     with open(os.path.join(DATA_DIR, 'processed.json'), 'w') as f:
         json.dump(data, f, indent=2)
     return data
 
+#streams the response from the AI, pushing the story text to the room as it is generated.
+#returns the full raw text, the usage metadata (only present on the final chunks of the stream) and when the first chunk arrived
+def stream_ai_response(game_room, client, model, contents, config):
+    streamer = StoryTextStreamer()
+    raw_text = ""
+    usage = None
+    first = True
+    first_chunk_at = None
+    stream = client.models.generate_content_stream(model=model, contents=contents, config=config)
+    for chunk in stream:
+        if first_chunk_at is None:
+            first_chunk_at = time.time()
+        if chunk.usage_metadata:
+            usage = chunk.usage_metadata
+        piece = chunk.text or ""
+        raw_text += piece
+        new_text = streamer.feed(piece)
+        if new_text:
+            #'first' lets the client drop any partial text left over from a failed attempt
+            socketio.emit('message_chunk', {'sender': 'GAOL', 'text': new_text, 'first': first}, room=game_room.room_id)
+            first = False
+        socketio.sleep(0) #yield so other rooms get a turn between chunks
+    return raw_text, usage, first_chunk_at
+
 #this is the function responsible for collating all the prompt information, assembling it, and generating response.
 #this response contains the visually displayed story text, alongside all the world/character updates that must be made.
+#the key a room's requests are billed to, None if there is none
+def active_api_key(game_room):
+    #prefer room override key
+    if game_room.custom_api_key and len(game_room.custom_api_key) > 10:
+        return game_room.custom_api_key
+    #fallback to server .env key (if one exists)
+    if DEFAULT_API_KEY and len(DEFAULT_API_KEY) > 10:
+        return DEFAULT_API_KEY
+    return None
+
+#tells a room where its turn is while it waits for the API key to free up
+def announce_queue_position(room_id, position):
+    if position == 1:
+        msg = 'GAOL is busy with other rooms, your turn is next in line...'
+    else:
+        msg = f'GAOL is busy with other rooms, your turn is #{position} in line...'
+    socketio.emit('status', {'msg': msg}, room=room_id)
+
+#the world's settled lore for the cached prompt prefix, call with the world lock held
+#it's only rebuilt every SETTLED_LORE_REFRESH world changes, lore added in between reaches the prompt through the RelevanceEngine
+settled_lore_cache = {} #world id -> (epoch, version, lines)
+def settled_lore(w):
+    #without a cache the prefix is sent every turn anyway, the per turn lore picks are cheaper
+    if context_cache.backend is None or SETTLED_LORE_TOKENS == 0:
+        return []
+    cached = settled_lore_cache.get(w.id)
+    if cached and cached[0] == w.epoch and w.version - cached[1] < SETTLED_LORE_REFRESH:
+        return cached[2]
+    lines = RelevanceEngine.settled_lore(w, SETTLED_LORE_TOKENS * CHARS_PER_TOKEN)
+    settled_lore_cache[w.id] = (w.epoch, w.version, lines)
+    return lines
+
 def generate_ai_response(game_room, is_embark=False, is_finale=False):
-    #fetching world context for prompt
-    world_context = "Unknown World"
-    #placeholder for the condensed lore
-    relevant_lore_block = "No known history."
-    #take all the submitted player actions and place them into one chunk.
-    current_actions = game_room.compile_turn_actions()
-    
-    #set up message history to keep storyteller on track
-    relevant_history = [m for m in game_room.history if isinstance(m, dict) and m.get('type') == 'story']
-    recent_history_msgs = relevant_history[-15:]
-
-    history_text = ""
-    for msg in recent_history_msgs:
-        if isinstance(msg, dict):
-            #we skip system/hidden messages in the prompt history to save tokens
-            if msg.get('type') == 'story': 
-                history_text += f"{msg['sender']}: {msg['text']}\n"
+    turn_start = time.time() #used for the per-phase latency in the token audit
+    #the prompt reads the room (actions, history, stats) in many places, hold it still until the prompt is built
+    with games.lock(game_room.room_id):
+        #fetching world context for prompt
+        world_context = "Unknown World"
+        #placeholder for the condensed lore
+        relevant_lore_block = "No known history."
+        #take all the submitted player actions and place them into one chunk.
+        current_actions = game_room.compile_turn_actions()
     
-    if game_room.world_id and game_room.world_id in worlds:
-        w = worlds[game_room.world_id]
-        world_context = f"{w.name}: {w.description}. Map Size: {w.width}x{w.height}."
+        #set up message history to keep storyteller on track
+        #we skip system/hidden messages in the prompt history to save tokens (the room only keeps its newest messages in memory)
+        relevant_history = [m for m in game_room.history if isinstance(m, dict) and m.get('type') == 'story']
+        recent_history_msgs = relevant_history[-MAX_HISTORY_MESSAGES:]
+        history_lines = [f"{msg['sender']}: {msg['text']}\n" for msg in recent_history_msgs]
+        #the last 15 messages are what the RelevanceEngine searches, whether or not they all fit in the prompt
+        search_history_text = "".join(history_lines[-15:])
+
+        #lore candidates, the prompt packer decides how many of them actually make it in
+        lore_candidates = []
+        settled_lines = []
+        if game_room.world_id and game_room.world_id in worlds:
+            w = worlds[game_room.world_id]
+            world_context = f"{w.name}: {w.description}. Map Size: {w.width}x{w.height}."
         
-        #implementing the RelevanceEngine
-        #this condenses the world.major_events and world.groups based on what's happening NOW
-        #it scans 'history_text' and 'current_actions' to pick the most relevant lore.
-        relevant_lore_block = RelevanceEngine.get_relevant_lore(w, history_text, current_actions, limit=8)
-
-    #getting the party's stats in one block for prompt info
-    party_stats = game_room.get_party_status_string()
-
-    #special instructions are provided in order to override or force specific behavior in the response
-    #e.g. the following is_embark branch
-    special_instructions = ""
+            #implementing the RelevanceEngine
+            #this condenses the world.major_events and world.groups based on what's happening NOW
+            #it scans the recent history and 'current_actions' to pick the most relevant lore.
+            with worlds.lock(w.id): #another room in this world may be adding lore
+                settled_lines = settled_lore(w)
+                lore_candidates = RelevanceEngine.get_scored_lore(w, search_history_text, current_actions, limit=LORE_CANDIDATES, scoring=LORE_SCORING)
+            #lore already in the prefix doesn't need a second copy (an edited entry reads differently and is kept)
+            settled_set = set(settled_lines)
+            lore_candidates = [item for item in lore_candidates if item['text'] not in settled_set]
+
+        #getting the party's stats in one block for prompt info
+        party_stats = game_room.get_party_status_string()
+
+        #special instructions are provided in order to override or force specific behavior in the response
+        #e.g. the following is_embark branch
+        special_instructions = ""
     
-    #done to initialize the game, generates new world info for the players, and offers them some initial direction.
-    if is_embark:
-        special_instructions = """
-        THIS IS THE START OF THE GAME. IGNORE 'PLAYERS JUST DID'. 
-        1. Initialize the story by placing the party in a random starting scenario relevant to the setting (e.g. waking up in a cell, standing on a battlefield, meeting in a tavern, etc) Attempt to provide a "starting point" being a character or object in which to offer the player some initial direction. 
-            - This does NOT require creating a new location.
-        2. WORLD GENERATION TASK:
-           - SCAN all player descriptions, tags, and secrets for named entities (Gods, Patrons, Factions, Characters, Locations) that are missing from the World Context.
-           - Generate a corresponding entry for EACH one found.
-           - Provide a brief description for them based on the player's text.
-        """
-        current_actions = "The party is ready to begin."
-    elif is_finale:
-        special_instructions = """
-        THIS IS THE END OF THE GAME. IGNORE 'PLAYERS JUST DID'.
-        1. Wrap up the story of the players and their characters by narratively having them go their seperate ways.
-            - Dead players should remain dead, and have the story wrapped up as such.
-            - Living players characters should vaguely follow ambition in their seperation.
-        2. Create new characters for all of the living players, in their description be sure to include pertinent description, ambition, secret, and tags.
-        """
+        #done to initialize the game, generates new world info for the players, and offers them some initial direction.
+        if is_embark:
+            special_instructions = """
+            THIS IS THE START OF THE GAME. IGNORE 'PLAYERS JUST DID'. 
+            1. Initialize the story by placing the party in a random starting scenario relevant to the setting (e.g. waking up in a cell, standing on a battlefield, meeting in a tavern, etc) Attempt to provide a "starting point" being a character or object in which to offer the player some initial direction. 
+                - This does NOT require creating a new location.
+            2. WORLD GENERATION TASK:
+               - SCAN all player descriptions, tags, and secrets for named entities (Gods, Patrons, Factions, Characters, Locations) that are missing from the World Context.
+               - Generate a corresponding entry for EACH one found.
+               - Provide a brief description for them based on the player's text.
+            """
+            current_actions = "The party is ready to begin."
+        elif is_finale:
+            special_instructions = """
+            THIS IS THE END OF THE GAME. IGNORE 'PLAYERS JUST DID'.
+            1. Wrap up the story of the players and their characters by narratively having them go their seperate ways.
+                - Dead players should remain dead, and have the story wrapped up as such.
+                - Living players characters should vaguely follow ambition in their seperation.
+            2. Create new characters for all of the living players, in their description be sure to include pertinent description, ambition, secret, and tags.
+            """
     
-    #add the admin override if present
-    #these are "forceful" actions, such as creating a new figure or faction, that the AI MUST follow
-    if game_room.dm_override:
-        special_instructions += f"""
-        \n*** URGENT ADMIN OVERRIDE ***
-        The Room Admin has explicitly commanded: {game_room.dm_override}
-        PRIORITIZE THIS OVERRIDE ABOVE ALL OTHER CONTEXT. 
-        If the Admin asks to change the world state, kill a player, or spawn an item, DO IT in your response.
+        #add the admin override if present
+        #these are "forceful" actions, such as creating a new figure or faction, that the AI MUST follow
+        if game_room.dm_override:
+            special_instructions += f"""
+            \n*** URGENT ADMIN OVERRIDE ***
+            The Room Admin has explicitly commanded: {game_room.dm_override}
+            PRIORITIZE THIS OVERRIDE ABOVE ALL OTHER CONTEXT. 
+            If the Admin asks to change the world state, kill a player, or spawn an item, DO IT in your response.
+            """
+
+        #schema enforcing prompt
+        #the prompt below is quite complicated and contains A LOT of information.
+        #it should all be self-explanatory by the context and the variable names.
+        #the AI model returns a JSON formatted response that the server parses in order to update player/world states. 
+        #the settings block and the settled lore only change with the world, so they are cached alongside the system instruction (see context_cache.py)
+        static_template = """
+        GAME SETTINGS:
+        - Setting: {setting}
+        - Realism Level: {realism}
+        - World Context: {world_context}
+        {settled_lore_block}
         """
-
-    #schema enforcing prompt
-    #the prompt below is quite complicated and contains A LOT of information.
-    #it should all be self-explanatory by the context and the variable names.
-    #the AI model returns a JSON formatted response that the server parses in order to update player/world states. 
-
-    prompt = f"""
-    GAME SETTINGS:
-    - Setting: {game_room.setting}
-    - Realism Level: {game_room.realism}
-    - World Context: {world_context}
+        prompt_template = """
+        RELEVANT LORE & HISTORY (Use these for context):
+        {relevant_lore_block}
+
+        {party_stats}
+        {story_summary}
+        RECENT HISTORY:
+        {history_text}
     
-    RELEVANT LORE & HISTORY (Use these for context):
-    {relevant_lore_block}
-
-    {party_stats}
+        PLAYERS JUST DID:
+        {current_actions}
     
-    RECENT HISTORY:
-    {history_text}
-    
-    PLAYERS JUST DID:
-    {current_actions}
-    
-    SPECIAL INSTRUCTIONS:
-    {special_instructions}
-    """
+        SPECIAL INSTRUCTIONS:
+        {special_instructions}
+        """
+        settled_lore_block = ("ESTABLISHED LORE:\n" + "\n".join(settled_lines)) if settled_lines else ""
+        static_prompt = static_template.format(setting=game_room.setting, realism=game_room.realism, world_context=world_context, settled_lore_block=settled_lore_block)
+        #the rolling summary stands in for everything older than the history window
+        story_summary = f"\n    STORY SO FAR:\n    {game_room.summary}\n" if game_room.summary else ""
+        prompt_fields = {
+            'party_stats': party_stats,
+            'story_summary': story_summary,
+            'current_actions': current_actions,
+            'special_instructions': special_instructions
+        }
+
+        #pack lore and history into the room's input token budget
+        #everything but the lore and history is always sent, so it's reserved up front (the system instruction counts too)
+        packer = PromptPacker(input_budget_for(game_room.ai_model, game_room.input_token_budget))
+        packer.require(generation_config.system_instruction)
+        packer.require(static_prompt)
+        packer.require(prompt_template.format(relevant_lore_block="", history_text="", **prompt_fields))
+        lore_lines = packer.pack_lore(lore_candidates, limit=MAX_LORE_ITEMS)
+        if lore_lines:
+            relevant_lore_block = "\n".join(lore_lines)
+        history_picked = packer.pack_history(history_lines)
+        history_text = "".join(history_picked)
+        turn_prompt = prompt_template.format(relevant_lore_block=relevant_lore_block, history_text=history_text, **prompt_fields)
+        prompt = static_prompt + turn_prompt
+        estimated_input = packer.used
+        print(f"[PROMPT BUDGET] {game_room.room_id}: ~{estimated_input}/{packer.budget} tokens | Lore: {len(lore_lines)}/{len(lore_candidates)} | History: {len(history_picked)}/{len(history_lines)}")
     
-    active_key = None
-    #prefer room override key
-    if game_room.custom_api_key and len(game_room.custom_api_key) > 10:
-        active_key = game_room.custom_api_key
-    #fallback to server .env key (if one exists)
-    elif DEFAULT_API_KEY and len(DEFAULT_API_KEY) > 10:
-        active_key = DEFAULT_API_KEY
-        
+    active_key = active_api_key(game_room)
     #if neither - return an error
     if not active_key:
             return {"story_text": "CRITICAL ERROR: No Gemini API Key provided. Enter one in Room Creation or check server .env config.", "updates": {}, "world_updates": []}
 
-    retry_count = 3 #try three times
-    tries = 0       #index at 0
-    while tries < retry_count:   
+    prompt_built = time.time()
+    kind = "embark" if is_embark else ("finale" if is_finale else "turn")
+    use_cache = True
+    for attempt in range(1, retry_policy.attempts + 1):
+        #the room's model, or the next model in the fallback chain while it's failing
+        model = model_chain.pick(game_room.ai_model)
+        if model is None:
+            #every model in the chain is failing, don't make the room wait through retries that can't succeed
+            print(f"[AI ERROR] Every model for {game_room.room_id} is unavailable, failing fast.")
+            record_attempt(game_room, kind, attempt, game_room.ai_model, "circuit_open", None, time.time())
+            break
+        if model != game_room.ai_model:
+            print(f"[AI FALLBACK] {game_room.room_id} is using {model} instead of {game_room.ai_model}.")
+        breaker = model_chain.breaker(model)
+        cache_name = None
+        #wait for the key to have room in its per minute limits, rooms sharing the key are served in turn
+        ticket = admission.acquire(active_key, model, game_room.room_id, estimated_input + EXPECTED_OUTPUT_TOKENS,
+                                   on_wait=lambda position: announce_queue_position(game_room.room_id, position))
+        if ticket.waited > 1:
+            socketio.emit('status', {'msg': 'GAOL IS THINKING...'}, room=game_room.room_id)
+        call_start = time.time()
         try:
-            #the actual response generation
-            #if an error occurs here, it will see if it's a code '503' (model overload), if so it will retry the prompt.
+            client = client_pool.get(active_key)
+            #reference the cached prefix when there is one, otherwise the full prompt is sent
+            contents, config = prompt, generation_config
+            if use_cache:
+                contents, config, cache_name = context_cache.prepare(client, active_key, model, game_room.world_id, static_prompt, turn_prompt)
+            #the actual response generation, failures are sorted out by the retry policy below
             print(f"[API CALL] {game_room.room_id} is submitting a turn.")
-            response = game_room.ai_client.models.generate_content(model=game_room.ai_model, contents=prompt, config=generation_config)
+            first_chunk_at = None
+            if STREAM_STORY_TEXT:
+                raw_text, usage, first_chunk_at = stream_ai_response(game_room, client, model, contents, config)
+            else:
+                response = client.models.generate_content(model=model, contents=contents, config=config)
+                raw_text, usage = response.text, response.usage_metadata
+            call_end = time.time()
+            breaker.record_success()
             #save the last raw response to disk as `./data/last_gen.json`
             try:
                 debug_dump = {
                     "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
                     "prompt": prompt,
-                    "raw_response": response.text
+                    "raw_response": raw_text
                 }
                 with open(os.path.join(DATA_DIR, 'last_gen.json'), 'w') as f:
                     json.dump(debug_dump, f, indent=2)
@@ -663,69 +988,108 @@ def generate_ai_response(game_room, is_embark=False, is_finale=False):
                 print(f"[DEBUG ERROR] Could not dump last_gen: {e}")
 
             #save token inputs and outputs alongside a timestamp to get an overview of token usage.
-            if response.usage_metadata:
-                input_tokens = response.usage_metadata.prompt_token_count
-                output_tokens = response.usage_metadata.candidates_token_count
-                total_tokens = response.usage_metadata.total_token_count
-                print(f"[PROMPT INPUT TOKENS] - {input_tokens} | [RESPONSE OUTPUT TOKENS] - {output_tokens} | [TOTAL TOKEN USAGE] - {total_tokens}")
-                print(f"[TOKEN AUDIT] % of Minute Limit: {(input_tokens / 1000000) * 100:.4f}%") # based on 1M TPM limit
-
-                try:
-                    audit_file = os.path.join(DATA_DIR, 'token_audit.json')
-                    audit_data = []
-                    #read existing audit log if it exists
-                    if os.path.exists(audit_file):
-                        with open(audit_file, 'r') as f:
-                            try:
-                                audit_data = json.load(f)
-                            except json.JSONDecodeError:
-                                audit_data = [] #start fresh if corrupted
-                    
-                    #append the new entity
-                    audit_data.append({
-                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                        "input": input_tokens,
-                        "output": output_tokens,
-                        "total": total_tokens,
-                        "world": worlds[game_room.world_id].name,
-                        "player_count": len(game_room.players),
-                        "ai_model": game_room.ai_model
-                    })
-                    
-                    #write back to file
-                    with open(audit_file, 'w') as f:
-                        json.dump(audit_data, f, indent=2)
-                except Exception as e:
-                    print(f"[AUDIT ERROR] Could not save token audit: {e}")
-
-            final_output = process_response(response.text, game_room) #parse JSON string to Python dict
+            input_tokens = output_tokens = total_tokens = cached_tokens = None
+            if usage:
+                input_tokens = usage.prompt_token_count
+                output_tokens = usage.candidates_token_count
+                total_tokens = usage.total_token_count
+                cached_tokens = getattr(usage, 'cached_content_token_count', None)
+                print(f"[PROMPT INPUT TOKENS] - {input_tokens} (cached {cached_tokens or 0}) | [RESPONSE OUTPUT TOKENS] - {output_tokens} | [TOTAL TOKEN USAGE] - {total_tokens}")
+                admission.settle(ticket, total_tokens)
+                print(f"[TOKEN AUDIT] {admission.describe(active_key, model)}")
+
+            parse_start = time.time()
+            final_output = process_response(raw_text, game_room) #parse JSON string to Python dict
+            parse_end = time.time()
+
+            #append the turn to the audit log (written on a background thread)
+            if usage:
+                world = worlds.get(game_room.world_id)
+                token_audit.record({
+                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "ts": parse_end,
+                    "input": input_tokens,
+                    "output": output_tokens,
+                    "total": total_tokens,
+                    "cached": cached_tokens,
+                    "context_cache": cache_name,
+                    "world": world.name if world else "Unknown",
+                    "room": game_room.room_id,
+                    "player_count": len(game_room.players),
+                    "ai_model": model,
+                    "requested_model": game_room.ai_model,
+                    "kind": kind,
+                    "attempt": attempt,
+                    "outcome": "ok",
+                    "estimated_input": estimated_input,
+                    "input_budget": packer.budget,
+                    #per-phase latency in milliseconds
+                    "latency_ms": {
+                        "prompt": round((prompt_built - turn_start) * 1000, 1),
+                        "queued": round(ticket.waited * 1000, 1),
+                        "first_chunk": round((first_chunk_at - call_start) * 1000, 1) if first_chunk_at else None,
+                        "generate": round((call_end - call_start) * 1000, 1),
+                        "parse": round((parse_end - parse_start) * 1000, 1),
+                        "total": round((parse_end - turn_start) * 1000, 1)
+                    }
+                })
             return final_output
-        
-        except errors.APIError as e:
-            tries += 1 #increase the tries counter so we don't infinitely retry
-            if e.code == 503:
-                print(f"[AI ERROR] Model {game_room.ai_model} is currently overloaded. Waiting and retrying...")
-                time.sleep(5)
-            else:
-                print(f"[AI ERROR] Critical API Error: {e}")
-                return {
-                "story_text": "GAOL has gone silent", 
-                "updates": {}, 
-                "world_updates": []
-                }
 
         except Exception as e:
-            tries += 1 #increase the tries counter so we don't infinitely retry
-            #log the actual error to the backend console for debugging
-            print(f"[AI ERROR] Generation failed: {e}")
-            traceback.print_exc()
-            
-            #return a thematic message for failures.
-            return {
-                "story_text": "GAOL has gone silent", 
-                "updates": {}, 
-                "world_updates": []
-            }
+            record_attempt(game_room, kind, attempt, model, "error", e, call_start)
+            api_code = e.code if isinstance(e, errors.APIError) else None
+            if cache_name and api_code is not None and api_code not in RETRYABLE_CODES:
+                #the cache may have expired or been deleted on the API side, drop it and resend uncached
+                print(f"[AI ERROR] Cached request failed ({api_code}), retrying without the context cache.")
+                breaker.record_success() #the model answered, it's the cache that's gone
+                context_cache.invalidate(active_key, model, game_room.world_id)
+                use_cache = False
+                continue
+            if not retry_policy.is_retryable(e):
+                #bad request, bad key, unparseable response... another attempt would end the same way
+                breaker.record_success() #the model answered, it's the request that failed
+                print(f"[AI ERROR] Critical error for {game_room.room_id}: {e}")
+                if api_code is None:
+                    traceback.print_exc()
+                break
+            if api_code in OVERLOAD_BACKOFF:
+                #hold the key's whole line, the retry (and every other room on this key) waits for it in admission.acquire
+                admission.throttle(active_key, model, OVERLOAD_BACKOFF[api_code])
+            if api_code == 429:
+                breaker.record_success() #out of quota on this key, the model itself is fine
+            else:
+                breaker.record_failure()
+            if attempt < retry_policy.attempts:
+                delay = retry_policy.delay(attempt + 1)
+                print(f"[AI ERROR] {model} failed for {game_room.room_id} ({retry_policy.describe(e)}), retrying in {delay:.1f}s...")
+                socketio.sleep(delay) #cooperative sleep, other rooms keep running while we wait
+
+    #return a thematic message for failures.
+    return {
+        "story_text": "GAOL has gone silent", 
+        "updates": {}, 
+        "world_updates": []
+    }
+
+#adds a failed (or skipped) generation attempt to the audit log, successful attempts are recorded with their token counts
+def record_attempt(game_room, kind, attempt, model, outcome, error, started):
+    world = worlds.get(game_room.world_id)
+    now = time.time()
+    token_audit.record({
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "ts": now,
+        "world": world.name if world else "Unknown",
+        "room": game_room.room_id,
+        "player_count": len(game_room.players),
+        "ai_model": model,
+        "requested_model": game_room.ai_model,
+        "kind": kind,
+        "attempt": attempt,
+        "outcome": outcome,
+        "error": retry_policy.describe(error) if error is not None else None,
+        "retryable": retry_policy.is_retryable(error) if error is not None else None,
+        "latency_ms": {"generate": round((now - started) * 1000, 1)}
+    })
 
 #helper function to process AI updates
 def apply_ai_updates(game, ai_data, room_id):
@@ -746,78 +1110,82 @@ def apply_ai_updates(game, ai_data, room_id):
         print(f"[DEBUG] World found in memory. Proceeding with updates...")
         
         try:
-            #add new world events
-            for event in world_updates:
-                world.add_event(event)
+            with worlds.lock(world.id): #rooms sharing this world generate in parallel, one of them changes it at a time
+                world = worlds[game.world_id] #sync_world may have swapped in a fresh copy while we waited
+                #add new world events
+                for event in world_updates:
+                    world.add_event(event)
             
-            #add new entities
-            for group in new_group:   
-                world.add_group(
-                    group.get('name', 'Unknown'),
-                    group.get('type', 'Organization'),
-                    group.get('description', ''),
-                    group.get('keywords', [])
-                )
-                print(f"[LORE] Created Entity: {group.get('name')} | Type: {group.get('type')}")
+                #add new entities
+                for group in new_group:   
+                    world.add_group(
+                        group.get('name', 'Unknown'),
+                        group.get('type', 'Organization'),
+                        group.get('description', ''),
+                        group.get('keywords', [])
+                    )
+                    print(f"[LORE] Created Entity: {group.get('name')} | Type: {group.get('type')}")
             
-            #add new locations with coords
-            for loc in new_locations:
-                world.add_location(
-                    loc.get('name', 'Unknown Place'),
-                    loc.get('type', 'Landmark'),
-                    loc.get('description', ''),
-                    loc.get('x', 0),
-                    loc.get('y', 0),
-                    loc.get('radius', 1),
-                    loc.get('affiliation', 'Independent'),
-                    loc.get('keywords', [])
-                )
-                print(f"[LORE] Created Location: {loc.get('name')} at {loc.get('x')},{loc.get('y')}")
-
-            #add new characters
-            for char in new_characters:
-                world.add_character(
-                    char.get('name', 'Unknown'),
-                    char.get('description', ''),
-                    char.get('role', 'NPC'),
-                    char.get('affiliation', 'None')
-                )
-                print(f"[LORE] Created NPC: {char.get('name')}")
+                #add new locations with coords
+                for loc in new_locations:
+                    world.add_location(
+                        loc.get('name', 'Unknown Place'),
+                        loc.get('type', 'Landmark'),
+                        loc.get('description', ''),
+                        loc.get('x', 0),
+                        loc.get('y', 0),
+                        loc.get('radius', 1),
+                        loc.get('affiliation', 'Independent'),
+                        loc.get('keywords', [])
+                    )
+                    print(f"[LORE] Created Location: {loc.get('name')} at {loc.get('x')},{loc.get('y')}")
+
+                #add new characters
+                for char in new_characters:
+                    world.add_character(
+                        char.get('name', 'Unknown'),
+                        char.get('description', ''),
+                        char.get('role', 'NPC'),
+                        char.get('affiliation', 'None')
+                    )
+                    print(f"[LORE] Created NPC: {char.get('name')}")
         
-            #add new flora/fauna
-            for bio in new_biology:
-                world.add_biology(
-                    bio.get('name', 'Unknown'),
-                    bio.get('description', ''),
-                    bio.get('habitat', ''),
-                    bio.get('disposition', '')
-                )
-                print(f"[LORE] Created Biology: {bio.get('name')}")
-
-            #process location updates (changing affiliation, description)
-            for loc_name, changes in location_updates.items():
-                #find location by name
-                target_loc = next((l for l in world.locations if l.name.lower() == loc_name.lower()), None)
-                if target_loc:
-                    if 'affiliation' in changes:
-                        target_loc.affiliation = changes['affiliation']
-                    if 'description' in changes:
-                        target_loc.description = changes['description']
-                    if 'radius' in changes:
-                        target_loc.radius = changes['radius']
-                    print(f"[LORE] Updated Location: {target_loc.name}")
+                #add new flora/fauna
+                for bio in new_biology:
+                    world.add_biology(
+                        bio.get('name', 'Unknown'),
+                        bio.get('description', ''),
+                        bio.get('habitat', ''),
+                        bio.get('disposition', '')
+                    )
+                    print(f"[LORE] Created Biology: {bio.get('name')}")
+
+                #process location updates (changing affiliation, description)
+                for loc_name, changes in location_updates.items():
+                    #find location by name
+                    target_loc = world.find('locations', loc_name)
+                    if target_loc:
+                        if 'affiliation' in changes:
+                            target_loc.affiliation = changes['affiliation']
+                        if 'description' in changes:
+                            target_loc.description = changes['description']
+                        if 'radius' in changes:
+                            target_loc.radius = changes['radius']
+                        world.mark_changed('locations', target_loc)
+                        print(f"[LORE] Updated Location: {target_loc.name}")
             
-            for char_name, changes in character_updates.items():
-                #get character by name
-                target_character = next((c for c in world.characters if c.name.lower() == char_name.lower()), None)
-                if target_character:
-                    if 'status' in changes:
-                        target_character.status = changes['status']
-                    if 'description' in changes:
-                        target_character.description = changes['description']
+                for char_name, changes in character_updates.items():
+                    #get character by name
+                    target_character = world.find('characters', char_name)
+                    if target_character:
+                        if 'status' in changes:
+                            target_character.status = changes['status']
+                        if 'description' in changes:
+                            target_character.description = changes['description']
+                        world.mark_changed('characters', target_character)
             
-            save_worlds() #save worlds with all the updated/existing lore
-            emit('world_update', world.to_dict(), room=room_id)
+                save_worlds(world.id) #save worlds with all the updated/existing lore
+                publish_world_update(game, world)
             
         except Exception as e:
             print(f"[CRITICAL ERROR] Failed to update world data: {e}")
@@ -843,25 +1211,258 @@ def apply_ai_updates(game, ai_data, room_id):
             if 'description' in changes:
                 target_player.description = changes['description']
 
+##############################
+#      State Publishers      #
+##############################
+
+#sends whatever changed in the party since the last publish to the room as a patch (see party_state.py)
+#to_sid also gets a full snapshot, for players who just joined or reconnected
+def publish_party_state(game, to_sid=None):
+    state = game.party_state
+    patch = state.diff(game.room_id, list(game.players.values()))
+    if patch:
+        if state.patch_is_larger(patch):
+            socketio.emit('game_state_update', state.snapshot(), room=game.room_id)
+        else:
+            socketio.emit('game_state_patch', patch, room=game.room_id)
+    if to_sid:
+        socketio.emit('game_state_update', state.snapshot(), room=to_sid)
+
+#sends the room what changed in its world since the version it was last sent
+#the first update a room gets (or one the change log no longer reaches) is a full snapshot
+def publish_world_update(game, world):
+    with worlds.lock(world.id):
+        diff = world.diff_since(game.world_version) if game.world_version is not None else None
+        snapshot = world.snapshot() if diff is None else None
+        version = world.version
+    if diff is None:
+        socketio.emit('world_snapshot', snapshot, room=game.room_id)
+    elif diff['changes'] or 'major_events' in diff:
+        diff['room'] = game.room_id
+        socketio.emit('world_update', diff, room=game.room_id)
+    game.world_version = version
+
+#a full copy of a world for a joining player and the version it is at, taken together so a diff can't slip in between
+def world_snapshot(world):
+    with worlds.lock(world.id):
+        return world.snapshot(), world.version
+
+##############################
+#            Lobby           #
+##############################
+
+#the row a room has in the lobby's room list, None once the room is gone
+def lobby_row(room_id):
+    g = games.get(room_id)
+    if g is None:
+        return None
+    world_name = "Unknown"
+    if g.world_id and g.world_id in worlds:
+        world_name = worlds.header(g.world_id)['name']
+    return {
+        'id': g.room_id,
+        'world': world_name,
+        'world_id': g.world_id,
+        'setting': g.setting,
+        'player_count': len(g.players),
+        'max_players': ROOM_CAPACITY,
+        'is_started': g.is_started,
+        'has_custom_key': bool(g.custom_api_key),   #sends if the room has a custom API key
+        'is_private': bool(g.password)              #indicates if room is password protected
+    }
+
+#the room list, rows are rebuilt only for the rooms touched since the last lobby update
+lobby = LobbyIndex(lobby_row)
+LOBBY_INTERVAL = 1          #seconds between room_list_delta pushes, changes in between are sent together
+LOBBY_SYNC_INTERVAL = 5     #seconds between checks for rooms changed on other workers (shared backend only)
+
+#pushes the rooms that changed to everyone looking at the room list, each gets only what matches their filters
+def publish_lobby():
+    last_sync = 0
+    while True:
+        socketio.sleep(LOBBY_INTERVAL)
+        try:
+            if state_backend.shared and lobby.has_subscribers() and time.time() - last_sync >= LOBBY_SYNC_INTERVAL:
+                last_sync = time.time()
+                sync_rooms() #rooms created, joined or closed on other workers
+            push_lobby_changes()
+        except Exception as e:
+            print(f"[LOBBY] Could not update the room list: {e}")
+
+def push_lobby_changes():
+    changes = lobby.refresh()
+    for sid, delta in lobby.deltas(changes):
+        socketio.emit('room_list_delta', delta, room=sid)
+
+##############################
+#           History          #
+##############################
+
+#every message a room keeps goes through here: archived in full (written in the background), kept in memory only while it's recent
+def append_history(game, message):
+    transcripts.append(game.room_id, [message])
+    if game.add_message(message):
+        #enough messages have left the window, fold them into the summary off the turn's critical path
+        game.summarizing = True
+        socketio.start_background_task(summarize_history, game.room_id)
+
+#newest page of a room's transcript for join payloads, older pages are fetched with get_history
+def latest_history_page(game):
+    if not game.is_started:
+        return [], 0
+    return transcripts.read_page(game.room_id, None, PAGE_SIZE)
+
+#background task, folds the messages that left the history window into the room's rolling summary
+def summarize_history(room_id):
+    try:
+        #copy what the summarizer needs while holding the room, handlers append to it on other threads
+        with room_lease(room_id) as lease:
+            game = games.get(room_id) #refreshed by the lease
+            if lease is None or game is None:
+                return
+            batch = list(game.pending_summary)
+            old_summary = game.summary
+            api_key = active_api_key(game)
+            world = worlds.get(game.world_id)
+            world_name = world.name if world else "Unknown"
+            player_count = len(game.players)
+        if not batch:
+            return
+        prompt = SUMMARY_PROMPT.format(
+            max_words=SUMMARY_MAX_CHARS // 6,
+            summary=old_summary or "Nothing yet, the story has just begun.",
+            events="\n".join(message_line(m) for m in batch)
+        )
+        summary = None
+        if api_key:
+            try:
+                #summaries share the key's limits with the turns, they wait in the same line
+                ticket = admission.acquire(api_key, SUMMARY_MODEL, room_id, estimate_tokens(prompt) + SUMMARY_MAX_CHARS // 4)
+                response = client_pool.get(api_key).models.generate_content(model=SUMMARY_MODEL, contents=prompt)
+                summary = (response.text or "").strip()
+                usage = response.usage_metadata
+                if usage:
+                    admission.settle(ticket, usage.total_token_count)
+                    token_audit.record({
+                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "ts": time.time(),
+                        "input": usage.prompt_token_count,
+                        "output": usage.candidates_token_count,
+                        "total": usage.total_token_count,
+                        "world": world_name,
+                        "room": room_id,
+                        "player_count": player_count,
+                        "ai_model": SUMMARY_MODEL,
+                        "kind": "summary"
+                    })
+            except Exception as e:
+                print(f"[HISTORY ERROR] Summarizer failed for {room_id}, using the fallback summary: {e}")
+        if not summary:
+            summary = fallback_summary(old_summary, batch)
+        with room_lease(room_id) as lease:
+            game = games.get(room_id) #refreshed by the lease, another worker may have folded this batch already
+            if lease is None or game is None or game.pending_summary[:len(batch)] != batch:
+                return
+            game.summary = trim_summary(summary)
+            #only drop what was summarized, more messages may have left the window in the meantime
+            del game.pending_summary[:len(batch)]
+            save_rooms(room_id)
+        print(f"[HISTORY] Folded {len(batch)} messages into the summary for {room_id} ({len(game.summary)} chars)")
+    finally:
+        with games.lock(room_id):
+            game = games.get(room_id)
+            if game:
+                game.summarizing = False
+
+##############################
+#       Generation Jobs      #
+##############################
+
+#generation is slow (multiple seconds per turn), so it never runs inside a socket handler.
+#handlers queue a job and return immediately, the job runs as a cooperative background task
+#and emits its results to the room once the AI has answered. This lets one worker keep many rooms generating at once.
+#NOTE: jobs run outside of the request context, so everything they call has to use socketio.emit instead of emit.
+active_jobs = {} # {'room_id': job kind} rooms that currently have a generation in flight
+
+#queues a generation job for the room, kind is one of 'turn', 'embark', 'finale'
+#turn_id comes from game.begin_turn(), the result is only applied while that turn is still the one generating
+def start_generation_job(room_id, kind, turn_id):
+    active_jobs[room_id] = kind
+    print(f"[JOBS] Queued {kind} generation for Room {room_id} (turn {turn_id}). ({len(active_jobs)} in flight)")
+    socketio.start_background_task(run_generation_job, room_id, kind, turn_id)
+
+#the background task itself, generates the response and hands it to the matching completion step
+def run_generation_job(room_id, kind, turn_id):
+    try:
+        sync_room(room_id) #generate from the latest state, the lease is only held while the result is applied
+        game = games.get(room_id)
+        if not game:
+            return
+        ai_data = generate_ai_response(game, is_embark=(kind == 'embark'), is_finale=(kind == 'finale'))
+        with room_lease(room_id, wait=LEASE_TTL) as lease:
+            #the room may have been closed while GAOL was thinking
+            game = games.get(room_id)
+            if lease is None or game is None:
+                print(f"[JOBS] Room {room_id} closed during generation, discarding result.")
+                return
+            #exactly one result is applied per turn, anything else is a duplicate or a job that outlived its turn
+            if not game.begin_applying(turn_id):
+                print(f"[JOBS] Dropping {kind} result for Room {room_id}, turn {turn_id} is no longer generating.")
+                return
+            apply_ai_updates(game, ai_data, room_id)
+            if kind == 'embark':
+                complete_embark(game, ai_data, room_id)
+            elif kind == 'finale':
+                complete_finale(game, ai_data, room_id)
+            else:
+                complete_turn(game, ai_data, room_id)
+            finish_turn(game, turn_id)
+    except Exception as e:
+        print(f"[JOBS ERROR] {kind} generation for Room {room_id} failed: {e}")
+        traceback.print_exc()
+        socketio.emit('status', {'msg': 'GAOL has gone silent'}, room=room_id)
+        #don't leave the room stuck generating, the players can try the turn again
+        with room_lease(room_id) as lease:
+            game = games.get(room_id)
+            if lease is not None and game is not None:
+                finish_turn(game, turn_id)
+    finally:
+        active_jobs.pop(room_id, None)
+
+#back to collecting actions, moves sent while GAOL was thinking are locked in for the new turn
+def finish_turn(game, turn_id):
+    applied = game.end_turn(turn_id)
+    if not applied:
+        return
+    names = ", ".join(p.username for p in applied)
+    print(f"[TURN] Room {game.room_id} carried over queued actions from {names}.")
+    publish_party_state(game)
+    #everyone may already have moved (e.g. a single player), then the next turn starts right away
+    if game.is_started and not game.is_finished and game.all_players_acted():
+        process_turn(game.room_id)
+
 #extracted turn processing so it can be triggered by disconnects or actions
 def process_turn(room_id):
     if room_id not in games: return
     game = games[room_id]
+
+    #only one generation per turn, a second trigger (two last actions at once, a disconnect racing an action) stops here
+    turn_id = game.begin_turn()
+    if turn_id is None:
+        print(f"[TURN] Room {room_id} is already generating turn {game.turn_id}, ignoring the extra trigger.")
+        return
     
     #we compile all the player actions and their summaries to send in one block to the AI prompt
     turn_summary = game.compile_turn_actions()
-    game.history.append({'sender': 'Party', 'text': turn_summary, 'type': 'story'})
-    emit('message', {'sender': 'Party', 'text': turn_summary}, room=room_id)
+    append_history(game, {'sender': 'Party', 'text': turn_summary, 'type': 'story'})
+    socketio.emit('message', {'sender': 'Party', 'text': turn_summary}, room=room_id)
     
     #generate the AI response in the form of a JSON file
-    emit('status', {'msg': 'GAOL IS THINKING...'}, room=room_id)
-    
-    #small sleep to allow the frontend to update the status ticker before blocking
-    socketio.sleep(0.1)
-    
-    ai_data = generate_ai_response(game)
-    apply_ai_updates(game, ai_data, room_id)
-    
+    socketio.emit('status', {'msg': 'GAOL IS THINKING...'}, room=room_id)
+    start_generation_job(room_id, 'turn', turn_id)
+
+#second half of a turn, runs once the AI response is back
+def complete_turn(game, ai_data, room_id):
     #extract the story text to display on the console
     story_text = ai_data.get('story_text', 'The DM remains silent.')
     
@@ -871,33 +1472,48 @@ def process_turn(room_id):
         game.dm_override = None
 
     #display the current narrative to the room
-    game.history.append({'sender': 'GAOL', 'text': story_text, 'type': 'story'})
-    emit('message', {'sender': 'GAOL', 'text': story_text}, room=room_id)
+    append_history(game, {'sender': 'GAOL', 'text': story_text, 'type': 'story'})
+    socketio.emit('message', {'sender': 'GAOL', 'text': story_text}, room=room_id)
     
     #reset everyones turns
     game.reset_turns()
-    save_rooms()
-    save_players()
+    save_rooms(room_id)
+    save_players(room_id)
     
     #status back to waiting for move
-    emit('status', {'msg': 'GAOL awaits your move...'}, room=room_id)
+    socketio.emit('status', {'msg': 'GAOL awaits your move...'}, room=room_id)
     
     #display the status updates for each player, and update the frontend character sheets to reflect this.
-    game_state_export = [
-        {
-            'name': p.username,                 #characters name
-            'hp': p.hp,                         #characters health (x/100)
-            'status': p.status,                 #characters status (Healthy, Transformed, etc.)
-            'has_acted': p.has_acted,           #has the player input an action yet?
-            'is_ready': p.is_ready,             #is the player ready (input action or submitted character sheet)
-            'tags': p.tags,                     #characters tags
-            'ambition': p.ambition,             #characters ambition/goal
-            'secret': p.secret,                 #characters secrets
-            'description': p.description        #characters description
-        } 
-        for p in game.players.values()
-    ]
-    emit('game_state_update', game_state_export, room=room_id)
+    publish_party_state(game)
+
+#second half of the embark, displays the opening scenario
+def complete_embark(game, ai_data, room_id):
+    story_text = ai_data.get('story_text', 'The adventure begins...')
+    
+    #display the current narrative to the room
+    append_history(game, {'sender': 'GAOL', 'text': story_text, 'type': 'story'})
+    socketio.emit('message', {'sender': 'GAOL', 'text': story_text}, room=room_id)
+    
+    save_rooms(room_id) #save the room and begin saving history
+
+    #game is officially on, set status
+    socketio.emit('status', {'msg': 'GAOL awaits your move...'}, room=room_id)
+    
+    #update frontend to clear ready flags
+    publish_party_state(game)
+
+#second half of the finale, closes out the campaign
+def complete_finale(game, ai_data, room_id):
+    story_text = ai_data.get('story_text')
+    append_history(game, {'sender': 'GAOL', 'text': story_text, 'type': 'story'})
+    socketio.emit('message', {'sender': 'GAOL', 'text': story_text}, room=room_id)
+    save_rooms(room_id)
+    socketio.emit('status', {'msg': 'GAOL has moved on...'}, room=room_id)
+
+    #update frontend to clear ready flags
+    game.is_finished = True
+    publish_party_state(game)
+    print(f"[ROOM] Finalized {game.room_id}.")
 
 ########################################################################
 #                         Server Handlers                              #
@@ -915,18 +1531,10 @@ def index():
 #fetches worlds for the frontend dropdown
 @socketio.on('get_worlds')
 def handle_get_worlds():
-    world_list = []
-    for k, v in worlds.items():
-        world_list.append({
-            'id': k,
-            'name': v.name,
-            'setting': v.setting,
-            'realism': v.realism,
-            'description': v.description,
-            'width': v.width,
-            'height': v.height
-        })
-    emit('world_list', world_list)
+    if state_backend.shared:
+        worlds.load_headers() #worlds created on other workers
+    #headers only, listing the worlds never loads their lore
+    emit('world_list', worlds.all_headers())
     
     #tell the client if the server has a default .env key
     has_key = bool(DEFAULT_API_KEY and len(DEFAULT_API_KEY) > 10)
@@ -934,6 +1542,7 @@ def handle_get_worlds():
 
 #handles room creation logic separate from joining
 @socketio.on('create_room')
+@room_event
 def handle_create_room(data):
     room_id = data['room']
     username = data['username']
@@ -945,6 +1554,7 @@ def handle_create_room(data):
     new_world_name = data.get('new_world_name')
     custom_api_key = data.get('custom_api_key')
     password = data.get('password') # retrieve optional password
+    input_token_budget = data.get('input_token_budget') # optional prompt budget override (tokens)
     
     #width and height from the frontend payload (defaulting if missing)
     req_width = data.get('width', 1024)
@@ -978,7 +1588,7 @@ def handle_create_room(data):
         )
         worlds[w.id] = w
         final_world_id = w.id
-        save_worlds() 
+        save_worlds(w.id) 
     elif world_selection in worlds:
         #load existing world and OVERRIDE provided settings
         final_world_id = world_selection
@@ -991,13 +1601,15 @@ def handle_create_room(data):
             print("[SYSTEM] No worlds found, fallback world created.")
             w = World("Gaia", "Medieval Fantasy", "High", "The default world.", 1024, 512)
             worlds[w.id] = w
-            save_worlds() 
+            save_worlds(w.id) 
         final_world_id = list(worlds.keys())[0]
 
     games[room_id] = GameRoom(room_id, final_setting, final_realism, final_world_id, custom_api_key, password)
+    if isinstance(input_token_budget, int) and input_token_budget > 0:
+        games[room_id].input_token_budget = input_token_budget
     
     #save the room after it's been created
-    save_rooms()
+    save_rooms(room_id)
 
     #manually trigger join logic for the creator
     #using a helper function logic here would be cleaner but keeping inline for now
@@ -1005,6 +1617,7 @@ def handle_create_room(data):
 
 #someone joins a room
 @socketio.on('join')
+@room_event
 def on_join(data):
     username = data['username']
     room = data['room']
@@ -1036,6 +1649,8 @@ def on_join(data):
             del game.players[old_sid]
         target_ghost.sid = sid
         target_ghost.connect = True
+        target_ghost.dc_timer = None
+        disconnect_timers.cancel((room, username))
         game.players[sid] = target_ghost
         #if the ghost was an admin, reassign the admin rights
         if game.admin_sid == old_sid or game.admin_sid == f"offline_{username}":
@@ -1058,70 +1673,112 @@ def on_join(data):
             game.admin_sid = sid # Set the admin SID to the creator/first joiner
         game.add_player(sid, username)
 
-    save_players()
-    save_rooms()
+    save_players(room)
+    save_rooms(room)
 
     #hot-join player logic
-    #NOTE: I see a potential bug/issue when a player joins and hasn't yet filled out their character sheet. This should be tested.
+    #their first move is joining the party, if GAOL is mid-turn it's held for the next turn like any other late action
     if game.is_started:
         p = game.players[sid]
-        p.has_acted = True
-        p.current_action = "Joins the party."
         p.is_ready = True #ensure they don't block checks
+        game.submit_action(p, "Joins the party.", None)
         emit('status', {'msg': 'Game in progress. You will join next turn.'}, room=sid)
     
     emit('status', {'msg': f'{username} CONNECTED.'}, room=room)
     
     #signal to frontend that join was successful so it can swap views
-    #sending history ensures late joiners don't see the 'waiting for host' screen
+    #sending history ensures late joiners don't see the 'waiting for host' screen, only the latest page is sent
+    lobby.unsubscribe(sid) #in a room now, no more room list updates
+    history_page, history_start = latest_history_page(game)
+    world_details, world_version = world_snapshot(current_world)
     emit('join_success', {
         'room': room, 
         'username': username,
         'world': current_world.name,
-        'world_details': current_world.to_dict(), #send full world details
+        'world_details': world_details, #send full world details, world_update diffs apply on top of its version
         'is_admin': is_admin, # pass admin flag to frontend
-        'history': game.history if game.is_started else []
+        'history': history_page,
+        'history_start': history_start #seq of the first message sent, the client pages back from here with get_history
     }, room=sid)
 
-    #send immediate state update so the new player sees existing cards
-    game_state_export = [
-        {
-            'name': p.username, 
-            'hp': p.hp, 
-            'status': p.status, 
-            'has_acted': p.has_acted, 
-            'is_ready': p.is_ready, 
-            'tags': p.tags,
-            'ambition': p.ambition,
-            'secret': p.secret,
-            'description': p.description
-        } 
-        for p in game.players.values()
-    ]
-    emit('game_state_update', game_state_export, room=room)
+    #the room's world diffs start from the oldest snapshot any of its players has
+    if game.world_version is None:
+        game.world_version = world_version
 
+    #push the new card to the room, the new player gets the whole party so they see existing cards
+    publish_party_state(game, to_sid=sid)
+
+#one page of the room list, optional 'filters' (see lobby.parse_filters), 'page' and 'page_size'
+#the client is subscribed to room_list_delta for its filters until it joins a room or disconnects
 @socketio.on('get_rooms')
-def handle_get_rooms():
-    #compile a list of active rooms
-    room_data = []
-    for g in games.values():
-        world_name = "Unknown"
-        if g.world_id and g.world_id in worlds:
-            world_name = worlds[g.world_id].name
-            
-        room_data.append({
-            'id': g.room_id,
-            'world': world_name,
-            'setting': g.setting,
-            'player_count': len(g.players),
-            'is_started': g.is_started,
-            'has_custom_key': bool(g.custom_api_key),   #sends if the room has a custom API key
-            'is_private': bool(g.password)              #indicates if room is password protected
-        })
-    emit('room_list', room_data)
+def handle_get_rooms(data=None):
+    data = data if isinstance(data, dict) else {}
+    filters = parse_filters(data.get('filters'))
+    sync_rooms() #rooms created or closed on other workers
+    push_lobby_changes() #so the page includes changes the lobby loop hasn't pushed yet
+    lobby.subscribe(request.sid, filters)
+    emit('room_list', lobby.query(filters, data.get('page', 0), data.get('page_size')))
+
+#stop pushing room list changes to this client
+@socketio.on('unsubscribe_rooms')
+def handle_unsubscribe_rooms():
+    lobby.unsubscribe(request.sid)
+
+#older pages of the chat for a client scrolling back, 'before' is the seq of the oldest message it has
+@socketio.on('get_history')
+@room_event
+def handle_get_history(data):
+    room_id = data.get('room')
+    before = data.get('before')
+    limit = data.get('limit', PAGE_SIZE)
+    sid = request.sid
+
+    if room_id not in games: return
+    game = games[room_id]
+    #only players in the room can read its transcript
+    if sid not in game.players: return
+    if not isinstance(before, int) or not isinstance(limit, int): return
+
+    #read_page waits for this room's queued appends, so the page includes the newest messages
+    messages, start = transcripts.read_page(room_id, before, min(limit, PAGE_SIZE))
+    emit('history_page', {'room': room_id, 'messages': messages, 'start': start}, room=sid)
+
+#world changes since the version a client has, or a snapshot if the server can't diff from there
+@socketio.on('get_world_diff')
+@room_event
+def handle_get_world_diff(data):
+    room_id = data.get('room')
+    since = data.get('since')
+    sid = request.sid
+    if room_id not in games: return
+    game = games[room_id]
+    if sid not in game.players or game.world_id not in worlds: return
+    world = worlds[game.world_id]
+
+    #the epoch, the diff and the snapshot have to come from the same version of the world
+    with worlds.lock(world.id):
+        diff = world.diff_since(since) if data.get('epoch') == world.epoch else None
+        snapshot = world.snapshot() if diff is None else None
+    if diff is None:
+        emit('world_snapshot', snapshot, room=sid)
+    else:
+        diff['room'] = room_id
+        emit('world_update', diff, room=sid)
+
+#full party snapshot for a client whose patches fell out of sync
+@socketio.on('get_game_state')
+@room_event
+def handle_get_game_state(data):
+    room_id = data.get('room')
+    sid = request.sid
+    if room_id not in games: return
+    game = games[room_id]
+    if sid not in game.players: return
+    publish_party_state(game, to_sid=sid)
 
 #manual leave handler to avoid ghost sockets
 @socketio.on('leave_room')
+@room_event
 def on_leave(data):
     sid = request.sid
     room_id = data.get('room')
@@ -1131,8 +1788,7 @@ def on_leave(data):
         game = games[room_id]
         if game.admin_sid == sid:
             emit('room_closed', {'msg': 'The host has ended the session.'}, room=room_id)
-            del games[room_id]
-            save_rooms()
+            close_room(room_id)
             return
             
         name = game.players[sid].username
@@ -1140,53 +1796,34 @@ def on_leave(data):
         emit('status', {'msg': f'{name} has left the party.'}, room=room_id)
         
         if len(game.players) == 0:
-            del games[room_id]
-            save_rooms()
+            close_room(room_id)
         else:
-            save_players()
-            save_rooms()
-            game_state_export = [
-                {
-                    'name': p.username, 'hp': p.hp, 'status': p.status, 
-                    'has_acted': p.has_acted, 'is_ready': p.is_ready, 
-                    'tags': p.tags, 'ambition': p.ambition, 'secret': p.secret, 'description': p.description
-                } 
-                for p in game.players.values()
-            ]
-            emit('game_state_update', game_state_export, room=room_id)
+            save_players(room_id)
+            save_rooms(room_id)
+            publish_party_state(game)
 
 #handle when a player disconnects
 @socketio.on('disconnect')
 def on_disconnect():
     sid = request.sid
-    for room_id, game in list(games.items()):
-        game = games[room_id]
-        if sid in game.players:
+    lobby.unsubscribe(sid)
+    for room_id in [r for r, g in list(games.items()) if sid in g.players]:
+        with room_lease(room_id) as lease:
+            game = games.get(room_id) #refreshed by the lease
+            if lease is None or game is None or sid not in game.players:
+                continue
             # Check if the disconnecting player is the host (admin)
             p = game.players[sid]
             p.connect = False
             p.dc_timer = time.time()
+            disconnect_timers.schedule((room_id, p.username), p.dc_timer + DISCONNECT_GRACE)
             print(f"[CONNECTION] {p.username} disconnected. Grace period (5 Minutes) started.")
 
-            save_players() #make a save of the players in the room
-            save_rooms()   #make a save of the rooms
+            save_players(room_id) #make a save of the players in the room
+            save_rooms(room_id)   #make a save of the rooms
             
             #push new state immediately to prevent ghost cards
-            game_state_export = [
-                {
-                    'name': p.username, 
-                    'hp': p.hp, 
-                    'status': p.status, 
-                    'has_acted': p.has_acted, 
-                    'is_ready': p.is_ready, 
-                    'tags': p.tags,
-                    'ambition': p.ambition, 
-                    'secret': p.secret,
-                    'description': p.description
-                } 
-                for p in game.players.values()
-            ]
-            emit('game_state_update', game_state_export, room=room_id)
+            publish_party_state(game)
 
             #check if the game was waiting on this person
             if game.is_started and len(game.players) > 0 and game.all_players_acted():
@@ -1194,6 +1831,7 @@ def on_disconnect():
 
 #handle user rejoin (refreshing the page, losing connection etc.)
 @socketio.on('rejoin')
+@room_event
 def handle_rejoin(data):
     username = data.get('username')
     room_id = data.get('room')
@@ -1219,6 +1857,7 @@ def handle_rejoin(data):
             target_player.sid = new_sid
             target_player.connect = True
             target_player.dc_timer = None #stop the DC timer
+            disconnect_timers.cancel((room_id, username))
             # if player has data but is marked 'not ready' (due to refresh or legacy file), force ready.
             if target_player.description and len(target_player.tags) > 0 and not target_player.is_ready:
                 print(f"[SYSTEM] Auto-locking player {username} due to existing data.")
@@ -1236,27 +1875,25 @@ def handle_rejoin(data):
             current_world = worlds[game.world_id]
             
             #emit Success with the is_admin flag
+            lobby.unsubscribe(new_sid)
+            history_page, history_start = latest_history_page(game)
+            world_details, world_version = world_snapshot(current_world)
             emit('join_success', {
                 'room': room_id, 
                 'username': username,
                 'world': current_world.name,
-                'world_details': current_world.to_dict(), 
+                'world_details': world_details, 
                 'is_admin': was_admin,  #explicitly send the captured status
-                'history': game.history if game.is_started else []
+                'history': history_page,
+                'history_start': history_start
             }, room=new_sid)
+            if game.world_version is None:
+                game.world_version = world_version
             
             emit('status', {'msg': f'{username} reconnected.'}, room=room_id)
             
-            #emit the party state immediately so the grid repopulates
-            game_state_export = [
-                {
-                    'name': p.username, 'hp': p.hp, 'status': p.status, 
-                    'has_acted': p.has_acted, 'is_ready': p.is_ready, 
-                    'tags': p.tags, 'ambition': p.ambition, 'secret': p.secret, 'description': p.description
-                } 
-                for p in game.players.values()
-            ]
-            emit('game_state_update', game_state_export, room=room_id)
+            #emit the party state immediately so the grid repopulates (in full for the reconnected player)
+            publish_party_state(game, to_sid=new_sid)
             return
         else:
              print(f"[DEBUG REJOIN] Player {username} not found in memory for room {room_id}")
@@ -1266,6 +1903,7 @@ def handle_rejoin(data):
 
 #handling player ready status in lobby
 @socketio.on('player_ready')
+@room_event
 def handle_player_ready(data):
     #room stuff
     room = data['room']
@@ -1297,71 +1935,38 @@ def handle_player_ready(data):
         player.secret = secret
         player.is_ready = True
 
-        save_players() #save updated player data
+        save_players(room) #save updated player data
         
         #emit updated state
-        game_state_export = [
-            {
-                'name': p.username, 
-                'hp': p.hp, 
-                'status': p.status, 
-                'has_acted': p.has_acted, 
-                'is_ready': p.is_ready, 
-                'tags': p.tags,
-                'ambition': p.ambition,
-                'secret': p.secret,
-                'description': p.description
-            } 
-            for p in game.players.values()
-        ]
-        emit('game_state_update', game_state_export, room=room)
+        publish_party_state(game)
         emit('status', {'msg': f'{player.username} is READY.'}, room=room)
 
 #handling game finale to finish a campaign
 @socketio.on('finale')
+@room_event
 def handle_finale(data):
     room = data['room']
-    game = games[room]
     sid = request.sid
-    print(f"[ROOMS] Room {game.room_id} entering finale.")
     if room not in games:
         return
+    game = games[room]
+    print(f"[ROOMS] Room {game.room_id} entering finale.")
     
     #make sure the player submitting the finale is the admin.
     if game.admin_sid != sid:
         emit('status', {'msg': 'UNAUTHORIZED.'}, room=sid)
         return
     
+    turn_id = game.begin_turn()
+    if turn_id is None:
+        emit('status', {'msg': 'GAOL is still thinking, try again once the turn is over.'}, room=sid)
+        return
     emit('status', {'msg': 'FINALIZING CAMPAIGN...'}, room=room)
-    ai_data = generate_ai_response(game, is_finale=True)
-    apply_ai_updates(game, ai_data, room)
-    story_text = ai_data.get('story_text')
-    game.history.append({'sender': 'GAOL', 'text': story_text, 'type': 'story'})
-    emit('message', {'sender': 'GAOL', 'text': story_text}, room=room)
-    save_rooms()
-    emit('status', {'msg': 'GAOL has moved on...'})
-
-    #update frontend to clear ready flags
-    game_state_export = [
-        {
-            'name': p.username, 
-            'hp': p.hp, 
-            'status': p.status, 
-            'has_acted': p.has_acted, 
-            'is_ready': p.is_ready, 
-            'tags': p.tags,
-            'ambition': p.ambition,
-            'secret': p.secret,
-            'description': p.description
-        } 
-        for p in game.players.values()
-    ]
-    game.is_finished = True
-    emit('game_state_update', game_state_export, room=room)
-    print(f"[ROOM] Finalized {game.room_id}.")
+    start_generation_job(room, 'finale', turn_id)
 
 #handling embark logic to start the game
 @socketio.on('embark')
+@room_event
 def handle_embark(data):
     room = data['room']
     if room not in games:
@@ -1373,6 +1978,10 @@ def handle_embark(data):
     if not game.all_players_ready():
         emit('status', {'msg': 'Cannot Embark: Not all players are ready.'}, room=room)
         return
+    #a second embark press while the intro is generating does nothing
+    turn_id = game.begin_turn()
+    if turn_id is None:
+        return
 
     game.is_started = True
     #clean up lobby ready flags so they don't interfere with game turn flags
@@ -1382,38 +1991,11 @@ def handle_embark(data):
     emit('status', {'msg': 'INITIALIZING SCENARIO...'}, room=room)
     
     #generate the intro
-    ai_data = generate_ai_response(game, is_embark=True)
-    apply_ai_updates(game, ai_data, room)
-    story_text = ai_data.get('story_text', 'The adventure begins...')
-    
-    #display the current narrative to the room
-    game.history.append({'sender': 'GAOL', 'text': story_text, 'type': 'story'})
-    emit('message', {'sender': 'GAOL', 'text': story_text}, room=room)
-    
-    save_rooms() #save the room and begin saving history
-
-    #game is officially on, set status
-    emit('status', {'msg': 'GAOL awaits your move...'}, room=room)
-    
-    #update frontend to clear ready flags
-    game_state_export = [
-        {
-            'name': p.username, 
-            'hp': p.hp, 
-            'status': p.status, 
-            'has_acted': p.has_acted, 
-            'is_ready': p.is_ready, 
-            'tags': p.tags,
-            'ambition': p.ambition,
-            'secret': p.secret,
-            'description': p.description
-        } 
-        for p in game.players.values()
-    ]
-    emit('game_state_update', game_state_export, room=room)
+    start_generation_job(room, 'embark', turn_id)
 
 #admin story injections
 @socketio.on('submit_override')
+@room_event
 def handle_admin_override(data):
     room = data['room']
     override_text = data['text']
@@ -1437,11 +2019,12 @@ def handle_admin_override(data):
     admin_name = game.players[sid].username
     whisper_msg = {'sender': 'System', 'text': f'*{admin_name}* whispers to GAOL...', 'type': 'story'}
     #append to history so it persists
-    game.history.append(whisper_msg)
+    append_history(game, whisper_msg)
     emit('message', whisper_msg, room=room)
 
 #admin model switcher
 @socketio.on('change_model')
+@room_event
 def handle_model_change(data):
     room = data['room']
     new_model_name = data['model']
@@ -1456,12 +2039,16 @@ def handle_model_change(data):
         return
 
     try:
-        room.ai_model = genai.GenerativeModel(new_model_name)
+        if not isinstance(new_model_name, str) or not new_model_name.startswith('gemini-'):
+            raise ValueError(f"unknown model {new_model_name!r}")
+        #the model is just a name on the room, the next generation picks it up (with the usual fallbacks behind it)
+        game.ai_model = new_model_name
+        save_rooms(room)
         print(f"[ADMIN] System Model Switched to: {new_model_name}")
         
         #broadcast the shift message
         shift_msg = {'sender': 'System', 'text': 'A shift occurs in the mind of GAOL...', 'type': 'story'}
-        game.history.append(shift_msg)
+        append_history(game, shift_msg)
         emit('message', shift_msg, room=room)
         emit('status', {'msg': f'Model updated to {new_model_name}'}, room=sid)
     except Exception as e:
@@ -1470,6 +2057,7 @@ def handle_model_change(data):
 
 #updating api key
 @socketio.on('update_api_key')
+@room_event
 def handle_update_api_key(data):
     room = data['room']
     new_key = data['new_key']
@@ -1488,6 +2076,7 @@ def handle_update_api_key(data):
 
 #promoting a player to admin
 @socketio.on('promote_player')
+@room_event
 def handle_promote_player(data):
     room = data['room']
     target_name = data['target_name']
@@ -1523,20 +2112,13 @@ def handle_promote_player(data):
         emit('status', {'msg': f'ADMIN TRANSFERRED TO {target_name}'}, room=room)
         
         #Update room list data (since key might have changed)
-        save_rooms()
-
-        game_state_export = [
-            {
-                'name': p.username, 'hp': p.hp, 'status': p.status, 
-                'has_acted': p.has_acted, 'is_ready': p.is_ready, 
-                'tags': p.tags, 'ambition': p.ambition, 'secret': p.secret, 'description': p.description
-            } 
-            for p in game.players.values()
-        ]
-        emit('game_state_update', game_state_export, room=room)
+        save_rooms(room)
+
+        publish_party_state(game)
 
 #kicking a player
 @socketio.on('kick_player')
+@room_event
 def handle_kick_player(data):
     room = data['room']
     target_name = data['target_name']
@@ -1562,22 +2144,15 @@ def handle_kick_player(data):
         game.remove_player(target_sid)
         emit('status', {'msg': f'{target_name} was kicked.'}, room=room)
         
-        save_players()
-        save_rooms()
+        save_players(room)
+        save_rooms(room)
         
         #update state
-        game_state_export = [
-            {
-                'name': p.username, 'hp': p.hp, 'status': p.status, 
-                'has_acted': p.has_acted, 'is_ready': p.is_ready, 
-                'tags': p.tags, 'ambition': p.ambition, 'secret': p.secret, 'description': p.description
-            } 
-            for p in game.players.values()
-        ]
-        emit('game_state_update', game_state_export, room=room)
+        publish_party_state(game)
         
 #handling player actions
 @socketio.on('player_action')
+@room_event
 def handle_action(data):
     #check to make sure the rooms and players exist
     room = data['room']
@@ -1592,30 +2167,16 @@ def handle_action(data):
     if not player:
         return
     
-    #lock in players move
-    player.current_action = action_text
-    player.current_roll = roll
-    player.has_acted = True
+    #lock in players move, if GAOL is still working on the last turn it counts for the next one
+    if game.submit_action(player, action_text, roll):
+        emit('status', {'msg': f'{player.username} has locked in their move for the next turn...'}, room=room)
+        return
     
     #notify that a player has finished submitting their action (does not display their input)
     emit('status', {'msg': f'{player.username} has locked in their move...'}, room=room)
     
     #update game state immediately to show ready status
-    game_state_export = [
-        {
-            'name': p.username, 
-            'hp': p.hp, 
-            'status': p.status, 
-            'has_acted': p.has_acted, 
-            'is_ready': p.is_ready, 
-            'tags': p.tags, 
-            'ambition': p.ambition, 
-            'secret': p.secret,
-            'description': p.description
-        } 
-        for p in game.players.values()
-    ]
-    emit('game_state_update', game_state_export, room=room)
+    publish_party_state(game)
 
     #see if all players have acted.
     if not game.all_players_acted():
@@ -1628,18 +2189,20 @@ def handle_action(data):
 print("[SYSTEM] Initializing GAOL context...")
 load_worlds()     # load worlds on startup
 load_game_state() # load rooms and players on startup
-
-#this forces any schema updates (like adding missing 'entities' keys) to disk immediately.
-save_worlds() 
+for r_id in games: #build the room list once, after that only touched rooms are rebuilt
+    lobby.touch(r_id)
+lobby.refresh()
 
 #seed a default world if empty
 if not worlds:
     print("[SYSTEM] No worlds found, creating default...")
     default_world = World("GAOL-1", "Medieval Fantasy", "High", "The original timeline.")
     worlds[default_world.id] = default_world
-    save_worlds()
+    save_worlds(default_world.id)
 
 socketio.start_background_task(check_disconnect_timers) #starts the disconnect timer checker
+socketio.start_background_task(persistence.run, socketio.sleep) #starts the write-behind save loop
+socketio.start_background_task(publish_lobby) #starts pushing room list changes to the lobby
 
 if __name__ == "__main__":
     print("[MAIN] Executed, worlds and game states will be loaded.")
@@ -0,0 +1,66 @@
+#jfr
+#append-only token audit log, every generation adds one JSON line to data/token_audit.jsonl
+#writes happen on a background thread so a turn never waits on the audit file.
+import json, os, queue, threading, atexit
+
+class AuditLog:
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=5):
+        self.path = path                #active log file, rotated copies are path.1, path.2, ...
+        self.max_bytes = max_bytes      #rotate once the active file grows past this size
+        self.backups = backups          #how many rotated files to keep
+        self.queue = queue.Queue()      #records waiting to be written
+        self.thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    #queue a record for writing, never blocks the caller
+    def record(self, entry):
+        self.queue.put(entry)
+
+    #blocks until everything queued so far has been written
+    def flush(self):
+        self.queue.join()
+
+    #writes whatever is left and stops the writer thread
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            batch = [entry]
+            #drain anything else that is waiting, so a burst of turns becomes a single write
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = [json.dumps(e) + "\n" for e in batch if e is not None]
+            try:
+                if lines:
+                    with open(self.path, 'a') as f:
+                        f.writelines(lines)
+                    if os.path.getsize(self.path) > self.max_bytes:
+                        self._rotate()
+            except Exception as e:
+                print(f"[AUDIT ERROR] Could not write token audit: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stop:
+                return
+
+    #token_audit.jsonl -> token_audit.jsonl.1 -> token_audit.jsonl.2 ... the oldest is dropped
+    def _rotate(self):
+        oldest = f"{self.path}.{self.backups}"
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        print(f"[AUDIT] Rotated {os.path.basename(self.path)}")
@@ -0,0 +1,77 @@
+#jfr
+#benchmark for the lore scoring engines, builds synthetic worlds and times get_relevant_lore against each engine
+#usage: python bench_relevance.py [--sizes 100,1000,10000] [--queries 200]
+import random, time, argparse, io, contextlib
+from classes        import World
+from relevance      import RelevanceEngine
+
+#a zipf-ish vocabulary, a handful of words ("city", "king") show up everywhere, most are rare
+COMMON_WORDS = ['city', 'king', 'war', 'ancient', 'dark', 'river', 'forest', 'guild', 'temple', 'mountain']
+RARE_WORDS = [f"lore{i}" for i in range(3000)]
+
+def random_text(rng, length):
+    words = []
+    for _ in range(length):
+        if rng.random() < 0.35:
+            words.append(rng.choice(COMMON_WORDS))
+        else:
+            words.append(rng.choice(RARE_WORDS))
+    return " ".join(words)
+
+#world with `size` entities spread across every kind of lore
+def build_world(size, rng):
+    w = World(f"Bench {size}")
+    with contextlib.redirect_stdout(io.StringIO()): #the add_* methods print on every entity
+        for i in range(size):
+            name = f"{random_text(rng, 2)} {i}"
+            kind = i % 4
+            if kind == 0:
+                w.add_group(name, "Faction", random_text(rng, 20), random_text(rng, 3).split())
+            elif kind == 1:
+                w.add_location(name, "City", random_text(rng, 20), rng.randint(0, 1024), rng.randint(0, 512), 2, "Independent", random_text(rng, 3).split())
+            elif kind == 2:
+                w.add_character(name, random_text(rng, 20), "NPC", "None")
+            else:
+                w.add_biology(name, random_text(rng, 20), "Swamp", "Hostile")
+        for i in range(20):
+            w.add_event({"title": random_text(rng, 2), "description": random_text(rng, 15)})
+    return w
+
+def bench(world, queries, scoring):
+    start = time.perf_counter()
+    for history, actions in queries:
+        RelevanceEngine.get_relevant_lore(world, history, actions, limit=8, scoring=scoring)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+#how many of the 8 picks are lore lines built around a common word only
+def common_word_share(world, queries, scoring):
+    rare = set(RARE_WORDS)
+    flooded = 0
+    total = 0
+    for history, actions in queries:
+        context = RelevanceEngine.extract_keywords(history + " " + actions) & rare
+        block = RelevanceEngine.get_relevant_lore(world, history, actions, limit=8, scoring=scoring)
+        for line in block.splitlines():
+            if line.startswith("[History]"):
+                continue
+            total += 1
+            if not (RelevanceEngine.extract_keywords(line) & context):
+                flooded += 1
+    return flooded / total * 100 if total else 0.0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the lore scoring engines.")
+    parser.add_argument('--sizes', default="100,1000,10000")
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'entities':>9} | {'engine':>8} | {'ms/turn':>8} | {'% picks matching only common words':>34}")
+    print("-" * 70)
+    for size in [int(s) for s in args.sizes.split(',')]:
+        world = build_world(size, rng)
+        queries = [(random_text(rng, 60), random_text(rng, 15)) for _ in range(args.queries)]
+        for scoring in RelevanceEngine.SCORING_MODES:
+            ms = bench(world, queries, scoring)
+            share = common_word_share(world, queries[:50], scoring)
+            print(f"{size:>9} | {scoring:>8} | {ms:>8.3f} | {share:>33.1f}%")
@@ -0,0 +1,76 @@
+#jfr
+#benchmark for server startup, fills a scratch world database with synthetic worlds and times the old boot against
+#the header-only boot, plus loading one world on first use.
+#the old boot is the real code: storage.py is read from the commit before header-only loading (git history, so run
+#this from a checkout) and its load_worlds() is what the old startup blocked on, every world rebuilt in full.
+#usage: python bench_startup.py [--worlds 10,50] [--entities 500,5000] [--baseline <git rev>]
+import random, time, argparse, io, contextlib, os, sys, tempfile, subprocess, types
+from storage        import WorldStore, WorldRegistry
+from bench_relevance import build_world
+
+def timed(fn):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()): #loading prints on every entity
+        result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+#the last revision before worlds were loaded lazily, the parent of the commit that added load_headers
+def default_baseline():
+    found = subprocess.run(['git', 'log', '--reverse', '--format=%H', '-S', 'def load_headers', '--', 'storage.py'],
+                           capture_output=True, text=True, check=True).stdout.split()
+    if not found:
+        raise RuntimeError("no commit adds load_headers to storage.py")
+    return found[0] + '^'
+
+#storage.py as it was at rev, loaded as its own module
+def load_baseline_storage(rev):
+    source = subprocess.run(['git', 'show', f'{rev}:storage.py'], capture_output=True, text=True, check=True).stdout
+    module = types.ModuleType('baseline_storage')
+    exec(compile(source, f'{rev}:storage.py', 'exec'), module.__dict__)
+    return module
+
+#the old boot: the baseline WorldStore rebuilding every world, exactly as load_worlds() did on startup
+def eager_boot(baseline, db_path):
+    store = baseline.WorldStore(db_path)
+    try:
+        return store.load_worlds()
+    finally:
+        store.close()
+
+def lazy_boot(store):
+    registry = WorldRegistry(store)
+    registry.load_headers()
+    return registry
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark server startup against the world database.")
+    parser.add_argument('--worlds', default="10,50")
+    parser.add_argument('--entities', default="500,5000")
+    parser.add_argument('--baseline', default=None, help="git revision whose storage.py is the old boot")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        rev = args.baseline or default_baseline()
+        baseline = load_baseline_storage(rev)
+    except (OSError, subprocess.CalledProcessError, RuntimeError) as e:
+        sys.exit(f"Could not read the baseline storage.py from git ({e}), run this from a git checkout or pass --baseline.")
+    print(f"old boot: load_worlds() from storage.py at {rev}")
+
+    rng = random.Random(42)
+    print(f"{'worlds':>7} | {'entities':>9} | {'old boot ms':>11} | {'lazy boot ms':>12} | {'first use ms':>12}")
+    print("-" * 64)
+    for world_count in [int(n) for n in args.worlds.split(',')]:
+        for size in [int(n) for n in args.entities.split(',')]:
+            with tempfile.TemporaryDirectory() as tmp:
+                db_path = os.path.join(tmp, 'worlds.db')
+                store = WorldStore(db_path)
+                template = build_world(size, rng)
+                for i in range(world_count):
+                    template.id = f"W{i:05d}"
+                    store.save_world(template, full=True)
+                eager_ms, _ = timed(lambda: eager_boot(baseline, db_path))
+                lazy_ms, registry = timed(lambda: lazy_boot(store))
+                first_ms, _ = timed(lambda: registry.get("W00000"))
+                store.close()
+            print(f"{world_count:>7} | {size:>9} | {eager_ms:>11.1f} | {lazy_ms:>12.1f} | {first_ms:>12.1f}")
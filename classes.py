@@ -1,8 +1,23 @@
 #jfr
 #This is for storing data classes, to simplify the content of 'app.py'
-import random, string, os
-from google         import genai
-from dotenv         import load_dotenv
+import random, string, threading, time
+from relevance      import LoreIndex
+from highlight      import NameMatcher
+from history        import HISTORY_WINDOW, PROMPT_HISTORY, SUMMARY_BATCH
+from party_state    import PartyState
+
+#changes kept for the client diffs, a client further behind than this gets a full snapshot
+CHANGE_LOG_LIMIT = 1000
+#a turn stuck generating longer than this (a worker died mid-turn) no longer blocks the room
+TURN_TIMEOUT = 600
+
+#case-folded key used to look lore up by name, names are unique per kind regardless of case
+def name_key(name):
+    return name.casefold()
+
+#story messages are the ones the prompt sends and the summary covers, chat and system messages are neither
+def is_story(message):
+    return isinstance(message, dict) and message.get('type') == 'story'
 
 #generic class for locations, cities, landmarks, etc.
 class WorldEntity:
@@ -80,6 +95,151 @@ class World:
         self.biology = []                                                                #list of Biology that lives within the world
         self.width = width                                                               #Arbitrary world width
         self.height = height                                                             #Arbitrary world height
+        #change tracking, consumed by the storage engine so that only modified lore is written back to disk
+        self.header_dirty = True                                                         #name/setting/description etc. changed
+        self.events_dirty = False                                                        #major_events changed
+        self.dirty = set()                                                               #(kind, name key) of entities changed since the last save
+        #per-kind lookup of lore by case-folded name, kept in sync by the add_* methods
+        self.name_index = {'groups': {}, 'locations': {}, 'characters': {}, 'biology': {}}
+        self.lore_index = LoreIndex()                                                    #keyword -> lore inverted index used by the RelevanceEngine
+        self.name_matcher = NameMatcher()                                                #every lore name, used to highlight them in the story text
+        #versioning for the clients, every change bumps the version and is logged so a client can catch up with a diff
+        self.epoch = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8)) #new on every load, versions from an older process are never trusted
+        self.version = 0                                                                 #bumped on every entity or event change
+        self.change_log = []                                                             #(kind, name key) of change number log_start + 1 + i, kind 'major_events' for the event list
+        self.log_start = 0                                                               #oldest version a diff can be built from
+
+    #builds a world (and all of its lore) from the dict produced by to_dict
+    @classmethod
+    def from_dict(cls, w_data):
+        #defaults added for backward compatibility
+        #added width/height defaults
+        w = cls(
+            w_data['name'], 
+            w_data.get('setting', 'Medieval Fantasy'), 
+            w_data.get('realism', 'High'), 
+            w_data['description'],
+            w_data.get('width', 1024),
+            w_data.get('height', 512)
+        )
+        w.id = w_data['id'] #overwrite random id
+        
+        #handle major_events. If they are strings, convert to dicts.
+        for evt in w_data.get('major_events', []):
+            if isinstance(evt, str):
+                w.add_event({"title": "Historical Event", "description": evt})
+            else:
+                w.add_event(evt)
+        
+        #load entities if they exist
+        for e_data in w_data.get('groups', []):
+            w.add_group(
+                e_data['name'], 
+                e_data['type'], 
+                e_data['description'], 
+                e_data.get('keywords', [])
+            )
+
+        #load locations
+        for l_data in w_data.get('locations', []):
+            w.add_location(
+                l_data['name'],
+                l_data['type'],
+                l_data['description'],
+                l_data.get('x', 0),
+                l_data.get('y', 0),
+                l_data.get('radius', 1),
+                l_data.get('affiliation', 'Independent'), #default to independent
+                l_data.get('keywords', [])
+            )
+
+        #load characters
+        for c_data in w_data.get('characters', []):
+            c_role = c_data.get('role', 'NPC')
+            c_aff  = c_data.get('affiliation', 'None')
+            c_stat = c_data.get('status', 'Alive') 
+            w.add_character(c_data['name'], c_data['description'], c_role, c_aff, c_stat)
+
+        #load world biology
+        for b_data in w_data.get('biology', []):
+            w.add_biology(
+                b_data['name'],
+                b_data['description'],
+                b_data['habitat'],
+                b_data['disposition']
+            )
+        #loading isn't a change any client has to catch up on
+        w.change_log = []
+        w.log_start = w.version
+        return w
+
+    #looks up lore by name (case-insensitive), returns None if it doesn't exist
+    def find(self, kind, name):
+        if not isinstance(name, str):
+            return None
+        return self.name_index[kind].get(name_key(name))
+
+    #indexes a newly added entity by name (lookup and highlighting) and flags it for saving
+    def register(self, kind, entity):
+        self.name_index[kind][name_key(entity.name)] = entity
+        self.name_matcher.add(entity.name)
+        self.mark_changed(kind, entity)
+
+    #must be called whenever an entity is added or edited. kind is one of 'groups', 'locations', 'characters', 'biology'
+    #flags it so the next save persists it, and refreshes its keywords in the lore index
+    def mark_changed(self, kind, entity):
+        key = name_key(entity.name)
+        self.dirty.add((kind, key))
+        self.lore_index.index_entity(kind, entity, key)
+        self.log_change(kind, key)
+
+    #records a change for the client diffs, the oldest entries are dropped once the log is full
+    def log_change(self, kind, key):
+        self.version += 1
+        self.change_log.append((kind, key))
+        if len(self.change_log) > CHANGE_LOG_LIMIT:
+            dropped = len(self.change_log) - CHANGE_LOG_LIMIT // 2
+            del self.change_log[:dropped]
+            self.log_start += dropped
+
+    #everything added or modified after version `base`, None if the log doesn't reach back that far (send a snapshot instead)
+    def diff_since(self, base):
+        if not isinstance(base, int) or base < self.log_start or base > self.version:
+            return None
+        changes = {}
+        events_changed = False
+        seen = set()
+        for kind, key in self.change_log[base - self.log_start:]:
+            if kind == 'major_events':
+                events_changed = True
+                continue
+            if (kind, key) in seen:
+                continue
+            seen.add((kind, key))
+            entity = self.name_index[kind].get(key)
+            if entity:
+                changes.setdefault(kind, []).append(entity.to_dict())
+        diff = {'world_id': self.id, 'epoch': self.epoch, 'base': base, 'version': self.version, 'changes': changes}
+        if events_changed:
+            diff['major_events'] = self.major_events #capped at 20, sent whole
+        return diff
+
+    #the whole world plus the version it was taken at, what a client starts from before applying diffs
+    def snapshot(self):
+        data = self.to_dict()
+        data['epoch'] = self.epoch
+        data['version'] = self.version
+        return data
+
+    #true if anything has changed since the last save
+    def has_changes(self):
+        return self.header_dirty or self.events_dirty or bool(self.dirty)
+
+    #called by the storage engine once everything has been written
+    def clear_changes(self):
+        self.header_dirty = False
+        self.events_dirty = False
+        self.dirty = set()
 
     #adds a new event to the major events of the planet
     def add_event(self, event_data):
@@ -90,6 +250,8 @@ class World:
         self.major_events.append(event_data)
         if len(self.major_events) > 20: 
             self.major_events.pop(0)
+        self.events_dirty = True
+        self.log_change('major_events', None)
         
     #adding a new entity to the world.
     def add_group(self, name, type_tag, description, keywords=[]):
@@ -98,38 +260,42 @@ class World:
             keywords = []
             
         #no duplicates
-        if any(e.name.lower() == name.lower() for e in self.groups):
+        if self.find('groups', name):
             print(f"[LORE SKIP] Duplicate entity detected: {name}")
             return
             
         new_entity = WorldEntity(name, type_tag, description, keywords)
         self.groups.append(new_entity)
+        self.register('groups', new_entity)
         print(f"[DEBUG] Entity Added to Memory: {name} ({type_tag})")
 
     #adding a new physical location to the world
     def add_location(self, name, type_tag, description, x, y, radius, affiliation="Independent", keywords=[]):
         #make sure name is unique
-        if any(l.name.lower() == name.lower() for l in self.locations):
+        if self.find('locations', name):
             return
         new_loc = Location(name, type_tag, description, x, y, radius, affiliation, keywords)
         self.locations.append(new_loc)
+        self.register('locations', new_loc)
         print(f"[DEBUG] Location Added: {name} at {x},{y}")
 
     #adding characters to the world entitites
     def add_character(self, name, description, role, affiliation, status="Alive"):
         #make sure name is unique
-        if any(c.name.lower() == name.lower() for c in self.characters):
+        if self.find('characters', name):
             return
         new_character = Character(name, description, role, affiliation, status)
         self.characters.append(new_character)
+        self.register('characters', new_character)
 
     #adding new biology to the world
     def add_biology(self, name, description, habitat, disposition):
         #make sure name is unique
-        if any(b.name.lower() == name.lower() for b in self.biology):
+        if self.find('biology', name):
             return
         new_biology = Biology(name, description, habitat, disposition)
         self.biology.append(new_biology)
+        self.register('biology', new_biology)
     
     #grab a list of all entity names, this is to be used for highlighting in the frontend
     def get_entity_list(self):
@@ -206,6 +372,27 @@ class Player:
             #NOTE: we don't save SID or current_action/roll since they are session specific
             }
 
+    #everything about the player, session fields included, used to hand a live room to another server worker
+    def to_state(self):
+        state = self.to_dict()
+        state.update({
+            'sid': self.sid,
+            'connect': self.connect,
+            'dc_timer': self.dc_timer,
+            'current_action': self.current_action,
+            'current_roll': self.current_roll,
+            'has_acted': self.has_acted
+        })
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        p = cls(state['sid'], state['username'])
+        for field, value in state.items():
+            if field not in ('sid', 'username'):
+                setattr(p, field, value)
+        return p
+
 #store important persistent characters to the world
 class Character:
     def __init__(self, name, description, role="NPC", affiliation=None, status="Alive", keywords=[]):
@@ -231,34 +418,43 @@ class Character:
 #stores information about the game room
 class GameRoom:
     def __init__(self, room_id, setting="Medieval Fantasy", realism="High", world_id=None, custom_api_key=None, password=None):
-        #See if the default API key is there, if so grab it.
-        load_dotenv()
-        raw_key = os.getenv("GEMINI_API_KEY")
-        #if the .env field is empty or just whitespace, treat it as none
-        DEFAULT_API_KEY = raw_key.strip() if raw_key and raw_key.strip() else None
-
         #Room values
         self.room_id = room_id                  #unique ID of the room for people to join
         self.setting = setting                  #setting of the world the room is using
         self.realism = realism                  #how realistic should the room behave?
         self.world_id = world_id                #id of the loaded world
-        self.custom_api_key = custom_api_key    #stores override api keys
+        self.custom_api_key = custom_api_key    #stores override api keys, rooms without one use the server key (the client comes from the shared pool in app.py)
         self.password = password                #optional password for the room
-        self.history = []                       #list of strings or dicts
+        self.history = []                       #newest messages (dicts), bounded by HISTORY_WINDOW, the full transcript is archived on disk
+        self.summary = ""                       #rolling summary of the story messages that have left the history window
+        self.pending_summary = []               #story messages that left the window but aren't in the summary yet
+        self.summarizing = False                #true while a background task is folding pending_summary into the summary
         self.players = {}                       #dict: { sid: Player }
         self.is_started = False                 #has the room started the gameplay loop yet?
         self.admin_sid = None                   #track who the host is
         self.dm_override = None                 #stores admin override instructions for next turn
         self.is_finished = False                #becomes true once game has finalized.
 
-        if custom_api_key:
-            self.ai_client =  genai.Client(api_key=custom_api_key)
-        elif DEFAULT_API_KEY:
-            self.ai_client = genai.Client(api_key=DEFAULT_API_KEY)
-        else:
-            self.ai_client = None
-
         self.ai_model = "gemini-2.5-flash-lite" #ai model the room is using for generation
+        self.input_token_budget = None          #prompt token budget override, None uses the model default
+        self.player_matcher = None              #NameMatcher over the current party, rebuilt when the party changes
+        self.player_matcher_names = None        #the usernames player_matcher was built from
+        self.party_state = PartyState()         #last party state sent to the clients, changes go out as patches
+        self.world_version = None               #world version last sent to this room, the next world_update is a diff from here
+        #turn lifecycle: collecting (taking actions) -> generating (waiting on GAOL) -> applying (writing the result) -> collecting
+        self.turn_phase = 'collecting'
+        self.turn_id = 0                        #bumped when a generation starts, a result is only applied to the turn it was generated for
+        self.turn_started = 0.0                 #when the current generation started
+        self.queued_actions = {}                #username -> (action, roll) sent while a turn was generating, they count for the next turn
+        self.turn_lock = threading.Lock()       #guards the phase changes, so only one generation can start per turn
+
+    #matcher for highlighting player names, only rebuilt when someone joins or leaves
+    def get_player_matcher(self):
+        names = tuple(sorted(p.username for p in self.players.values()))
+        if names != self.player_matcher_names:
+            self.player_matcher = NameMatcher(names)
+            self.player_matcher_names = names
+        return self.player_matcher
 
     #add a player into the room.
     def add_player(self, sid, username):
@@ -313,6 +509,109 @@ class GameRoom:
                 status_lines.append(f"   - SECRET (Only known to you and player): {p.secret}")
         return "\n".join(status_lines)
     
+    #appends a message to the history window, the oldest messages fall out once the window is full
+    #a story message waits in pending_summary as soon as the prompt stops sending it: when PROMPT_HISTORY newer story
+    #messages exist, or when it leaves the window before that. returns true once enough have piled up to summarize
+    def add_message(self, message):
+        self.history.append(message)
+        if is_story(message):
+            stories = [m for m in self.history if is_story(m)]
+            if len(stories) > PROMPT_HISTORY:
+                self.pending_summary.append(stories[-(PROMPT_HISTORY + 1)])
+        while len(self.history) > HISTORY_WINDOW:
+            old = self.history.pop(0)
+            #with PROMPT_HISTORY newer story messages it was already handed over above
+            if is_story(old) and sum(1 for m in self.history if is_story(m)) < PROMPT_HISTORY:
+                self.pending_summary.append(old)
+        return len(self.pending_summary) >= SUMMARY_BATCH and not self.summarizing
+
+    #the whole live room (players, keys, history window, publisher state), used by the shared state backend
+    def to_state(self):
+        return {
+            'room_id': self.room_id,
+            'setting': self.setting,
+            'realism': self.realism,
+            'world_id': self.world_id,
+            'custom_api_key': self.custom_api_key,
+            'password': self.password,
+            'history': self.history,
+            'summary': self.summary,
+            'pending_summary': self.pending_summary,
+            'players': [p.to_state() for p in self.players.values()],
+            'is_started': self.is_started,
+            'admin_sid': self.admin_sid,
+            'dm_override': self.dm_override,
+            'is_finished': self.is_finished,
+            'ai_model': self.ai_model,
+            'input_token_budget': self.input_token_budget,
+            'party_state': self.party_state.to_state(),
+            'world_version': self.world_version,
+            'turn_phase': self.turn_phase,
+            'turn_id': self.turn_id,
+            'turn_started': self.turn_started,
+            'queued_actions': self.queued_actions
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        gr = cls(state['room_id'], state['setting'], state['realism'], state['world_id'], state['custom_api_key'], state['password'])
+        for field in ('history', 'summary', 'pending_summary', 'is_started', 'admin_sid', 'dm_override',
+                      'is_finished', 'ai_model', 'input_token_budget', 'world_version', 'turn_phase', 'turn_id', 'turn_started'):
+            setattr(gr, field, state[field])
+        gr.queued_actions = {name: tuple(a) for name, a in state['queued_actions'].items()}
+        for p_state in state['players']:
+            p = Player.from_state(p_state)
+            gr.players[p.sid] = p
+        gr.party_state = PartyState.from_state(state['party_state'])
+        return gr
+
+    #moves the room from collecting to generating, returns the new turn id, or None if a generation is already running
+    def begin_turn(self):
+        with self.turn_lock:
+            if self.turn_phase != 'collecting':
+                if time.time() - self.turn_started < TURN_TIMEOUT:
+                    return None
+                print(f"[TURN] Room {self.room_id} was stuck {self.turn_phase} turn {self.turn_id}, starting over.")
+            self.turn_id += 1
+            self.turn_phase = 'generating'
+            self.turn_started = time.time()
+            return self.turn_id
+
+    #moves a generated turn on to applying, false if turn_id isn't the turn being generated (a stale or duplicate result)
+    def begin_applying(self, turn_id):
+        with self.turn_lock:
+            if self.turn_phase != 'generating' or self.turn_id != turn_id:
+                return False
+            self.turn_phase = 'applying'
+            return True
+
+    #back to collecting, the actions queued during the turn become the players' moves for the next one.
+    #returns the players whose queued action was applied, or None if turn_id isn't the current turn
+    def end_turn(self, turn_id):
+        with self.turn_lock:
+            if self.turn_id != turn_id or self.turn_phase == 'collecting':
+                return None
+            self.turn_phase = 'collecting'
+            queued, self.queued_actions = self.queued_actions, {}
+        applied = []
+        for p in self.players.values():
+            if p.username in queued:
+                p.current_action, p.current_roll = queued[p.username]
+                p.has_acted = True
+                applied.append(p)
+        return applied
+
+    #locks in a player's move, while a turn is generating it is held for the next turn instead. returns true if it was held
+    def submit_action(self, player, action, roll):
+        with self.turn_lock:
+            if self.turn_phase != 'collecting':
+                self.queued_actions[player.username] = (action, roll)
+                return True
+            player.current_action = action
+            player.current_roll = roll
+            player.has_acted = True
+            return False
+
     #turn the game room into a dictionary
     def to_dict(self):
         player_list = [p.username for p in self.players.values()]
@@ -323,8 +622,10 @@ class GameRoom:
             'world_id': self.world_id,
             'is_started': self.is_started,
             'active_players': player_list,
-            'history': self.history,
-            'is_private': bool(self.password) # flag if password is set
+            'summary': self.summary,
+            'pending_summary': self.pending_summary,
+            'is_private': bool(self.password), # flag if password is set
+            'input_token_budget': self.input_token_budget
         }
     
 #debugging
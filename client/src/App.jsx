@@ -8,6 +8,51 @@ import './App.css';
 const SOCKET_URL = import.meta.env.PROD ? undefined : 'http://localhost:5000';
 const socket = io(SOCKET_URL);
 
+//applies a party patch from the server (see party_state.py) on top of the current cards
+//changed: {name: {field: value}}, added: [full player states], order: names in card order (only sent if it changed)
+const applyPartyPatch = (players, patch) => {
+  const byName = {};
+  players.forEach(p => { byName[p.name] = p; });
+  Object.entries(patch.changed || {}).forEach(([name, fields]) => {
+    if (byName[name]) byName[name] = { ...byName[name], ...fields };
+  });
+  (patch.added || []).forEach(p => { byName[p.name] = p; });
+  const order = patch.order || players.map(p => p.name);
+  return order.filter(name => byName[name]).map(name => byName[name]);
+};
+
+//applies a world diff from the server on top of the current world, entities are replaced by name or appended
+//changes: {groups|characters|locations|biology: [entity]}, major_events is only sent when the events changed
+const applyWorldDiff = (world, diff) => {
+  const updated = { ...world, version: diff.version };
+  Object.entries(diff.changes || {}).forEach(([kind, entities]) => {
+    const list = [...(world[kind] || [])];
+    entities.forEach(entity => {
+      const i = list.findIndex(e => e.name === entity.name);
+      if (i >= 0) list[i] = entity;
+      else list.push(entity);
+    });
+    updated[kind] = list;
+  });
+  if (diff.major_events) updated.major_events = diff.major_events;
+  return updated;
+};
+
+//rooms per page of the lobby's room list
+const ROOM_PAGE_SIZE = 10;
+
+//applies a room list delta from the server (see lobby.py) to the page being shown
+//upserts: rows that match our filters (replaced by id, new ones fill the page if there's space), removed: ids to drop
+const applyRoomDelta = (rooms, delta) => {
+  const list = rooms.filter(r => !(delta.removed || []).includes(r.id));
+  (delta.upserts || []).forEach(row => {
+    const i = list.findIndex(r => r.id === row.id);
+    if (i >= 0) list[i] = row;
+    else if (list.length < ROOM_PAGE_SIZE) list.push(row);
+  });
+  return list;
+};
+
 function App() {
   //////////////////////////////////////
   //              CONSTANTS           //
@@ -27,8 +72,12 @@ function App() {
   const [joinPassword, setJoinPassword] = useState('');
   const [showPwdModal, setShowPwdModal] = useState(false);
   const [pendingRoom, setPendingRoom] = useState(''); //stores room ID while waiting for password
-  //list of available lobbies fetched from server
+  //list of available lobbies fetched from server, one page at a time
   const [activeRooms, setActiveRooms] = useState([]);
+  const [roomPage, setRoomPage] = useState(0);
+  const [roomTotal, setRoomTotal] = useState(0);
+  //room list filters, 'any' (or empty) leaves a filter out
+  const [roomFilters, setRoomFilters] = useState({ visibility: 'any', started: 'any', world: '', free_slots: false });
   //world tracking
   const [currentWorldName, setCurrentWorldName] = useState('');
   //stores full world object (lore, events, settings)
@@ -59,7 +108,14 @@ function App() {
   const [serverHasKey, setServerHasKey] = useState(null);
   //gameplay data containers
   const [messages, setMessages] = useState([]);
+  //seq of the oldest message loaded, anything before it is fetched a page at a time with get_history
+  const [historyStart, setHistoryStart] = useState(0);
+  const [loadingHistory, setLoadingHistory] = useState(false);
   const [partyStats, setPartyStats] = useState([]);
+  //version of the party state the cards are built from, null until a full snapshot arrives
+  const partyVersionRef = useRef(null);
+  //{epoch, version} of the world snapshot worldData was built from, world_update diffs are applied on top of it
+  const worldVersionRef = useRef(null);
   const [inputValue, setInputValue] = useState('');
   const [statusMsg, setStatusMsg] = useState('');
   //visual state for the d20 roll
@@ -77,6 +133,8 @@ function App() {
   const [particles, setParticles] = useState([]);
   //ref used for auto-scrolling chat
   const chatEndRef = useRef(null);
+  //set when older messages are prepended, so the chat doesn't jump to the bottom
+  const skipScrollRef = useRef(false);
   //state for model selector modal
   const [showModelModal, setShowModelModal] = useState(false);
   const [currentModel, setCurrentModel] = useState('gemini-2.5-flash-lite');
@@ -237,8 +295,6 @@ function App() {
   useEffect(() => {
     debugLog("Opening Sockets")
     //LOGIN VIEW SOCKETS
-    //request rooms immediately
-    socket.emit('get_rooms');
     //populates the world dropdown in creation menu
     socket.on('world_list', (data) => {
         setAvailableWorlds(data);
@@ -251,14 +307,15 @@ function App() {
     });
     //updates the table of active rooms in the lobby
     socket.on('room_list', (data) => {
-        setActiveRooms(data);
+        setActiveRooms(data.rooms);
+        setRoomTotal(data.total);
+        setRoomPage(data.page); //the server moves us back if the page we asked for no longer exists
+    });
+    //the server pushes changes to the rooms matching our filters instead of us polling for the list
+    socket.on('room_list_delta', (delta) => {
+        setActiveRooms(prev => applyRoomDelta(prev, delta));
+        setRoomTotal(prev => Math.max(0, prev + (delta.total_change || 0)));
     });
-    //set up polling interval for rooms list (every 3 seconds)
-    const roomPollInterval = setInterval(() => {
-        if(gameState === 'login') {
-            socket.emit('get_rooms');
-        }
-    }, 3000);
 
     //password Requirement Trigger
     socket.on('password_required', (data) => {
@@ -274,6 +331,7 @@ function App() {
         setGameState('login');
         setRoom('');
         setMessages([]);
+        setHistoryStart(0);
         setPartyStats([]);
         setIsReady(false);
         setIsAdmin(false);
@@ -286,8 +344,12 @@ function App() {
       setRoom(data.room);
       setCurrentWorldName(data.world);
       setWorldData(data.world_details); 
+      worldVersionRef.current = { epoch: data.world_details.epoch, version: data.world_details.version };
       setIsAdmin(data.is_admin); 
       if(data.history && data.history.length > 0) setMessages(data.history);
+      setHistoryStart(data.history_start || 0);
+      partyVersionRef.current = null; //the party snapshot follows join_success
+      setLoadingHistory(false);
       setGameState('playing');
       setJoinPassword(''); // clear password on success
       setShowPwdModal(false);
@@ -301,13 +363,50 @@ function App() {
     
     //INGAME VIEW SOCKETS
     //listens for incoming chat messages
+    //older page of the transcript, placed above what is already loaded
+    socket.on('history_page', (data) => {
+      skipScrollRef.current = true;
+      setMessages(prev => [...data.messages, ...prev]);
+      setHistoryStart(data.start);
+      setLoadingHistory(false);
+    });
     socket.on('message', (data) => handleMessages(data));
+    //listens for story text streaming in while GAOL is still generating
+    socket.on('message_chunk', (data) => handleMessageChunk(data));
     //updates the top status ticker
     socket.on('status', (data) => setStatusMsg(data.msg));
     //updates the list of players and their stats
-    socket.on('game_state_update', (data) => setPartyStats(data));
+    socket.on('game_state_update', (data) => {
+      partyVersionRef.current = data.version;
+      setPartyStats(data.players);
+    });
+    //only what changed since the last version, if we missed one we ask for the whole party again
+    socket.on('game_state_patch', (patch) => {
+      if (partyVersionRef.current === null) return; //a snapshot is on its way
+      if (patch.base !== partyVersionRef.current) {
+        partyVersionRef.current = null;
+        socket.emit('get_game_state', { room: patch.room });
+        return;
+      }
+      partyVersionRef.current = patch.version;
+      setPartyStats(prev => applyPartyPatch(prev, patch));
+    });
     //updates world lore/events when ai triggers a change
-    socket.on('world_update', (data) => setWorldData(data));
+    socket.on('world_snapshot', (data) => {
+      worldVersionRef.current = { epoch: data.epoch, version: data.version };
+      setWorldData(data);
+    });
+    //only the lore that changed, if we're missing earlier changes we ask for them (or a snapshot) first
+    socket.on('world_update', (diff) => {
+      const known = worldVersionRef.current;
+      if (!known || known.epoch !== diff.epoch || known.version < diff.base) {
+        socket.emit('get_world_diff', { room: diff.room, since: known ? known.version : null, epoch: known ? known.epoch : null });
+        return;
+      }
+      if (diff.version <= known.version) return; //already applied
+      worldVersionRef.current = { epoch: diff.epoch, version: diff.version };
+      setWorldData(prev => applyWorldDiff(prev, diff));
+    });
     //handle being kicked
     socket.on('kicked', (data) => {
         setGameState('login');
@@ -337,26 +436,57 @@ function App() {
     return () => { 
       debugLog("Closing Sockets")
       socket.off('message'); 
+      socket.off('history_page');
+      socket.off('message_chunk');
       socket.off('status'); 
       socket.off('game_state_update'); 
+      socket.off('game_state_patch');
       socket.off('world_list');
       socket.off('server_config');
       socket.off('room_list');
+      socket.off('room_list_delta');
       socket.off('join_success');
       socket.off('world_update');
+      socket.off('world_snapshot');
       socket.off('room_closed');
       socket.off('password_required');
       socket.off('kicked');
       socket.off('admin_update');
-      clearInterval(roomPollInterval); //clear interval
     };
-  }, [gameState]); //dependency on gameState ensuring interval respects login status
+  }, [gameState]); //dependency on gameState ensuring listeners respect login status
   //NOTE: if gameState is updated, this useEffect will be rerun, hence why they are within the end array.
   //FIXME: This is a bit silly, we don't need to close and reopen sockets on every game state change.
   //       this should potentially be moved into a couple different movestates for sockets that need to beupdated, and those that may be static.
 
+  //asks for the room list whenever we're back in the lobby or the filters/page change
+  //the server then keeps us up to date with room_list_delta until we join a room
+  useEffect(() => {
+    if (gameState !== 'login') return;
+    const filters = {};
+    if (roomFilters.visibility !== 'any') filters.visibility = roomFilters.visibility;
+    if (roomFilters.started !== 'any') filters.started = roomFilters.started === 'started';
+    if (roomFilters.world) filters.world = roomFilters.world;
+    if (roomFilters.free_slots) filters.free_slots = 1;
+    const requestRooms = () => socket.emit('get_rooms', { filters, page: roomPage, page_size: ROOM_PAGE_SIZE });
+    requestRooms();
+    socket.on('connect', requestRooms); //a reconnect loses the subscription, ask again
+    return () => socket.off('connect', requestRooms);
+  }, [gameState, roomFilters, roomPage]);
+
+  //keeps the filters on screen when nothing matches them
+  const roomFiltersActive = roomFilters.visibility !== 'any' || roomFilters.started !== 'any' || roomFilters.world || roomFilters.free_slots;
+  //changing a filter starts the list over from the first page
+  const updateRoomFilter = (field, value) => {
+    setRoomFilters(prev => ({ ...prev, [field]: value }));
+    setRoomPage(0);
+  };
+
   //auto-scrolls to the bottom of chat when new messages arrive
   useEffect(() => {
+    if (skipScrollRef.current) {
+      skipScrollRef.current = false; //older messages were loaded, stay where the player is reading
+      return;
+    }
     chatEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [messages]);
   //runs every time the messages field is updated
@@ -372,7 +502,7 @@ function App() {
     if (!ttsEnabled || messages.length === 0 || !sam) return;
     const lastMsg = messages[messages.length - 1]; 
     
-    if (lastMsg.sender === 'GAOL') { 
+    if (lastMsg.sender === 'GAOL' && !lastMsg.streaming) { 
         //send to the playTTS function
         playTTS(lastMsg.text, samConfigRef.current);
     }
@@ -596,6 +726,14 @@ function App() {
     }
   };
 
+  //Load Earlier Messages button
+  //asks the server for the page of the transcript just before the oldest loaded message
+  const loadEarlierMessages = () => {
+    if (loadingHistory || historyStart <= 0) return;
+    setLoadingHistory(true);
+    socket.emit('get_history', { room, before: historyStart });
+  };
+
   //DM Override button
   //sends admin override to server
   const sendOverride = () => {
@@ -665,7 +803,39 @@ function App() {
   //preprocessing on messages sent back from the server.
   //Currently uses regex to highlight player names, for visual flavor
   const handleMessages = (data) => {
-    setMessages((prev) => [...prev, data]);
+    setMessages((prev) => {
+        //the finished GAOL message replaces the text that was streamed in while generating,
+        //found by its flag since system/status messages and chat can arrive in the middle of a stream
+        const i = data.sender === 'GAOL' ? findStreaming(prev) : -1;
+        if (i >= 0) {
+            const next = [...prev];
+            next[i] = data;
+            return next;
+        }
+        return [...prev, data];
+    });
+  };
+
+  //index of the GAOL message still being streamed in, -1 if there is none
+  const findStreaming = (list) => {
+    for (let i = list.length - 1; i >= 0; i--) {
+        if (list[i].streaming && list[i].sender === 'GAOL') return i;
+    }
+    return -1;
+  };
+
+  //appends streamed story text to the in-progress GAOL message (or starts a new one)
+  const handleMessageChunk = (data) => {
+    setMessages((prev) => {
+        const i = findStreaming(prev);
+        if (i >= 0) {
+            const next = [...prev];
+            const text = data.first ? data.text : prev[i].text + data.text;
+            next[i] = { ...prev[i], text };
+            return next;
+        }
+        return [...prev, { sender: data.sender, text: data.text, streaming: true }];
+    });
   };
 
   //World Sheet Filters
@@ -903,10 +1073,33 @@ function App() {
                 {statusMsg !== 'System Ready...' ? statusMsg : ''}
               </div>
 
-              {/* active rooms table (autorefreshing) */}
-              {loginMode === 'join' && activeRooms.length > 0 && (
+              {/* active rooms table (kept up to date by the server) */}
+              {loginMode === 'join' && (activeRooms.length > 0 || roomFiltersActive) && (
                   <div className="room-list-container">
                       <h3>Available Rooms</h3>
+                      {/* server side filters */}
+                      <div className="room-filters">
+                          <select value={roomFilters.visibility} onChange={(e) => updateRoomFilter('visibility', e.target.value)}>
+                              <option value="any">All Rooms</option>
+                              <option value="public">Public</option>
+                              <option value="private">Private</option>
+                          </select>
+                          <select value={roomFilters.started} onChange={(e) => updateRoomFilter('started', e.target.value)}>
+                              <option value="any">Any Status</option>
+                              <option value="lobby">In Lobby</option>
+                              <option value="started">In Progress</option>
+                          </select>
+                          <select value={roomFilters.world} onChange={(e) => updateRoomFilter('world', e.target.value)}>
+                              <option value="">Any World</option>
+                              {availableWorlds.map(w => (
+                                  <option key={w.id} value={w.id}>{w.name}</option>
+                              ))}
+                          </select>
+                          <label>
+                              <input type="checkbox" checked={roomFilters.free_slots} onChange={(e) => updateRoomFilter('free_slots', e.target.checked)} />
+                              Open Seats
+                          </label>
+                      </div>
                       <table className="room-table">
                           <thead>
                               <tr>
@@ -922,7 +1115,7 @@ function App() {
                                   <tr key={r.id}>
                                       <td style={{color: 'var(--accent-gold)'}}>{r.id}</td>
                                       <td>{r.world}</td>
-                                      <td>{r.player_count}/6</td>
+                                      <td>{r.player_count}/{r.max_players}</td>
                                       <td>
                                           {/* visual indicators for key availability */}
                                           {r.has_custom_key ? (
@@ -947,6 +1140,17 @@ function App() {
                               ))}
                           </tbody>
                       </table>
+                      {activeRooms.length === 0 && (
+                          <div className="room-list-empty">No rooms match these filters.</div>
+                      )}
+                      {/* pagination */}
+                      {roomTotal > ROOM_PAGE_SIZE && (
+                          <div className="room-pagination">
+                              <button className="join-sm-btn" disabled={roomPage === 0} onClick={() => setRoomPage(roomPage - 1)}>PREV</button>
+                              <span>{roomPage + 1} / {Math.ceil(roomTotal / ROOM_PAGE_SIZE)}</span>
+                              <button className="join-sm-btn" disabled={roomPage + 1 >= Math.ceil(roomTotal / ROOM_PAGE_SIZE)} onClick={() => setRoomPage(roomPage + 1)}>NEXT</button>
+                          </div>
+                      )}
                   </div>
               )}
 
@@ -1162,6 +1366,12 @@ function App() {
                 </div>
             )}
 
+          {/* older messages are only loaded on request */}
+          {historyStart > 0 && (
+            <button className="load-history-btn" onClick={loadEarlierMessages} disabled={loadingHistory}>
+              {loadingHistory ? 'LOADING...' : 'LOAD EARLIER MESSAGES'}
+            </button>
+          )}
           {/* chat history mapping */}
           {messages.map((m, i) => (
             <div key={i} className={`message-block ${m.sender === 'GAOL' ? 'gaol-msg' : 'player-msg'}`}>
@@ -0,0 +1,71 @@
+#jfr
+#one Gemini client per API key for the whole process.
+#rooms only keep their key, the client (and its HTTP connection pool) is created the first time the key generates
+#and shared by every room using that key. Clients that haven't been used for a while are closed.
+import threading, time
+from google import genai
+
+IDLE_TIMEOUT = 900      #seconds a client may sit unused before it is closed
+SWEEP_INTERVAL = 60     #seconds between checks for idle clients
+
+# PooledClient class
+# A client and when it was last handed out
+class PooledClient:
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.time()
+
+# ClientPool class
+# get() returns the shared client for a key, creating it on first use. Idle clients are swept during get(),
+# so there is no background task to manage. A sweep never closes a client used within IDLE_TIMEOUT,
+# which is far longer than any single generation.
+class ClientPool:
+    def __init__(self, factory=None, idle_timeout=IDLE_TIMEOUT):
+        self.factory = factory or (lambda api_key: genai.Client(api_key=api_key))
+        self.idle_timeout = idle_timeout
+        self.clients = {}           #api key -> PooledClient
+        self.last_sweep = time.time()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.clients)
+
+    #the client for a key, None if there is no key
+    def get(self, api_key):
+        if not api_key:
+            return None
+        now = time.time()
+        with self.lock:
+            if now - self.last_sweep >= SWEEP_INTERVAL:
+                self._sweep(now)
+            pooled = self.clients.get(api_key)
+            if pooled is None:
+                pooled = PooledClient(self.factory(api_key))
+                self.clients[api_key] = pooled
+                print(f"[CLIENT POOL] Created client for key ...{api_key[-4:]} ({len(self.clients)} open)")
+            pooled.last_used = now
+            return pooled.client
+
+    #closes every client, called on shutdown
+    def close_all(self):
+        with self.lock:
+            pooled = list(self.clients.values())
+            self.clients.clear()
+        for p in pooled:
+            self._close(p.client)
+
+    def _sweep(self, now):
+        self.last_sweep = now
+        for api_key, pooled in list(self.clients.items()):
+            if now - pooled.last_used >= self.idle_timeout:
+                del self.clients[api_key]
+                self._close(pooled.client)
+                print(f"[CLIENT POOL] Closed idle client for key ...{api_key[-4:]} ({len(self.clients)} open)")
+
+    def _close(self, client):
+        try:
+            close = getattr(client, 'close', None)
+            if close:
+                close()
+        except Exception as e:
+            print(f"[CLIENT POOL] Could not close client: {e}")
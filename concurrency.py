@@ -0,0 +1,97 @@
+#jfr
+#locking for the shared server state.
+#   KeyedLocks   - one reentrant lock per room or world id, so independent rooms never wait on each other
+#   RoomRegistry - the rooms by id, copy-on-write: readers iterate a snapshot without locking, writers swap in a new dict
+#lock order is always room before world, nothing takes a room lock while holding a world lock.
+import threading
+from contextlib import contextmanager
+
+# KeyedLocks class
+# Hands out an RLock per id for the duration of a with block. Reentrant so a handler that calls another handler
+# for the same room (create_room -> on_join) doesn't deadlock on itself.
+# Each lock counts the threads holding or waiting on it and is dropped when that reaches zero, so closed rooms
+# don't leave locks behind and a lock is never replaced while anyone is still using it.
+class KeyedLocks:
+    def __init__(self):
+        self.locks = {}             #key -> [RLock, threads holding or waiting on it]
+        self.guard = threading.Lock()
+
+    #holds the key's lock for the with block, yields False (without the lock) if timeout ran out first
+    @contextmanager
+    def hold(self, key, timeout=-1):
+        with self.guard:
+            slot = self.locks.get(key)
+            if slot is None:
+                slot = self.locks[key] = [threading.RLock(), 0]
+            slot[1] += 1
+        acquired = False
+        try:
+            acquired = slot[0].acquire(timeout=timeout)
+            yield acquired
+        finally:
+            if acquired:
+                slot[0].release()
+            with self.guard:
+                slot[1] -= 1
+                if slot[1] == 0:
+                    del self.locks[key]
+
+    def __len__(self):
+        return len(self.locks)
+
+# RoomRegistry class
+# Reads like the old games dict. Every write copies the dict and replaces it in one assignment, so a reader
+# (the room list, the disconnect sweep, the savers) always sees a complete snapshot and never
+# "dictionary changed size during iteration". Rooms are only added and removed on create/close, so copying is cheap.
+class RoomRegistry:
+    def __init__(self):
+        self.rooms = {}                 #never modified in place, only replaced
+        self.write_lock = threading.Lock()
+        self.locks = KeyedLocks()       #room id -> RLock guarding that room's GameRoom
+
+    #the current rooms, safe to iterate while other threads add or remove rooms
+    def snapshot(self):
+        return self.rooms
+
+    #with block holding the room while changing (or reading more than one field of) it, see KeyedLocks.hold
+    def lock(self, room_id, timeout=-1):
+        return self.locks.hold(room_id, timeout)
+
+    def __getitem__(self, room_id):
+        return self.rooms[room_id]
+
+    def get(self, room_id, default=None):
+        return self.rooms.get(room_id, default)
+
+    def __contains__(self, room_id):
+        return room_id in self.rooms
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def __iter__(self):
+        return iter(self.rooms)
+
+    def keys(self):
+        return self.rooms.keys()
+
+    def values(self):
+        return self.rooms.values()
+
+    def items(self):
+        return self.rooms.items()
+
+    def __setitem__(self, room_id, room):
+        with self.write_lock:
+            rooms = dict(self.rooms)
+            rooms[room_id] = room
+            self.rooms = rooms
+
+    def pop(self, room_id, default=None):
+        with self.write_lock:
+            if room_id not in self.rooms:
+                return default
+            rooms = dict(self.rooms)
+            room = rooms.pop(room_id)
+            self.rooms = rooms
+        return room
@@ -0,0 +1,181 @@
+#jfr
+#context caching for the static part of every prompt (the system instruction, the world header and the world's settled lore).
+#the prefix is uploaded once per (api key, model, world prefix) as cached content, each turn then only sends what changed.
+#backends:
+#   GeminiCacheBackend - the Gemini cached content API (client.caches)
+#   LocalCacheBackend  - keeps the prefix in memory and sends it inline, same bookkeeping with no API calls (offline testing)
+import hashlib, threading, time
+from google.genai   import types
+from prompting      import estimate_tokens
+from concurrency    import KeyedLocks
+
+CACHE_TTL = 3600            #seconds a cached prefix lives on the API
+REFRESH_MARGIN = 300        #a cache used this close to expiring has its TTL extended
+FAILURE_BACKOFF = 600       #after a failed create, that prefix goes uncached for this long
+#Gemini refuses to cache anything shorter than this many tokens
+MIN_CACHE_TOKENS = {
+    'gemini-2.5-flash-lite': 1024,
+    'gemini-2.5-flash': 1024,
+    'gemini-2.5-pro': 4096
+}
+DEFAULT_MIN_CACHE_TOKENS = 1024
+
+def digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+# GeminiCacheBackend class
+# Thin wrapper around client.caches, every call may raise and the ContextCache falls back on failure.
+class GeminiCacheBackend:
+    inline = False #the prefix lives on the API, requests reference it by name
+
+    def create(self, client, model, system_instruction, static_text, ttl, display_name):
+        cache = client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=display_name,
+                system_instruction=system_instruction,
+                contents=[types.Content(role='user', parts=[types.Part(text=static_text)])],
+                ttl=f"{ttl}s"
+            )
+        )
+        return cache.name
+
+    def refresh(self, client, name, ttl):
+        client.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{ttl}s"))
+
+    def delete(self, client, name):
+        client.caches.delete(name=name)
+
+# LocalCacheBackend class
+# Stand-in for the cached content API. Handles are only tracked locally and the prefix is sent inline,
+# so cache hits, refreshes and invalidation can all be exercised without network access.
+class LocalCacheBackend:
+    inline = True
+
+    def __init__(self):
+        self.counter = 0
+        self.entries = {}   #name -> expiry time
+
+    def create(self, client, model, system_instruction, static_text, ttl, display_name):
+        self.counter += 1
+        name = f"local/{self.counter}"
+        self.entries[name] = time.time() + ttl
+        return name
+
+    def refresh(self, client, name, ttl):
+        if name not in self.entries:
+            raise KeyError(name)
+        self.entries[name] = time.time() + ttl
+
+    def delete(self, client, name):
+        self.entries.pop(name, None)
+
+BACKENDS = {
+    'gemini': GeminiCacheBackend,
+    'local': LocalCacheBackend
+}
+
+# CacheEntry class
+# One cached prefix, keyed by (api key, model, world)
+class CacheEntry:
+    def __init__(self, prefix_hash):
+        self.prefix_hash = prefix_hash  #which prefix the cache holds, a different hash means the world header or settled lore changed
+        self.name = None                #cached content name, None while uncached
+        self.expires_at = 0.0
+        self.retry_at = 0.0             #set after a failed create, no new attempt before this time
+        self.hits = 0
+
+# ContextCache class
+# Decides per call whether the static prefix can be referenced from a cache.
+# prepare() returns the contents and config to send, so callers never branch on the backend.
+class ContextCache:
+    def __init__(self, backend, base_config, ttl=CACHE_TTL):
+        self.backend = backend
+        self.base_config = base_config  #the full GenerateContentConfig, system instruction included
+        self.ttl = ttl
+        self.entries = {}               #(key hash, model, world id) -> CacheEntry
+        self.lock = threading.Lock()    #guards entries only, never held during an API call
+        self.key_locks = KeyedLocks()   #one per entry key, so only calls for the same prefix wait on its create/refresh
+        self.too_short = {}             #entry key -> hash of the last prefix that was under the minimum, so it's only logged once
+
+    #returns (contents, config, cache name or None) for one generation call
+    def prepare(self, client, api_key, model, world_id, static_text, delta):
+        full_prompt = static_text + delta
+        if self.backend is None or client is None:
+            return full_prompt, self.base_config, None
+        name = self._get(client, api_key, model, world_id, static_text)
+        if name is None:
+            return full_prompt, self.base_config, None
+        if self.backend.inline:
+            return full_prompt, self.base_config, name
+        cached_config = self.base_config.model_copy(update={'system_instruction': None, 'cached_content': name})
+        return delta, cached_config, name
+
+    #drops a cache the API no longer accepts (expired early, deleted, wrong project), the next call starts over
+    def invalidate(self, api_key, model, world_id):
+        with self.lock:
+            entry = self.entries.pop(self._key(api_key, model, world_id), None)
+        if entry and entry.name:
+            print(f"[CONTEXT CACHE] Dropped {entry.name} for {world_id} ({model})")
+
+    def _key(self, api_key, model, world_id):
+        return (digest(api_key or ""), model, world_id)
+
+    def _get(self, client, api_key, model, world_id, static_text):
+        system_instruction = self.base_config.system_instruction or ""
+        key = self._key(api_key, model, world_id)
+        prefix_hash = digest(system_instruction + static_text)
+        tokens = estimate_tokens(system_instruction + static_text)
+        minimum = MIN_CACHE_TOKENS.get(model, DEFAULT_MIN_CACHE_TOKENS)
+        if tokens < minimum:
+            #too short to cache, it's cheaper to just send it
+            with self.lock:
+                noted = self.too_short.get(key) == prefix_hash
+                self.too_short[key] = prefix_hash
+            if not noted:
+                print(f"[CONTEXT CACHE] Prefix for {world_id} ({model}) is ~{tokens} tokens, under the {minimum} token minimum, sending uncached")
+            return None
+        with self.key_locks.hold(key):
+            now = time.time()
+            with self.lock:
+                entry = self.entries.get(key)
+                stale = None
+                if entry is None or entry.prefix_hash != prefix_hash or (entry.name and entry.expires_at <= now):
+                    if entry and entry.name:
+                        stale = entry.name
+                    entry = CacheEntry(prefix_hash)
+                    self.entries[key] = entry
+                name, expires_at, retry_at = entry.name, entry.expires_at, entry.retry_at
+            #the API calls below run without the shared lock, rooms on other worlds or keys carry on meanwhile
+            if stale:
+                self._delete(client, stale)
+            if name is None:
+                if now < retry_at:
+                    return None
+                try:
+                    name = self.backend.create(client, model, system_instruction, static_text, self.ttl, f"gaol-{world_id}-{prefix_hash}")
+                    print(f"[CONTEXT CACHE] Created {name} for {world_id} ({model})")
+                except Exception as e:
+                    with self.lock:
+                        entry.retry_at = now + FAILURE_BACKOFF
+                    print(f"[CONTEXT CACHE] Could not create cache for {world_id} ({model}), sending uncached: {e}")
+                    return None
+                expires_at = now + self.ttl
+            elif expires_at - now < REFRESH_MARGIN:
+                #still in use, push the expiry out before the API drops it
+                try:
+                    self.backend.refresh(client, name, self.ttl)
+                    expires_at = now + self.ttl
+                except Exception as e:
+                    print(f"[CONTEXT CACHE] Could not refresh {name}: {e}")
+            with self.lock:
+                entry.name = name
+                entry.expires_at = expires_at
+                entry.hits += 1
+            return name
+
+    def _delete(self, client, name):
+        try:
+            self.backend.delete(client, name)
+        except Exception as e:
+            print(f"[CONTEXT CACHE] Could not delete {name}: {e}")
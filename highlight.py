@@ -0,0 +1,126 @@
+#jfr
+#highlights player and entity names in the story text.
+#names are matched with an Aho-Corasick automaton that is built once per world (and once per party)
+#and grows as lore is added, so a turn never compiles a regex over every entity name.
+
+#lowercases one character at a time, characters whose lowercase form is longer (e.g. 'İ') are kept as is
+#so that match positions in the folded text line up with the original text
+def fold(text):
+    folded = []
+    for ch in text:
+        low = ch.lower()
+        folded.append(low if len(low) == 1 else ch)
+    return "".join(folded)
+
+#same definition of a word character as \b in the re module
+def is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+# NameMatcher class
+# A trie of names with failure links, scans text once and reports every (start, end) where a name appears.
+# Names added after a scan are inserted into the trie straight away, the failure links are
+# only recomputed (in one pass over the trie) the next time the matcher is used.
+class NameMatcher:
+    def __init__(self, names=()):
+        self.goto = [{}]        #node -> {char: node}, node 0 is the root
+        self.fail = [0]         #node -> longest proper suffix that is also in the trie
+        self.out = [()]         #node -> lengths of every name that ends at this node (own + suffixes)
+        self.ends = [0]         #node -> length of the name ending exactly here, 0 if none
+        self.names = set()      #folded names already in the trie
+        self.stale = False      #true when names were added since the failure links were built
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    #inserts a name into the trie, duplicates and blank names are ignored
+    def add(self, name):
+        if not isinstance(name, str) or not name.strip():
+            return
+        folded = fold(name)
+        if folded in self.names:
+            return
+        self.names.add(folded)
+        node = 0
+        for ch in folded:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+                self.ends.append(0)
+                self.goto[node][ch] = nxt
+            node = nxt
+        self.ends[node] = len(folded)
+        self.stale = True
+
+    #breadth first pass over the trie, parents always get their failure link before their children
+    def _build(self):
+        queue = list(self.goto[0].values())
+        for child in queue:
+            self.fail[child] = 0
+            self.out[child] = (self.ends[child],) if self.ends[child] else ()
+        i = 0
+        while i < len(queue):
+            node = queue[i]
+            i += 1
+            for ch, child in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                own = (self.ends[child],) if self.ends[child] else ()
+                self.out[child] = own + self.out[self.fail[child]]
+                queue.append(child)
+        self.stale = False
+
+    #every (start, end) where a name appears on word boundaries, in the order they end
+    def find_all(self, text):
+        if not self.names:
+            return []
+        if self.stale:
+            self._build()
+        folded = fold(text)
+        size = len(text)
+        matches = []
+        node = 0
+        for i, ch in enumerate(folded):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for length in self.out[node]:
+                start = i + 1 - length
+                end = i + 1
+                #a word boundary on both sides, same as wrapping the name in \b...\b
+                before = start > 0 and is_word_char(text[start - 1])
+                after = end < size and is_word_char(text[end])
+                if before == is_word_char(text[start]) or after == is_word_char(text[end - 1]):
+                    continue
+                matches.append((start, end))
+        return matches
+
+#wraps every matched name in a span and swaps spaces for '||', in one pass over the text.
+#matchers is a list of (NameMatcher, css class), earlier matchers win ties (players before entities).
+#overlapping names resolve to the leftmost, then the longest match.
+def highlight_story(text, matchers):
+    spans = []
+    for priority, (matcher, css_class) in enumerate(matchers):
+        if matcher is None:
+            continue
+        for start, end in matcher.find_all(text):
+            spans.append((start, -(end - start), priority, end, css_class))
+    spans.sort()
+
+    pieces = []
+    pos = 0
+    for start, _, _, end, css_class in spans:
+        if start < pos:
+            continue #overlaps a name that was already highlighted
+        pieces.append(text[pos:start].replace(' ', '||'))
+        pieces.append(f'<span class="{css_class}">{text[start:end].replace(" ", "||")}</span>')
+        pos = end
+    pieces.append(text[pos:].replace(' ', '||'))
+    return "".join(pieces)
@@ -0,0 +1,230 @@
+#jfr
+#room history tiers:
+#   GameRoom.history  - a bounded window of the newest messages, this is what the prompt and joiners see
+#   GameRoom.summary  - a rolling summary of every story message the prompt no longer sends, folded in by a background task
+#   TranscriptArchive - the full transcript of every room on disk, split into append-only segments that clients page through
+import json, os, re, shutil, threading, queue, atexit
+from urllib.parse import quote
+
+HISTORY_WINDOW = 60         #messages kept in memory per room
+PROMPT_HISTORY = 30         #newest story messages the prompt sends, older ones are handed to the summary
+SUMMARY_BATCH = 10          #story messages that have to pile up before they are folded into the summary
+SUMMARY_MAX_CHARS = 2400    #the summary is trimmed to roughly this many characters (~600 tokens)
+SUMMARY_MODEL = "gemini-2.5-flash-lite"
+SEGMENT_SIZE = 200          #messages per transcript segment file
+PAGE_SIZE = 50              #messages sent on join and per page when a client scrolls back
+
+#instruction for the summarizer, the story so far plus the messages that just left the window are filled in
+SUMMARY_PROMPT = """
+You keep the running summary of a tabletop campaign run by GAOL, a Dungeon Master AI.
+Rewrite the STORY SO FAR so that it also covers the NEW EVENTS. Keep names, places, promises, injuries, deaths,
+unresolved threads and anything the players may come back to. Drop flavour text. Plain prose, past tense,
+no more than {max_words} words. Reply with the summary only.
+
+STORY SO FAR:
+{summary}
+
+NEW EVENTS:
+{events}
+"""
+
+#story text as stored is highlighted for the client (spans, '||' for spaces), this is the plain version
+def plain_text(text):
+    return re.sub(r'</?span[^>]*>', '', str(text)).replace('||', ' ')
+
+#how a message reads in the summarizer input
+def message_line(msg):
+    return f"{msg.get('sender', 'Unknown')}: {plain_text(msg.get('text', ''))}"
+
+#keeps the newest part of a summary that has grown past max_chars, cut on a sentence where possible
+def trim_summary(text, max_chars=SUMMARY_MAX_CHARS):
+    text = text.strip()
+    if len(text) <= max_chars:
+        return text
+    cut = text[-max_chars:]
+    sentence = re.search(r'[.!?]\s+', cut)
+    if sentence and sentence.end() < len(cut) // 2:
+        cut = cut[sentence.end():]
+    return cut.strip()
+
+#summary used when the summarizer can't be reached: the first sentence of every message, appended and trimmed
+def fallback_summary(summary, messages):
+    lines = []
+    for msg in messages:
+        text = " ".join(plain_text(msg.get('text', '')).split())
+        first = re.split(r'(?<=[.!?])\s', text, maxsplit=1)[0]
+        if first:
+            lines.append(f"{msg.get('sender', 'Unknown')}: {first}")
+    return trim_summary((summary + "\n" + "\n".join(lines)).strip())
+
+# TranscriptArchive class
+# Every message a room has ever seen, stored as append-only segment files:
+#   data/transcripts/<room_id>/000000.jsonl, 000001.jsonl, ... each holding SEGMENT_SIZE messages (one JSON line each)
+# Message n of a room always lives in segment n // SEGMENT_SIZE, so a page only opens the segments it needs
+# and an append only ever touches the newest segment.
+# Appends are written by a background thread (like the AuditLog) so handlers never wait on the disk,
+# every read waits for the appends queued before it so it sees the whole transcript.
+class TranscriptArchive:
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.counts = {}                #room id -> messages in its transcript, read from disk on first use
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()      #(room id, [JSON lines]) waiting to be written
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name="transcript-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def room_dir(self, room_id):
+        #room ids come from users: percent-encoded (dots included) so they can't escape the transcript directory
+        #and two different ids never share one. Plain ids like "R1" or "my_room" keep their name.
+        safe_id = quote(str(room_id), safe='-_').replace('.', '%2E')
+        return os.path.join(self.directory, safe_id)
+
+    def segment_path(self, room_id, segment):
+        return os.path.join(self.room_dir(room_id), f"{segment:06d}.jsonl")
+
+    def exists(self, room_id):
+        return self.count(room_id) > 0
+
+    #number of messages in a room's transcript
+    def count(self, room_id):
+        self.flush()
+        with self.lock:
+            return self._count(room_id)
+
+    #queues messages for the end of a room's transcript, never blocks the caller
+    def append(self, room_id, messages):
+        if messages:
+            self.queue.put((room_id, [json.dumps(m) + "\n" for m in messages]))
+
+    #blocks until everything queued so far has been written
+    def flush(self):
+        self.queue.join()
+
+    #writes whatever is left and stops the writer thread
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            #drain anything else that is waiting, so a busy turn opens each segment once
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            rooms = {} #room id -> lines, in the order they were queued
+            for entry in batch:
+                if entry is not None:
+                    rooms.setdefault(entry[0], []).extend(entry[1])
+            try:
+                for room_id, lines in rooms.items():
+                    try:
+                        self._write(room_id, lines)
+                    except Exception as e:
+                        print(f"[TRANSCRIPT ERROR] Could not append to the transcript of {room_id}: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stop:
+                return
+
+    def _write(self, room_id, lines):
+        with self.lock:
+            seq = self._count(room_id)
+            os.makedirs(self.room_dir(room_id), exist_ok=True)
+            i = 0
+            while i < len(lines):
+                segment, offset = divmod(seq, self.segment_size)
+                chunk = lines[i:i + self.segment_size - offset]
+                with open(self.segment_path(room_id, segment), 'a') as f:
+                    f.writelines(chunk)
+                seq += len(chunk)
+                i += len(chunk)
+            self.counts[room_id] = seq
+
+    #up to `limit` messages from before message number `before` (the end of the transcript if None), oldest first
+    #returns (messages, seq of the first message returned)
+    def read_page(self, room_id, before=None, limit=PAGE_SIZE):
+        self.flush()
+        with self.lock:
+            total = self._count(room_id)
+            end = total if before is None else max(0, min(int(before), total))
+            start = max(0, end - max(1, int(limit)))
+            messages = []
+            if start < end:
+                for segment in range(start // self.segment_size, (end - 1) // self.segment_size + 1):
+                    base = segment * self.segment_size
+                    lines = self._read_segment(room_id, segment)
+                    messages.extend(lines[max(start - base, 0):end - base])
+        return messages, start
+
+    #the newest `limit` messages, used to refill a room's history window after a restart
+    def tail(self, room_id, limit):
+        return self.read_page(room_id, None, limit)[0]
+
+    #drops the cached message count, for when another server worker may have appended to the room
+    def forget(self, room_id):
+        self.flush()
+        with self.lock:
+            self.counts.pop(room_id, None)
+
+    def delete(self, room_id):
+        self.flush() #or a queued append would recreate the room's directory
+        with self.lock:
+            shutil.rmtree(self.room_dir(room_id), ignore_errors=True)
+            self.counts.pop(room_id, None)
+
+    def _count(self, room_id):
+        if room_id not in self.counts:
+            segments = self._segments(room_id)
+            total = 0
+            if segments:
+                self._repair(room_id, segments[-1])
+                #every segment but the last is full
+                total = segments[-1] * self.segment_size + len(self._read_segment(room_id, segments[-1]))
+            self.counts[room_id] = total
+        return self.counts[room_id]
+
+    def _segments(self, room_id):
+        try:
+            names = os.listdir(self.room_dir(room_id))
+        except FileNotFoundError:
+            return []
+        return sorted(int(n[:-6]) for n in names if n.endswith('.jsonl') and n[:-6].isdigit())
+
+    def _read_segment(self, room_id, segment):
+        messages = []
+        try:
+            with open(self.segment_path(room_id, segment), 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        messages.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue #unreadable line, _repair drops torn ones before anything is appended
+        except FileNotFoundError:
+            pass
+        return messages
+
+    #a crash mid-append can leave a last line without its newline, the next append would be glued onto it and lost too.
+    #cuts the segment back to its last complete line, called once per room before its first append
+    def _repair(self, room_id, segment):
+        path = self.segment_path(room_id, segment)
+        try:
+            with open(path, 'rb+') as f:
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    f.truncate(data.rfind(b"\n") + 1)
+                    print(f"[TRANSCRIPT] Dropped a torn last line from {path}")
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,132 @@
+#jfr
+#the lobby's room list, kept up to date as rooms change instead of being rebuilt on every request.
+#handlers only mark a room as touched, the lobby loop turns the touched rooms into rows and sends each
+#lobby subscriber the rows that changed for its filters (room_list_delta). A room list request is a filter and a slice.
+import threading
+
+ROOM_CAPACITY = 6   #most players a room takes, see on_join
+PAGE_SIZE = 10      #rooms per page of the room list
+MAX_PAGE_SIZE = 50
+
+#filters a client can send with get_rooms, anything missing or unknown means "any"
+#   visibility - 'public' or 'private'
+#   started    - True for games in progress, False for rooms still in the lobby
+#   world      - world id
+#   free_slots - rooms with at least this many open seats
+def parse_filters(data):
+    data = data if isinstance(data, dict) else {}
+    filters = {}
+    if data.get('visibility') in ('public', 'private'):
+        filters['visibility'] = data['visibility']
+    if isinstance(data.get('started'), bool):
+        filters['started'] = data['started']
+    if data.get('world'):
+        filters['world'] = str(data['world'])
+    try:
+        free_slots = int(data.get('free_slots') or 0)
+    except (TypeError, ValueError):
+        free_slots = 0
+    if free_slots > 0:
+        filters['free_slots'] = min(free_slots, ROOM_CAPACITY)
+    return filters
+
+def matches(row, filters):
+    if row is None:
+        return False
+    if 'visibility' in filters and row['is_private'] != (filters['visibility'] == 'private'):
+        return False
+    if 'started' in filters and row['is_started'] != filters['started']:
+        return False
+    if 'world' in filters and row['world_id'] != filters['world']:
+        return False
+    if row['max_players'] - row['player_count'] < filters.get('free_slots', 0):
+        return False
+    return True
+
+#rooms that can still be joined first, then by id, so a page doesn't reshuffle every time someone joins
+def sort_key(row):
+    return (row['is_started'] or row['player_count'] >= row['max_players'], row['id'])
+
+# LobbyIndex class
+# row_for(room_id) builds the lobby row of a room, or returns None if the room is gone.
+# Rows are only rebuilt for rooms touched since the last refresh, so an idle server does no work here.
+class LobbyIndex:
+    def __init__(self, row_for):
+        self.row_for = row_for
+        self.rows = {}              #room id -> the row the subscribers were last sent
+        self.version = 0            #bumped on every refresh that changed something
+        self.dirty = set()          #room ids touched since the last refresh
+        self.subscribers = {}       #sid -> filters, clients looking at the room list
+        self.lock = threading.Lock()
+
+    #marks a room as possibly changed (created, joined, left, started, closed)
+    def touch(self, room_id):
+        with self.lock:
+            self.dirty.add(room_id)
+
+    #rebuilds the touched rows, returns [(old row, new row)] for the rooms whose row actually changed
+    def refresh(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            changes = []
+            for room_id in dirty:
+                old = self.rows.get(room_id)
+                new = self.row_for(room_id)
+                if new == old:
+                    continue
+                if new is None:
+                    del self.rows[room_id]
+                else:
+                    self.rows[room_id] = new
+                changes.append((old, new))
+            if changes:
+                self.version += 1
+            return changes
+
+    #one page of the rooms that match the filters
+    def query(self, filters, page=0, page_size=PAGE_SIZE):
+        page_size = max(1, min(int(page_size or PAGE_SIZE), MAX_PAGE_SIZE))
+        with self.lock:
+            found = sorted((r for r in self.rows.values() if matches(r, filters)), key=sort_key)
+            version = self.version
+        pages = max(1, -(-len(found) // page_size))
+        page = max(0, min(int(page or 0), pages - 1))
+        return {
+            'rooms': found[page * page_size:(page + 1) * page_size],
+            'total': len(found),
+            'page': page,
+            'pages': pages,
+            'page_size': page_size,
+            'filters': filters,
+            'version': version
+        }
+
+    def subscribe(self, sid, filters):
+        with self.lock:
+            self.subscribers[sid] = filters
+
+    def unsubscribe(self, sid):
+        with self.lock:
+            self.subscribers.pop(sid, None)
+
+    def has_subscribers(self):
+        return bool(self.subscribers)
+
+    #what each subscriber has to be told about the changes from refresh(), as (sid, delta) pairs
+    #upserts are rows that match the subscriber's filters (added counts the ones that didn't before),
+    #removed are ids of rooms that were closed or no longer match
+    def deltas(self, changes):
+        with self.lock:
+            subscribers = list(self.subscribers.items())
+            version = self.version
+        for sid, filters in subscribers:
+            upserts, removed, added = [], [], 0
+            for old, new in changes:
+                was, now = matches(old, filters), matches(new, filters)
+                if now:
+                    upserts.append(new)
+                    added += 0 if was else 1
+                elif was:
+                    removed.append(old['id'])
+            if upserts or removed:
+                yield sid, {'upserts': upserts, 'removed': removed, 'total_change': added - len(removed), 'version': version}
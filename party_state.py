@@ -0,0 +1,74 @@
+#jfr
+#versioned party state, what the character cards on the client are built from.
+#each room keeps the last state it published, a change is broadcast as a patch holding only the fields that changed.
+#clients apply a patch on top of the version it was built from (base) and ask for a full snapshot if they don't have it.
+import json
+
+#fields of a player that are published, besides the name which identifies them
+PARTY_FIELDS = ('hp', 'status', 'has_acted', 'is_ready', 'tags', 'ambition', 'secret', 'description')
+
+#what a client sees of a player
+def player_state(p):
+    state = {'name': p.username}
+    for field in PARTY_FIELDS:
+        value = getattr(p, field)
+        state[field] = list(value) if isinstance(value, list) else value #copied, tags are edited in place
+    return state
+
+# PartyState class
+# The last published party of one room and its version number.
+class PartyState:
+    def __init__(self):
+        self.version = 0
+        self.players = {}   #name -> published state
+        self.order = []     #names in the order the cards are shown
+
+    #the published state in full, sent to anyone who joins, reconnects or falls out of sync
+    def snapshot(self):
+        return {'version': self.version, 'players': [self.players[name] for name in self.order]}
+
+    #compares the room's players against the published state and moves the published state forward
+    #returns the patch to broadcast, or None if nothing changed
+    def diff(self, room_id, players):
+        current = [player_state(p) for p in players]
+        order = [s['name'] for s in current]
+        changed = {}
+        added = []
+        for state in current:
+            old = self.players.get(state['name'])
+            if old is None:
+                added.append(state)
+                continue
+            fields = {f: state[f] for f in PARTY_FIELDS if state[f] != old[f]}
+            if fields:
+                changed[state['name']] = fields
+        if not changed and not added and order == self.order:
+            return None
+
+        patch = {'room': room_id, 'base': self.version, 'version': self.version + 1}
+        if changed:
+            patch['changed'] = changed
+        if added:
+            patch['added'] = added
+        if order != self.order:
+            patch['order'] = order #players joined, left or were reordered
+        self.version += 1
+        self.players = {s['name']: s for s in current}
+        self.order = order
+        return patch
+
+    #plain dict form, so another server worker can keep publishing from the same version
+    def to_state(self):
+        return {'version': self.version, 'players': self.players, 'order': self.order}
+
+    @classmethod
+    def from_state(cls, state):
+        ps = cls()
+        ps.version = state['version']
+        ps.players = state['players']
+        ps.order = state['order']
+        return ps
+
+    #true when a patch wouldn't be any smaller than the snapshot (e.g. everyone changed at once)
+    def patch_is_larger(self, patch):
+        return len(json.dumps(patch)) >= len(json.dumps(self.snapshot()))
@@ -0,0 +1,75 @@
+#jfr
+#prompt budgeting, keeps each turn's prompt inside a per-room input token budget
+#so prompt size (and with it latency and TPM usage) stays steady from turn to turn.
+
+#Gemini averages roughly 4 characters per token on English prose, close enough for budgeting
+CHARS_PER_TOKEN = 4
+
+#default input token budget per model (the whole prompt, system instruction included)
+MODEL_INPUT_BUDGETS = {
+    'gemini-2.5-flash-lite': 6000,
+    'gemini-2.5-flash': 8000,
+    'gemini-2.5-pro': 12000
+}
+DEFAULT_INPUT_BUDGET = 6000
+
+#share of the flexible budget lore may claim before history gets its turn
+LORE_SHARE = 0.4
+#the most recent history messages are kept whenever they fit, they carry the thread of the story
+MIN_RECENT_HISTORY = 2
+
+#local token estimate of a piece of text
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
+
+#budget for a room, a room override wins over the model default
+def input_budget_for(model, override=None):
+    if override:
+        return int(override)
+    return MODEL_INPUT_BUDGETS.get(model, DEFAULT_INPUT_BUDGET)
+
+# PromptPacker class
+# Fixed sections (instructions, party status, actions) are reserved first,
+# then the highest value lore and the newest history are packed into whatever budget is left.
+class PromptPacker:
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+
+    @property
+    def remaining(self):
+        return max(0, self.budget - self.used)
+
+    #reserves space for a section that is always sent, even if it blows the budget
+    def require(self, text):
+        self.used += estimate_tokens(text)
+
+    #picks lore lines by score until the lore share is used up, items are {'text', 'score'} sorted best first
+    def pack_lore(self, items, limit, share=LORE_SHARE):
+        allowance = int(self.remaining * share)
+        chosen = []
+        spent = 0
+        for item in items:
+            if len(chosen) >= limit:
+                break
+            cost = estimate_tokens(item['text'])
+            if spent + cost > allowance:
+                continue #a shorter, lower scored line may still fit
+            chosen.append(item['text'])
+            spent += cost
+        self.used += spent
+        return chosen
+
+    #picks history lines newest first until the budget is used up, returned in chronological order
+    def pack_history(self, lines, min_recent=MIN_RECENT_HISTORY):
+        chosen = []
+        for i, line in enumerate(reversed(lines)):
+            cost = estimate_tokens(line)
+            if cost > self.remaining and i >= min_recent:
+                break
+            chosen.append(line)
+            self.used += cost
+        chosen.reverse()
+        return chosen
@@ -0,0 +1,314 @@
+#jfr
+#lore relevance, picks the bits of world lore worth spending prompt tokens on each turn
+import re
+import numpy as np
+
+#stop words are common word that aren't relevant to our prompting, and removing them helps minimize prompt bloat and improve both efficiency and information relevancy.
+STOP_WORDS = {
+    'the', 'is', 'at', 'which', 'on', 'a', 'an', 'and', 'or', 'but',
+    'if', 'of', 'to', 'in', 'for', 'with', 'by', 'from', 'up', 'about',
+    'into', 'over', 'after', 'i', 'you', 'he', 'she', 'it', 'we', 'they',
+    'me', 'him', 'her', 'us', 'them', 'my', 'your', 'his', 'its', 'our', 'their'
+}
+WORD_PATTERN = re.compile(r'\b\w+\b')
+
+#takes all the tokens submitted, cleans them, and removes stop words.
+def extract_keywords(text):
+    if not text: return set()
+    #clean and split text into tokens
+    tokens = WORD_PATTERN.findall(text.lower())           #extracts just the words, letters, and characters (removing punctuation)
+    return {t for t in tokens if t not in STOP_WORDS}     #removes all the stop words from the list of words
+
+#how much a word counts depending on where in the lore it appears (explicit names are high value)
+FIELD_WEIGHTS = {'name': 2.0, 'keywords': 1.0, 'description': 0.5}
+
+# LoreIndexEntry class
+# the precomputed keyword sets of one piece of lore, built once when the entity is added or edited
+class LoreIndexEntry:
+    __slots__ = ('kind', 'key', 'entity', 'seq', 'name', 'keywords', 'description', 'weights', 'length')
+
+    def __init__(self, kind, key, entity, seq):
+        self.kind = kind
+        self.key = key
+        self.entity = entity
+        self.seq = seq                                                  #insertion order, keeps ties in a stable order
+        self.name = extract_keywords(entity.name)
+        #manual keywords are matched whole (lowercased), same as they always were
+        self.keywords = {k.lower() for k in (getattr(entity, 'keywords', None) or []) if isinstance(k, str)}
+        self.description = extract_keywords(getattr(entity, 'description', ''))
+        #field weighted term frequency of every token, used by the bm25/tfidf scorers
+        self.weights = {}
+        for field in ('name', 'keywords', 'description'):
+            for token in getattr(self, field):
+                self.weights[token] = self.weights.get(token, 0.0) + FIELD_WEIGHTS[field]
+        self.length = sum(self.weights.values())
+
+    def tokens(self):
+        return self.name | self.keywords | self.description
+
+# LoreIndex class
+# Inverted index from keyword to the lore that contains it, one per World.
+# It is maintained incrementally by World.mark_changed, so a turn only looks at lore sharing a word with the turn context.
+class LoreIndex:
+    def __init__(self):
+        self.entries = {}   #{(kind, name key): LoreIndexEntry}
+        self.postings = {}  #{token: set of (kind, name key)}, the size of a set is that token's document frequency
+        self.next_seq = 0
+        self.total_length = 0.0 #sum of entry lengths, for the average document length in bm25
+        #numpy side of the index for the bm25/tfidf scorers, rows are entry seq numbers
+        self.by_seq = []                        #seq -> LoreIndexEntry (None once removed)
+        self.lengths = np.zeros(64)             #seq -> entry length
+        self.token_arrays = {}                  #{token: (seq array, weighted tf array)}, rebuilt lazily when a token's postings change
+
+    #(re)indexes an entity, called whenever it's added or its text changes. key is the entity's unique name key
+    def index_entity(self, kind, entity, key):
+        ref = (kind, key)
+        old = self.entries.get(ref)
+        if old:
+            self._unlink(old)
+            seq = old.seq
+        else:
+            seq = self.next_seq
+            self.next_seq += 1
+        entry = LoreIndexEntry(kind, ref[1], entity, seq)
+        self.entries[ref] = entry
+        self.total_length += entry.length
+        for token in entry.tokens():
+            self.postings.setdefault(token, set()).add(ref)
+            self.token_arrays.pop(token, None)
+        #grow the seq arrays by doubling
+        if seq >= len(self.by_seq):
+            self.by_seq.extend([None] * (seq + 1 - len(self.by_seq)))
+        if seq >= len(self.lengths):
+            self.lengths = np.concatenate([self.lengths, np.zeros(max(seq + 1, len(self.lengths)))])
+        self.by_seq[seq] = entry
+        self.lengths[seq] = entry.length
+
+    def remove_entity(self, kind, key):
+        entry = self.entries.pop((kind, key), None)
+        if entry:
+            self._unlink(entry)
+            self.by_seq[entry.seq] = None
+            self.lengths[entry.seq] = 0.0
+
+    def _unlink(self, entry):
+        ref = (entry.kind, entry.key)
+        self.total_length -= entry.length
+        for token in entry.tokens():
+            self.token_arrays.pop(token, None)
+            refs = self.postings.get(token)
+            if refs:
+                refs.discard(ref)
+                if not refs:
+                    del self.postings[token]
+
+    #every entry sharing at least one token with the context, optionally limited to some kinds
+    def candidates(self, context_keywords, kinds=None):
+        refs = set()
+        for token in context_keywords:
+            hits = self.postings.get(token)
+            if hits:
+                refs |= hits
+        entries = [self.entries[ref] for ref in refs]
+        if kinds is not None:
+            entries = [e for e in entries if e.kind in kinds]
+        return entries
+
+    #seq numbers and weighted term frequencies of every entry containing the token, as numpy arrays
+    def _token_arrays(self, token):
+        arrays = self.token_arrays.get(token)
+        if arrays is None:
+            refs = self.postings[token]
+            seqs = np.fromiter((self.entries[ref].seq for ref in refs), dtype=np.int64, count=len(refs))
+            tf = np.fromiter((self.entries[ref].weights[token] for ref in refs), dtype=np.float64, count=len(refs))
+            arrays = (seqs, tf)
+            self.token_arrays[token] = arrays
+        return arrays
+
+    #scores every entry against the context in one vectorized pass
+    #scoring is 'bm25' or 'tfidf', returns the matching entries and a numpy array of their scores
+    def score(self, context_keywords, kinds=None, scoring='bm25', k1=1.2, b=0.75):
+        query = [t for t in context_keywords if t in self.postings]
+        if not query:
+            return [], np.zeros(0)
+
+        #sparse (entry seq, query token, weighted tf) triples, straight from the cached posting arrays
+        per_token = [self._token_arrays(t) for t in query]
+        seqs = np.concatenate([a[0] for a in per_token])
+        tf = np.concatenate([a[1] for a in per_token])
+        df = np.array([len(a[0]) for a in per_token], dtype=np.float64)
+        cols = np.repeat(np.arange(len(query)), df.astype(np.int64))
+
+        total_docs = len(self.entries)
+        if scoring == 'tfidf':
+            idf = np.log(1.0 + total_docs / df)
+            contrib = tf * idf[cols]
+        else:
+            idf = np.log(1.0 + (total_docs - df + 0.5) / (df + 0.5))
+            avg_length = self.total_length / total_docs if total_docs else 1.0
+            norm = k1 * (1.0 - b + b * self.lengths[seqs] / max(avg_length, 1e-9))
+            contrib = idf[cols] * (tf * (k1 + 1.0)) / (tf + norm)
+        totals = np.bincount(seqs, weights=contrib, minlength=len(self.by_seq))
+
+        hits = np.flatnonzero(totals > 0)
+        entries = [self.by_seq[i] for i in hits]
+        scores = totals[hits]
+        if kinds is not None:
+            keep = [i for i, e in enumerate(entries) if e.kind in kinds]
+            entries = [entries[i] for i in keep]
+            scores = scores[keep]
+        return entries, scores
+
+# RelevanceEngine class
+# The purpose of this class is to allow for better scoping of context so that only relevant information is sent into the prompt
+# and to reduce unnecessary information from taking up token count in our prompting.
+class RelevanceEngine:
+    STOP_WORDS = STOP_WORDS
+    #the order lore types are listed in when scores tie
+    KIND_ORDER = {'groups': 0, 'locations': 1, 'characters': 2, 'biology': 3}
+    #the original engine only ever looked at groups and locations
+    OVERLAP_KINDS = ('groups', 'locations')
+    #selectable scoring engines: 'overlap' counts raw word matches with fixed weights,
+    #'bm25' and 'tfidf' weigh matches by how rare the word is in the world, so common words ("city", "king") stop flooding the results
+    SCORING_MODES = ('overlap', 'bm25', 'tfidf')
+
+    #takes all the tokens submitted, cleans them, and removes stop words.
+    @staticmethod
+    def extract_keywords(text):
+        return extract_keywords(text)
+
+    #prompt line for a piece of lore
+    @staticmethod
+    def format_entity(kind, entity):
+        if kind == 'locations':
+            return f"[{entity.type_tag}] {entity.name} (at {entity.x},{entity.y}): {entity.description} [Controlled by: {entity.affiliation}]"
+        if kind == 'characters':
+            return f"[Figure: {entity.role}] {entity.name} ({entity.affiliation}, {entity.status}): {entity.description}"
+        if kind == 'biology':
+            return f"[Biology] {entity.name}: {entity.description} [Habitat: {entity.habitat} | Disposition: {entity.disposition}]"
+        return f"[{entity.type_tag}] {entity.name}: {entity.description}"
+
+    #original scoring, raw overlap counts with fixed 2x/1x/0.5x weights
+    @staticmethod
+    def score_overlap(world, context_keywords):
+        scored_items = []
+        #only lore that shares a word with the context can score, so the index hands us just those
+        candidates = world.lore_index.candidates(context_keywords, kinds=RelevanceEngine.OVERLAP_KINDS)
+        candidates.sort(key=lambda e: (RelevanceEngine.KIND_ORDER[e.kind], e.seq))
+        for entry in candidates:
+            score = 0
+            score += len(entry.name & context_keywords) * 2               #2x weight value (explicit names are high value)
+            score += len(entry.keywords & context_keywords)               #1x weight value
+            #groups also check the description (lower weight)
+            if entry.kind == 'groups':
+                score += len(entry.description & context_keywords) * 0.5  #1/2 weight value
+
+            if score > 0:
+                scored_items.append({
+                    'text': RelevanceEngine.format_entity(entry.kind, entry.entity),
+                    'score': score
+                })
+        return scored_items
+
+    #bm25/tfidf scoring over every kind of lore, computed by the world's LoreIndex in one numpy pass
+    #only the top `limit` entries are formatted, nothing past that could make it into the prompt
+    @staticmethod
+    def score_weighted(world, context_keywords, scoring, limit):
+        candidates, scores = world.lore_index.score(context_keywords, scoring=scoring)
+        if not candidates:
+            return []
+        kind_order = np.array([RelevanceEngine.KIND_ORDER[e.kind] for e in candidates])
+        seqs = np.array([e.seq for e in candidates])
+        #highest score first, ties keep the usual kind/insertion order
+        top = np.lexsort((seqs, kind_order, -scores))[:limit]
+        return [
+            {'text': RelevanceEngine.format_entity(candidates[i].kind, candidates[i].entity), 'score': float(scores[i])}
+            for i in top
+        ]
+
+    #the world's standing lore (factions, then places) as prompt lines in the order they were added, up to max_chars
+    #unlike the scored lore it doesn't depend on the turn, so it can sit in the cached prompt prefix
+    @staticmethod
+    def settled_lore(world, max_chars):
+        lines, used = [], 0
+        for kind in ('groups', 'locations'):
+            for entity in getattr(world, kind):
+                line = RelevanceEngine.format_entity(kind, entity)
+                if used + len(line) + 1 > max_chars:
+                    return lines
+                lines.append(line)
+                used += len(line) + 1
+        return lines
+
+    #grab relevent lore bits from the world file, as one block of prompt text
+    @staticmethod
+    def get_relevant_lore(world, history_buffer, current_actions, limit=5, scoring='overlap'):
+        top_items = RelevanceEngine.get_scored_lore(world, history_buffer, current_actions, limit, scoring)
+        return "\n".join([item['text'] for item in top_items])
+
+    #scored lore items ({'text', 'score'}), best first
+    @staticmethod
+    def get_scored_lore(world, history_buffer, current_actions, limit=5, scoring='overlap'):
+        #creates search context out of recent history and the actions being taken
+        search_context = history_buffer + " " + current_actions
+        #distills that search context into relevant keywords for better searching
+        context_keywords = RelevanceEngine.extract_keywords(search_context)
+
+        #scoring out items
+        #scores against major events and worldentites
+        if scoring == 'overlap':
+            scored_items = RelevanceEngine.score_overlap(world, context_keywords)
+        else:
+            scored_items = RelevanceEngine.score_weighted(world, context_keywords, scoring, limit)
+            #bm25/tfidf scores grow with the size of the world, scale them to 0-1 (the best match of this query is 1)
+            #so they rank on the same footing as the event scores below
+            best = max((item['score'] for item in scored_items), default=0)
+            for item in scored_items:
+                item['score'] = item['score'] / best if best > 0 else 0.0
+        normalized = scoring != 'overlap'
+
+        #process major world events (factoring in a recency bias with keyword matching)
+        #since events are added sequentially, the further they are in the list the more recent they happened.
+        #NOTE: events are capped at 20 per world, so they are scored directly instead of going through the index
+        total_events = len(world.major_events)
+        event_matches = []
+        for i, event in enumerate(world.major_events):
+            score = 0
+
+            #check if event is a dict (new format) or string (old format)
+            if isinstance(event, dict):
+                text_content = f"{event.get('title', '')} {event.get('description', '')}"
+                display_text = f"[History] {event.get('title', 'Event')}: {event.get('description', '')}"
+            else:
+                text_content = event
+                display_text = f"[History] {event}"
+
+            event_words = RelevanceEngine.extract_keywords(text_content)
+            score += len(event_words.intersection(context_keywords))
+            event_matches.append((i, display_text, score))
+
+        best_match = max((m for _, _, m in event_matches), default=0)
+        for i, display_text, score in event_matches:
+            #recency bias (events at end of list get higher base score)
+            recency = i / total_events
+            is_latest = i == total_events - 1
+            if normalized:
+                #same 0-1 range as the lore: mostly keyword matches, a little recency
+                final_score = (score / best_match if best_match else 0) * 0.75 + recency * 0.25
+                #keep the most recent event in mind, even if it's not super relevant.
+                if is_latest:
+                    final_score += 1
+            else:
+                final_score = score + recency * 2
+                #keep the most recent event in mind, even if it's not super relevant.
+                if is_latest:
+                    final_score += 10
+
+            scored_items.append({
+                'text': display_text,
+                'score': final_score
+            })
+
+        #sort the items by their score, and slice the most relevant scorings.
+        scored_items.sort(key=lambda x: x['score'], reverse=True)
+        return scored_items[:limit]
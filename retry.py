@@ -0,0 +1,125 @@
+#jfr
+#retry policy for generation calls.
+#   RetryPolicy    - which errors are worth another attempt and how long to back off before it (exponential, full jitter)
+#   CircuitBreaker - per model, after repeated failures the model is skipped outright for a cooldown instead of
+#                    making every room wait through its own retries, then a single probe decides if it's healthy again
+#   ModelChain     - the room's model followed by the fallback models, skipping any whose breaker is open
+import random, threading, time
+import httpx
+from google.genai import errors
+
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}   #timeouts, quota, overload and server errors
+FAILURE_THRESHOLD = 3   #consecutive failures that open a model's breaker
+OPEN_SECONDS = 30       #how long an open breaker fails fast before letting a probe through
+#models by price per token, cheapest first. Without configured fallbacks a room only falls back to models
+#priced at or below its own, so a failing model never moves a room onto a pricier one
+MODEL_PRICE_ORDER = ['gemini-2.5-flash-lite', 'gemini-2.5-flash', 'gemini-2.5-pro']
+
+# RetryPolicy class
+# attempts is the total number of calls per generation (across every model in the chain)
+class RetryPolicy:
+    def __init__(self, attempts=4, base_delay=1.0, max_delay=12.0, rng=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+
+    #seconds to wait before attempt number `attempt` (2 is the first retry), anywhere between 0 and the exponential cap
+    #so rooms that failed together don't all come back at the same moment
+    def delay(self, attempt):
+        cap = min(self.max_delay, self.base_delay * (2 ** max(0, attempt - 2)))
+        return self.rng.uniform(0, cap)
+
+    #true for errors a later attempt may not hit: overload, quota, server errors and dropped connections
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, errors.APIError):
+            return error.code in RETRYABLE_CODES
+        return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+    #short label for the logs and the audit record
+    @staticmethod
+    def describe(error):
+        if isinstance(error, errors.APIError):
+            return f"{error.code} {error.status or ''}".strip()
+        return type(error).__name__
+
+# CircuitBreaker class
+# closed    - calls go through, consecutive failures are counted
+# open      - calls are refused until OPEN_SECONDS have passed
+# half_open - one probe call is let through, its outcome closes or reopens the breaker
+class CircuitBreaker:
+    def __init__(self, name, threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS):
+        self.name = name
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    #true if a call may be made now
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() - self.opened_at >= self.open_seconds:
+                self.state = 'half_open'
+                self.probing = False
+            if self.state == 'half_open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != 'closed':
+                print(f"[CIRCUIT] {self.name} is healthy again.")
+            self.state = 'closed'
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    print(f"[CIRCUIT] {self.name} failed {self.failures} times in a row, skipping it for {self.open_seconds}s.")
+                self.state = 'open'
+                self.opened_at = time.time()
+                self.probing = False
+
+# ModelChain class
+# Breakers for every model, and the order models are tried in for a room
+class ModelChain:
+    #fallbacks is the fixed list tried after any room's model, leave it empty to use the cheaper models of MODEL_PRICE_ORDER
+    def __init__(self, fallbacks=()):
+        self.fallbacks = [m for m in fallbacks if m]
+        self.breakers = {}          #model -> CircuitBreaker
+        self.lock = threading.Lock()
+
+    def breaker(self, model):
+        with self.lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(model)
+            return self.breakers[model]
+
+    #the room's model first, then the fallbacks, each only once
+    def models_for(self, model):
+        chain = [model]
+        fallbacks = self.fallbacks
+        if not fallbacks and model in MODEL_PRICE_ORDER:
+            #the next cheaper model first, a model we have no price for gets no fallbacks
+            fallbacks = MODEL_PRICE_ORDER[:MODEL_PRICE_ORDER.index(model)][::-1]
+        for fallback in fallbacks:
+            if fallback not in chain:
+                chain.append(fallback)
+        return chain
+
+    #the first model in the chain whose breaker lets a call through, None if every one of them is open
+    def pick(self, model):
+        for candidate in self.models_for(model):
+            if self.breaker(candidate).allow():
+                return candidate
+        return None
@@ -0,0 +1,197 @@
+#jfr
+#shared room state, so any server worker can serve any room.
+#rooms are stored as JSON blobs with a version number, and a room can only be changed by the worker holding its lease.
+#backends (picked with GAOL_STATE_BACKEND):
+#   local               - single process, nothing is shared and leases always succeed (the default)
+#   sqlite:///path.db   - every worker on one machine shares a sqlite file, also the stand-in used for testing
+#   redis://host:port/0 - workers on any machine share a redis server (needs `pip install redis`)
+import json, os, sqlite3, threading, time
+
+# LocalStateBackend class
+# Everything already lives in this process, so there is nothing to share or lock.
+class LocalStateBackend:
+    shared = False
+
+    def acquire_lease(self, room_id, owner, ttl):
+        return True
+
+    def release_lease(self, room_id, owner):
+        pass
+
+    def load_room(self, room_id):
+        return None, None
+
+    def save_room(self, room_id, state):
+        return 0
+
+    def delete_room(self, room_id):
+        pass
+
+    def room_versions(self):
+        return {}
+
+    def bump_world(self, world_id):
+        return 0
+
+    def world_revision(self, world_id):
+        return 0
+
+# SQLiteStateBackend class
+# Rooms, leases and world revisions in a sqlite file (WAL mode), safe to share between processes on one machine.
+class SQLiteStateBackend:
+    shared = True
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rooms (room_id TEXT PRIMARY KEY, version INTEGER NOT NULL, state TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS leases (room_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS world_revisions (world_id TEXT PRIMARY KEY, revision INTEGER NOT NULL)")
+
+    #takes (or extends) the lease if it is free, expired, or already ours
+    def acquire_lease(self, room_id, owner, ttl):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("""
+                    INSERT INTO leases (room_id, owner, expires) VALUES (?, ?, ?)
+                    ON CONFLICT(room_id) DO UPDATE SET owner=excluded.owner, expires=excluded.expires
+                    WHERE leases.owner = excluded.owner OR leases.expires < ?
+                """, (room_id, owner, now + ttl, now))
+                row = self.conn.execute("SELECT owner FROM leases WHERE room_id = ?", (room_id,)).fetchone()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return row is not None and row[0] == owner
+
+    def release_lease(self, room_id, owner):
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE room_id = ? AND owner = ?", (room_id, owner))
+
+    #(version, state dict) of a room, (None, None) if it doesn't exist
+    def load_room(self, room_id):
+        with self.lock:
+            row = self.conn.execute("SELECT version, state FROM rooms WHERE room_id = ?", (room_id,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1])
+
+    #stores a room and returns its new version
+    def save_room(self, room_id, state):
+        blob = json.dumps(state)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("""
+                    INSERT INTO rooms (room_id, version, state) VALUES (?, 1, ?)
+                    ON CONFLICT(room_id) DO UPDATE SET version=rooms.version + 1, state=excluded.state
+                """, (room_id, blob))
+                version = self.conn.execute("SELECT version FROM rooms WHERE room_id = ?", (room_id,)).fetchone()[0]
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return version
+
+    def delete_room(self, room_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM rooms WHERE room_id = ?", (room_id,))
+
+    #{room_id: version} of every room, lets a worker see what it is missing without loading every room
+    def room_versions(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT room_id, version FROM rooms").fetchall())
+
+    #called after a world's lore is written, other workers reload the world once they see a higher revision
+    def bump_world(self, world_id):
+        with self.lock:
+            self.conn.execute("""
+                INSERT INTO world_revisions (world_id, revision) VALUES (?, 1)
+                ON CONFLICT(world_id) DO UPDATE SET revision=world_revisions.revision + 1
+            """, (world_id,))
+            return self.conn.execute("SELECT revision FROM world_revisions WHERE world_id = ?", (world_id,)).fetchone()[0]
+
+    def world_revision(self, world_id):
+        with self.lock:
+            row = self.conn.execute("SELECT revision FROM world_revisions WHERE world_id = ?", (world_id,)).fetchone()
+        return row[0] if row else 0
+
+# RedisStateBackend class
+# Same layout as the sqlite backend in redis hashes and keys, for workers spread over several machines.
+class RedisStateBackend:
+    shared = True
+    #deletes the lease only if we still own it, in one step
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+    #extends the lease if we own it, or takes it if it's free
+    ACQUIRE_SCRIPT = """
+        local current = redis.call('get', KEYS[1])
+        if current == false or current == ARGV[1] then
+            redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2])
+            return 1
+        end
+        return 0
+    """
+
+    def __init__(self, url):
+        import redis #only needed when redis is actually used
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.acquire_script = self.redis.register_script(self.ACQUIRE_SCRIPT)
+        self.release_script = self.redis.register_script(self.RELEASE_SCRIPT)
+
+    def acquire_lease(self, room_id, owner, ttl):
+        return bool(self.acquire_script(keys=[f"gaol:lease:{room_id}"], args=[owner, int(ttl * 1000)]))
+
+    def release_lease(self, room_id, owner):
+        self.release_script(keys=[f"gaol:lease:{room_id}"], args=[owner])
+
+    def load_room(self, room_id):
+        version, blob = self.redis.hmget(f"gaol:room:{room_id}", 'version', 'state')
+        if blob is None:
+            return None, None
+        return int(version), json.loads(blob)
+
+    def save_room(self, room_id, state):
+        key = f"gaol:room:{room_id}"
+        pipe = self.redis.pipeline()
+        pipe.hincrby(key, 'version', 1)
+        pipe.hset(key, 'state', json.dumps(state))
+        pipe.sadd("gaol:rooms", room_id)
+        version = pipe.execute()[0]
+        return version
+
+    def delete_room(self, room_id):
+        pipe = self.redis.pipeline()
+        pipe.delete(f"gaol:room:{room_id}")
+        pipe.srem("gaol:rooms", room_id)
+        pipe.execute()
+
+    def room_versions(self):
+        room_ids = list(self.redis.smembers("gaol:rooms"))
+        pipe = self.redis.pipeline()
+        for room_id in room_ids:
+            pipe.hget(f"gaol:room:{room_id}", 'version')
+        return {r: int(v) for r, v in zip(room_ids, pipe.execute()) if v is not None}
+
+    def bump_world(self, world_id):
+        return self.redis.hincrby("gaol:world_revisions", world_id, 1)
+
+    def world_revision(self, world_id):
+        return int(self.redis.hget("gaol:world_revisions", world_id) or 0)
+
+#builds the backend named by a GAOL_STATE_BACKEND value
+def open_state_backend(url):
+    url = (url or "local").strip()
+    if url == "local":
+        return LocalStateBackend()
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return SQLiteStateBackend(path)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisStateBackend(url)
+    raise ValueError(f"Unknown state backend '{url}'")
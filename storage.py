@@ -0,0 +1,332 @@
+#jfr
+#This is for persistent storage, to keep disk I/O out of 'app.py'
+#worlds are kept in a sqlite database with one row per piece of lore, so a turn only writes what it changed
+import sqlite3, json, os, threading, tempfile, time
+from classes        import World, name_key
+from concurrency    import KeyedLocks
+
+#the lore lists on a World, these double as the 'kind' column in the entities table
+ENTITY_KINDS = ('groups', 'locations', 'characters', 'biology')
+
+#what the world list needs to know about a world, the same fields as the worlds table
+def world_header_row(w_id, name, setting, realism, description, width, height):
+    return {'id': w_id, 'name': name, 'setting': setting, 'realism': realism, 'description': description, 'width': width, 'height': height}
+
+def world_header(world):
+    return world_header_row(world.id, world.name, world.setting, world.realism, world.description, world.width, world.height)
+
+class WorldStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock() #one connection is shared by every handler and background task
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        #WAL lets readers keep going while a turn is being written, and NORMAL sync is safe under WAL
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS worlds (
+                    id          TEXT PRIMARY KEY,
+                    name        TEXT NOT NULL,
+                    setting     TEXT,
+                    realism     TEXT,
+                    description TEXT,
+                    width       INTEGER,
+                    height      INTEGER
+                )""")
+            #rowid keeps the insertion order of the lore, upserts leave it untouched
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS entities (
+                    world_id    TEXT NOT NULL,
+                    kind        TEXT NOT NULL,
+                    name_key    TEXT NOT NULL,
+                    data        TEXT NOT NULL,
+                    PRIMARY KEY (world_id, kind, name_key)
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    world_id    TEXT NOT NULL,
+                    seq         INTEGER NOT NULL,
+                    data        TEXT NOT NULL,
+                    PRIMARY KEY (world_id, seq)
+                )""")
+            #one-off flags, like whether worlds.json has been imported
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    #true if the legacy worlds.json has been fully imported
+    def json_migrated(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM meta WHERE key = 'worlds_json_migrated'").fetchone() is not None
+
+    #imports the legacy worlds.json layout in one transaction: either every world goes in and the migration is marked
+    #done, or nothing is written and the next boot tries again. Worlds already in the database are left alone,
+    #which also picks up the worlds an interrupted import (before there was a marker) never got to.
+    def migrate_from_json(self, json_path):
+        with open(json_path, 'r') as f:
+            data = json.load(f)
+        with self.lock:
+            existing = {row[0] for row in self.conn.execute("SELECT id FROM worlds")}
+        #build every world before writing anything, one bad world fails the whole import
+        rows = []
+        for w_id, w_data in data.items():
+            if w_id in existing:
+                continue
+            w = World.from_dict(w_data)
+            w.id = w_id
+            rows.append(self._rows(w, full=True))
+        with self.lock, self.conn:
+            for header, entity_rows, event_rows in rows:
+                self._write_rows(header, entity_rows, event_rows, True)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('worlds_json_migrated', ?)", (str(time.time()),))
+        print(f"[STORAGE] Migrated {len(rows)} worlds from {os.path.basename(json_path)} into {os.path.basename(self.db_path)}.")
+        return len(rows)
+
+    #the header row of every world, enough to list them without touching their lore
+    def load_headers(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT id, name, setting, realism, description, width, height FROM worlds ORDER BY rowid").fetchall()
+        return [world_header_row(*row) for row in rows]
+
+    #rebuilds every world from the database
+    def load_worlds(self):
+        with self.lock:
+            headers = self.conn.execute("SELECT id, name, setting, realism, description, width, height FROM worlds ORDER BY rowid").fetchall()
+            entity_rows = self.conn.execute("SELECT world_id, kind, data FROM entities ORDER BY rowid").fetchall()
+            event_rows = self.conn.execute("SELECT world_id, data FROM events ORDER BY world_id, seq").fetchall()
+        return self._build_worlds(headers, entity_rows, event_rows)
+
+    #rebuilds a single world, None if it isn't in the database
+    def load_world(self, world_id):
+        with self.lock:
+            headers = self.conn.execute("SELECT id, name, setting, realism, description, width, height FROM worlds WHERE id = ?", (world_id,)).fetchall()
+            entity_rows = self.conn.execute("SELECT world_id, kind, data FROM entities WHERE world_id = ? ORDER BY rowid", (world_id,)).fetchall()
+            event_rows = self.conn.execute("SELECT world_id, data FROM events WHERE world_id = ? ORDER BY seq", (world_id,)).fetchall()
+        return self._build_worlds(headers, entity_rows, event_rows).get(world_id)
+
+    #groups the rows back into the same shape World.to_dict produces and builds the worlds from them
+    def _build_worlds(self, headers, entity_rows, event_rows):
+        world_data = {}
+        for w_id, name, setting, realism, description, width, height in headers:
+            world_data[w_id] = {
+                'id': w_id, 'name': name, 'setting': setting, 'realism': realism,
+                'description': description, 'width': width, 'height': height,
+                'major_events': [], 'groups': [], 'locations': [], 'characters': [], 'biology': []
+            }
+        for w_id, kind, data in entity_rows:
+            if w_id in world_data:
+                world_data[w_id][kind].append(json.loads(data))
+        for w_id, data in event_rows:
+            if w_id in world_data:
+                world_data[w_id]['major_events'].append(json.loads(data))
+
+        worlds = {}
+        for w_id, w_data in world_data.items():
+            w = World.from_dict(w_data)
+            w.clear_changes() #everything was just read from disk
+            worlds[w_id] = w
+        return worlds
+
+    #writes the parts of a world that have changed since its last save (or everything if full=True)
+    def save_world(self, world, full=False):
+        if not full and not world.has_changes():
+            return False
+        #take the change set up front, anything modified while we write will be picked up by the next save
+        dirty, world.dirty = world.dirty, set()
+        header_dirty, world.header_dirty = world.header_dirty, False
+        events_dirty, world.events_dirty = world.events_dirty, False
+        try:
+            #serialize outside the lock, only the changed entities are converted
+            header, entity_rows, event_rows = self._rows(world, full, dirty, events_dirty)
+            with self.lock, self.conn:
+                self._write_rows(header, entity_rows, event_rows, full or header_dirty)
+        except Exception:
+            #put the changes back so nothing is lost, the next save will retry them
+            world.dirty |= dirty
+            world.header_dirty = world.header_dirty or header_dirty
+            world.events_dirty = world.events_dirty or events_dirty
+            raise
+        return True
+
+    #the rows a save writes: the header, the changed entities and (if they changed) the events
+    def _rows(self, world, full, dirty=(), events_dirty=False):
+        header = (world.id, world.name, world.setting, world.realism, world.description, world.width, world.height)
+        entity_rows = []
+        for kind in ENTITY_KINDS:
+            if full:
+                changed = getattr(world, kind)
+            else:
+                changed = [world.find(kind, key) for k, key in dirty if k == kind]
+            for entity in changed:
+                if entity is not None:
+                    entity_rows.append((world.id, kind, name_key(entity.name), json.dumps(entity.to_dict())))
+        event_rows = None
+        if full or events_dirty:
+            event_rows = [(world.id, seq, json.dumps(evt)) for seq, evt in enumerate(world.major_events)]
+        return header, entity_rows, event_rows
+
+    #runs inside the caller's transaction, with self.lock held
+    def _write_rows(self, header, entity_rows, event_rows, write_header):
+        if write_header:
+            self.conn.execute("""
+                INSERT INTO worlds (id, name, setting, realism, description, width, height) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET name=excluded.name, setting=excluded.setting, realism=excluded.realism,
+                    description=excluded.description, width=excluded.width, height=excluded.height
+            """, header)
+        if entity_rows:
+            self.conn.executemany("""
+                INSERT INTO entities (world_id, kind, name_key, data) VALUES (?, ?, ?, ?)
+                ON CONFLICT(world_id, kind, name_key) DO UPDATE SET data=excluded.data
+            """, entity_rows)
+        #events are capped at 20 per world, so they are simply replaced as a block
+        if event_rows is not None:
+            self.conn.execute("DELETE FROM events WHERE world_id = ?", (header[0],))
+            self.conn.executemany("INSERT INTO events (world_id, seq, data) VALUES (?, ?, ?)", event_rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# WorldRegistry class
+# Every known world by id. On startup only the headers are read, a world's lore is loaded from the
+# WorldStore the first time something asks for the World itself (a room joining or generating in it).
+# Reads like a dict of id -> World: `in`, len() and iteration only use the headers, [] and get() load the world.
+class WorldRegistry:
+    def __init__(self, store):
+        self.store = store
+        self.headers = {}       #world id -> header dict, for every world
+        self.loaded = {}        #world id -> World, for the worlds that have been loaded
+        self.load_lock = threading.Lock()
+        self.locks = KeyedLocks()   #world id -> RLock, held while a world's lore is changed, saved or read in bulk
+
+    #reads the header of every world in the store, called on startup
+    def load_headers(self):
+        with self.load_lock:
+            for header in self.store.load_headers():
+                self.headers.setdefault(header['id'], header)
+        return len(self.headers)
+
+    def __contains__(self, world_id):
+        return world_id in self.headers
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __iter__(self):
+        return iter(list(self.headers))
+
+    def keys(self):
+        return list(self.headers)
+
+    def __getitem__(self, world_id):
+        world = self.get(world_id)
+        if world is None:
+            raise KeyError(world_id)
+        return world
+
+    #the World, loaded from the store if this is the first time it's used
+    def get(self, world_id, default=None):
+        world = self.loaded.get(world_id)
+        if world is not None:
+            return world
+        if world_id not in self.headers:
+            return default
+        with self.load_lock:
+            world = self.loaded.get(world_id) #someone may have loaded it while we waited
+            if world is None:
+                start = time.perf_counter()
+                world = self.store.load_world(world_id)
+                if world is None:
+                    return default
+                self.loaded[world_id] = world
+                print(f"[STORAGE] Loaded world {world.name} ({world_id}) in {(time.perf_counter() - start) * 1000:.1f}ms.")
+        return world
+
+    def __setitem__(self, world_id, world):
+        with self.load_lock:
+            self.loaded[world_id] = world
+            self.headers[world_id] = world_header(world)
+
+    #the lock to hold while changing a world, or reading it in a way a concurrent change could break (lore scoring, snapshots)
+    def lock(self, world_id):
+        return self.locks.hold(world_id)
+
+    #the World if it has been loaded already, never touches the store
+    def peek(self, world_id):
+        return self.loaded.get(world_id)
+
+    #the header of one world, kept up to date with the World once it's loaded
+    def header(self, world_id):
+        world = self.loaded.get(world_id)
+        if world is not None:
+            return world_header(world)
+        return self.headers.get(world_id)
+
+    #every header in the order the worlds were created
+    def all_headers(self):
+        return [self.header(world_id) for world_id in list(self.headers)]
+
+    #the loaded worlds, the only ones that can have unsaved changes
+    def hydrated(self):
+        return list(self.loaded.values())
+
+#writes json to a temp file next to the target and renames it into place,
+#so a crash mid-write can never leave a half written file behind
+def write_json_atomic(path, data):
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# WriteBehindScheduler class
+# Handlers only mark what is dirty, a background loop coalesces everything marked since the last flush
+# and writes it in one batch. A join storm that marks the same room fifty times costs a single write.
+class WriteBehindScheduler:
+    ALL = None #marker for "everything of this kind is dirty"
+
+    def __init__(self, writers, interval=2.0):
+        self.writers = writers          #{'name': fn(keys)}, keys is a set of ids, or None for everything
+        self.interval = interval        #max seconds between a change and it reaching disk
+        self.pending = {}               #{'name': set of keys or ALL}
+        self.lock = threading.Lock()    #guards pending
+        self.flush_lock = threading.Lock() #only one flush at a time (background loop vs shutdown)
+
+    #flags something as needing a save, key=None marks every entry of that kind
+    def mark_dirty(self, name, key=None):
+        with self.lock:
+            if key is None:
+                self.pending[name] = self.ALL
+            elif name not in self.pending:
+                self.pending[name] = {key}
+            elif self.pending[name] is not self.ALL:
+                self.pending[name].add(key)
+
+    #writes everything that is currently dirty
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            for name, keys in batch.items():
+                try:
+                    self.writers[name](keys)
+                except Exception as e:
+                    print(f"[STORAGE ERROR] Failed to write {name}: {e}")
+                    #requeue so the next flush tries again
+                    if keys is self.ALL:
+                        self.mark_dirty(name)
+                    else:
+                        for key in keys:
+                            self.mark_dirty(name, key)
+
+    #background loop, sleep_fn lets the caller pass a cooperative sleep (socketio.sleep)
+    def run(self, sleep_fn=time.sleep):
+        while True:
+            sleep_fn(self.interval)
+            self.flush()
@@ -0,0 +1,58 @@
+#jfr
+#deadlines for things that expire later, like the grace period of a disconnected player.
+#entries go on a heap ordered by deadline, so checking for expirations only looks at the front of it
+#and costs nothing for the rooms where nobody is waiting to time out.
+import heapq, itertools, threading
+
+# ExpiryHeap class
+# schedule() and cancel() by key, pop_due() hands back the keys whose deadline has passed.
+# Cancelled or rescheduled entries stay in the heap and are skipped when they reach the front.
+class ExpiryHeap:
+    def __init__(self):
+        self.heap = []              #(deadline, seq, key), may hold stale entries
+        self.deadlines = {}         #key -> its current deadline, the only entries that count
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    #sets (or moves) the deadline of a key
+    def schedule(self, key, deadline):
+        with self.lock:
+            self.deadlines[key] = deadline
+            heapq.heappush(self.heap, (deadline, next(self.counter), key))
+            #rejoins leave stale entries behind, rebuild once they outnumber the live ones
+            if len(self.heap) > 2 * len(self.deadlines) + 64:
+                self.heap = [(d, next(self.counter), k) for k, d in self.deadlines.items()]
+                heapq.heapify(self.heap)
+
+    def cancel(self, key):
+        with self.lock:
+            self.deadlines.pop(key, None)
+
+    #the earliest live deadline, None if nothing is scheduled
+    def next_deadline(self):
+        with self.lock:
+            self._drop_stale()
+            return self.heap[0][0] if self.heap else None
+
+    #removes and returns every key whose deadline is at or before now, earliest first
+    def pop_due(self, now):
+        due = []
+        with self.lock:
+            self._drop_stale()
+            while self.heap and self.heap[0][0] <= now:
+                deadline, _, key = heapq.heappop(self.heap)
+                if self.deadlines.get(key) == deadline:
+                    del self.deadlines[key]
+                    due.append(key)
+                self._drop_stale()
+        return due
+
+    def _drop_stale(self):
+        while self.heap and self.deadlines.get(self.heap[0][2]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
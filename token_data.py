@@ -1,12 +1,210 @@
 #jfr
 #this file will be used for analyzing and calculating token usage.
-import json
+#it streams the token audit log (including rotated files) and prints rollups per world, model, party size and hour of day.
+#history summaries are background calls rather than turns, they get their own totals and stay out of the turn statistics.
+#usage: python token_data.py [--file data/token_audit.jsonl] [--by world,model,players,hour] [--json]
+import json, os, glob, time, argparse
+import numpy as np
 
-def return_token_usage(token_audit):
-    data = json.load(token_audit)
-    for index, dat in enumerate(data):
-        print(dat["input"], dat["output"], dat["total"])
+TPM_LIMIT = 1000000        #tokens per minute, the same figure generate_ai_response prints against
+BATCH_SIZE = 50000         #records are parsed into numpy columns this many at a time
+PERCENTILES = (50, 95, 99)
+DIMENSIONS = {             #rollup name -> how the group label is read from a record
+    'world': lambda r: r.get('world') or 'Unknown',
+    'model': lambda r: r.get('ai_model') or 'Unknown',
+    'players': lambda r: str(r.get('player_count', '?')),
+    'hour': None           #derived from the timestamp column
+}
+
+#every audit file in the order it was written: oldest rotation first, then the active log
+def audit_files(path):
+    rotated = []
+    for f in glob.glob(path + '.*'):
+        suffix = f.rsplit('.', 1)[-1]
+        if suffix.isdigit():
+            rotated.append((int(suffix), f))
+    files = [f for _, f in sorted(rotated, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    #the old single-list audit file, from before the log was append-only
+    legacy = os.path.splitext(path)[0] + '.json'
+    if os.path.exists(legacy):
+        files.insert(0, legacy)
+    return files
+
+#yields one record at a time without loading the files into memory
+def stream_records(files):
+    for f_path in files:
+        with open(f_path, 'r') as f:
+            if f_path.endswith('.json'):
+                try:
+                    yield from json.load(f)
+                except json.JSONDecodeError:
+                    print(f"[WARN] Skipping unreadable legacy audit {f_path}")
+                continue
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue #a torn last line from a crash, skip it
+
+#the epoch time of a record, legacy records only have the formatted timestamp
+def record_time(r):
+    if 'ts' in r:
+        return r['ts']
+    try:
+        return time.mktime(time.strptime(r['timestamp'], "%Y-%m-%d %H:%M:%S"))
+    except (KeyError, ValueError):
+        return 0.0
+
+#reads the records into column arrays, BATCH_SIZE rows at a time
+def load_columns(files, dimensions):
+    inputs, outputs, stamps, estimates = [], [], [], []
+    labels = {d: [] for d in dimensions if DIMENSIONS[d]}
+    batch = []
+    failed = 0
+    summaries = {'calls': 0, 'input_total': 0, 'output_total': 0}
+
+    def flush_batch():
+        inputs.append(np.fromiter((r.get('input') or 0 for r in batch), dtype=np.int64, count=len(batch)))
+        outputs.append(np.fromiter((r.get('output') or 0 for r in batch), dtype=np.int64, count=len(batch)))
+        stamps.append(np.fromiter((record_time(r) for r in batch), dtype=np.float64, count=len(batch)))
+        estimates.append(np.fromiter((r.get('estimated_input') or 0 for r in batch), dtype=np.int64, count=len(batch)))
+        for d in labels:
+            labels[d].extend(DIMENSIONS[d](r) for r in batch)
+        batch.clear()
+
+    for r in stream_records(files):
+        #failed or skipped attempts carry no token counts, they're only counted
+        if r.get('outcome', 'ok') != 'ok':
+            failed += 1
+            continue
+        if r.get('kind') == 'summary':
+            summaries['calls'] += 1
+            summaries['input_total'] += r.get('input') or 0
+            summaries['output_total'] += r.get('output') or 0
+            continue
+        batch.append(r)
+        if len(batch) >= BATCH_SIZE:
+            flush_batch()
+    if batch:
+        flush_batch()
+    if not inputs:
+        return None
+    columns = {
+        'input': np.concatenate(inputs),
+        'output': np.concatenate(outputs),
+        'ts': np.concatenate(stamps),
+        'estimated': np.concatenate(estimates),
+        'failed_attempts': failed,
+        'summaries': summaries
+    }
+    for d, values in labels.items():
+        columns[d] = np.array(values, dtype=object)
+    if 'hour' in dimensions:
+        columns['hour'] = np.array([f"{time.localtime(t).tm_hour:02d}:00" for t in columns['ts']], dtype=object)
+    return columns
+
+#peak and p95 tokens in any single minute, used for the TPM headroom
+def minute_load(tokens, stamps):
+    minutes = (stamps // 60).astype(np.int64)
+    _, inverse = np.unique(minutes, return_inverse=True)
+    per_minute = np.bincount(inverse, weights=tokens)
+    return float(per_minute.max()), float(np.percentile(per_minute, 95))
+
+#groups every column by the label column and computes the stats for each group in one pass
+def rollup(columns, dimension):
+    keys, inverse = np.unique(columns[dimension], return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(keys)))[:-1]
+    in_groups = np.split(columns['input'][order], bounds)
+    out_groups = np.split(columns['output'][order], bounds)
+    ts_groups = np.split(columns['ts'][order], bounds)
+
+    rows = []
+    for key, inp, out, ts in zip(keys, in_groups, out_groups, ts_groups):
+        peak, p95_minute = minute_load(inp, ts)
+        row = {
+            dimension: key,
+            'turns': int(len(inp)),
+            'input_total': int(inp.sum()),
+            'output_total': int(out.sum()),
+            'peak_tpm': int(peak),
+            'p95_tpm': int(p95_minute),
+            'tpm_headroom_pct': round((1 - peak / TPM_LIMIT) * 100, 2)
+        }
+        for name, values in (('input', inp), ('output', out)):
+            for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                row[f'{name}_p{p}'] = int(v)
+        rows.append(row)
+    rows.sort(key=lambda r: r['turns'], reverse=True)
+    return rows
+
+def print_table(title, rows):
+    print(f"\n=== {title} ===")
+    if not rows:
+        print("(no data)")
+        return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in rows:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+
+#summarizes the audit log, returns {'overall': {...}, 'world': [...], ...}
+def return_token_usage(path, dimensions=tuple(DIMENSIONS)):
+    columns = load_columns(audit_files(path), dimensions)
+    if columns is None:
+        return None
+    peak, p95_minute = minute_load(columns['input'], columns['ts'])
+    report = {
+        'overall': {
+            'turns': int(len(columns['input'])),
+            'input_total': int(columns['input'].sum()),
+            'output_total': int(columns['output'].sum()),
+            'input_p50/p95/p99': [int(v) for v in np.percentile(columns['input'], PERCENTILES)],
+            'output_p50/p95/p99': [int(v) for v in np.percentile(columns['output'], PERCENTILES)],
+            'peak_tpm': int(peak),
+            'p95_tpm': int(p95_minute),
+            'tpm_headroom_pct': round((1 - peak / TPM_LIMIT) * 100, 2),
+            'failed_attempts': columns['failed_attempts']
+        },
+        'summaries': columns['summaries']
+    }
+    #how closely the prompt packer's local estimate tracks the real prompt_token_count (1.0 is spot on)
+    has_estimate = columns['estimated'] > 0
+    if has_estimate.any():
+        ratio = columns['input'][has_estimate] / columns['estimated'][has_estimate]
+        report['overall']['actual/estimate_p50/p95'] = [round(float(v), 2) for v in np.percentile(ratio, (50, 95))]
+    for d in dimensions:
+        report[d] = rollup(columns, d)
+    return report
 
 if __name__ == "__main__":
-    with open("data/token_audit.json", "r") as f:
-        return_token_usage(f)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Summarize GAOL token usage from the audit log.")
+    parser.add_argument('--file', default=os.path.join('data', 'token_audit.jsonl'), help="active audit log (rotated files are found automatically)")
+    parser.add_argument('--by', default=','.join(DIMENSIONS), help="comma separated rollups: " + ", ".join(DIMENSIONS))
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    dims = tuple(d.strip() for d in args.by.split(',') if d.strip())
+    unknown = [d for d in dims if d not in DIMENSIONS]
+    if unknown:
+        parser.error(f"unknown rollup(s): {', '.join(unknown)}")
+
+    start = time.time()
+    report = return_token_usage(args.file, dims)
+    if report is None:
+        print(f"No audit records found at {args.file}")
+    elif args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"TPM limit used for headroom: {TPM_LIMIT:,} (input tokens per minute)")
+        print_table("OVERALL", [report['overall']])
+        print_table("HISTORY SUMMARIES", [report['summaries']])
+        for d in dims:
+            print_table(f"BY {d.upper()}", report[d])
+        print(f"\nSummarized {report['overall']['turns']:,} turns in {time.time() - start:.2f}s")